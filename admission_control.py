@@ -0,0 +1,240 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import add_stage_listener, counter, gauge_callback
+
+# =========================================================
+# التحكم في القبول وتخفيف الحمل (Admission control / Load shedding)
+#
+# تحت موجات الطلبات يقبل الخادم كل شيء فيزداد الزمن بلا حد. هنا يُقدَّر زمن الطلب
+# الجديد من الأعمال الجارية ومتوسط الزمن الأخير (EWMA)، وتُخفَّض جودة الخدمة
+# تدريجياً قبل الرفض للبقاء تحت الزمن المستهدف:
+#   0 full        تحليل كامل
+#   1 no_visuals  التقارير بدون Grad-CAM (لا تنافس النموذج على الاستدلال)
+#   2 no_cnn      التحليل بدون مرحلة CNN (PRNU و ELA والنسخ واللصق فقط)
+#   3 rejected    503 مع Retry-After
+# إضافة إلى حد لكل عميل (Token bucket) يرد بـ 429.
+# =========================================================
+
+LEVEL_FULL, LEVEL_NO_VISUALS, LEVEL_NO_CNN, LEVEL_REJECTED = range(4)
+LEVEL_NAMES = ('full', 'no_visuals', 'no_cnn', 'rejected')
+
+# الزمن المستهدف للتحليل بالثواني (p99)؛ 0 = تعطيل التخفيض (كل الطلبات تُقبل كاملة)
+ADMISSION_TARGET_SECONDS = float(os.environ.get('SIDQ_ADMISSION_TARGET_SECONDS', '5'))
+# إسقاط الصور التوضيحية يبدأ عند هذه النسبة من الزمن المستهدف (هامش قبل إسقاط CNN)
+ADMISSION_VISUALS_AT = float(os.environ.get('SIDQ_ADMISSION_VISUALS_AT', '0.8'))
+# عدد التحليلات التي تعمل معاً في العملية دون أن يبطئ بعضها بعضاً
+ADMISSION_CAPACITY = int(os.environ.get('SIDQ_ADMISSION_CAPACITY', '2'))
+# حد صارم للتحليلات الجارية أو المنتظرة في العملية
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('SIDQ_ADMISSION_MAX_IN_FLIGHT', '32'))
+# وزن العينة الجديدة في المتوسط المتحرك الأسي
+ADMISSION_EWMA_ALPHA = float(os.environ.get('SIDQ_ADMISSION_EWMA_ALPHA', '0.2'))
+# تحت السعة يُقبل طلب كامل واحد على الأقل كل هذه المدة (ثوانٍ) لتجديد تقدير الزمن الكامل،
+# وإلا يبقى التقدير عالقاً عند آخر عينة بطيئة (تحميل النموذج أو رفع كبير)
+ADMISSION_PROBE_SECONDS = float(os.environ.get('SIDQ_ADMISSION_PROBE_SECONDS', '5'))
+
+# حد كل عميل: طلبات في الثانية وحجم الدفعة؛ 0 = بدون حد (الافتراضي، خلف وكيل
+# يظهر كل العملاء بعنوان واحد ما لم تُحدد SIDQ_ADMISSION_CLIENT_HEADER)
+ADMISSION_RATE = float(os.environ.get('SIDQ_ADMISSION_RATE', '0'))
+ADMISSION_BURST = float(os.environ.get('SIDQ_ADMISSION_BURST', '10'))
+# ترويسة تعرّف العميل (مثلاً X-Forwarded-For أو مفتاح الجهة)، وإلا عنوان الاتصال
+ADMISSION_CLIENT_HEADER = os.environ.get('SIDQ_ADMISSION_CLIENT_HEADER', '')
+# أقصى عدد عملاء محفوظين (الأقدم استخداماً يُحذف أولاً)
+ADMISSION_MAX_CLIENTS = 10000
+
+ADMISSIONS = counter('sidq_admissions_total', 'Analysis requests by admission decision.', ['level'])
+
+
+class AdmissionRejected(Exception):
+    """رُفض الطلب: status_code هو 429 (حد العميل) أو 503 (ضغط الخادم)."""
+
+    def __init__(self, status_code, retry_after, level, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.level = level
+
+
+class AdmissionController:
+    """
+    يقرر مستوى الخدمة لكل طلب تحليل من الأعمال الجارية والزمن الأخير.
+
+    الزمن المتوقع لطلب جديد = متوسط زمن التحليل (لكل نمط) × max(1, (الجاري + 1) / السعة)،
+    ويُختار أدنى مستوى يبقى تحت الزمن المستهدف. العملية الخاملة تقبل الطلب كاملاً دائماً،
+    وتحت السعة يُمرَّر طلب كامل (probe) كل probe_seconds، فيتجدد تقدير الزمن الكامل
+    ويعود الخادم إلى الخدمة الكاملة بعد زوال الضغط.
+    """
+
+    def __init__(self, target_seconds=ADMISSION_TARGET_SECONDS, capacity=ADMISSION_CAPACITY,
+                 max_in_flight=ADMISSION_MAX_IN_FLIGHT, visuals_at=ADMISSION_VISUALS_AT,
+                 rate=ADMISSION_RATE, burst=ADMISSION_BURST, alpha=ADMISSION_EWMA_ALPHA,
+                 max_clients=ADMISSION_MAX_CLIENTS, probe_seconds=ADMISSION_PROBE_SECONDS):
+        self.target_seconds = target_seconds
+        self.capacity = max(1, capacity)
+        self.max_in_flight = max(1, max_in_flight)
+        self.visuals_at = visuals_at
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.alpha = alpha
+        self.max_clients = max_clients
+        self.probe_seconds = probe_seconds
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # وقت آخر عينة كاملة، وهل يوجد طلب تجريبي جارٍ
+        self._full_sampled_at = time.monotonic()
+        self._probing = False
+        # متوسط زمن التحليل كاملاً لكل نمط ('full' أو 'no_cnn')، ولكل مرحلة
+        self._latency = {}
+        self._stage_latency = {}
+        # العميل -> (الرصيد، وقت آخر تحديث)
+        self._buckets = OrderedDict()
+
+    # ----------------------------------------------------
+    # تقدير الزمن
+    # ----------------------------------------------------
+
+    def _update(self, table, key, elapsed):
+        previous = table.get(key)
+        table[key] = elapsed if previous is None else previous + self.alpha * (elapsed - previous)
+
+    def observe_stage(self, stage, elapsed):
+        with self._lock:
+            self._update(self._stage_latency, stage, elapsed)
+
+    def _expected(self, mode):
+        full = self._latency.get('full', 0.0)
+        if mode == 'full':
+            return full
+        if 'no_cnn' in self._latency:
+            return self._latency['no_cnn']
+        # لا توجد عينات بدون CNN بعد: زمن التحليل الكامل ناقص زمن التنبؤ (يشمل انتظار الدفعة)
+        return max(0.0, full - self._stage_latency.get('predict', 0.0))
+
+    def _level(self):
+        if self.target_seconds <= 0:
+            return LEVEL_FULL
+        if self._in_flight == 0:
+            return LEVEL_FULL
+        if self._in_flight >= self.max_in_flight:
+            return LEVEL_REJECTED
+        queueing = max(1.0, (self._in_flight + 1) / self.capacity)
+        expected_full = self._expected('full') * queueing
+        if expected_full <= self.visuals_at * self.target_seconds:
+            return LEVEL_FULL
+        if expected_full <= self.target_seconds:
+            return LEVEL_NO_VISUALS
+        if self._expected('no_cnn') * queueing <= self.target_seconds:
+            return LEVEL_NO_CNN
+        return LEVEL_REJECTED
+
+    def current_level(self):
+        """مستوى الخدمة الحالي (للتقارير والصور التوضيحية التي لا تمر بـ admit)."""
+        with self._lock:
+            return self._level()
+
+    def _retry_after(self):
+        # تقريباً زمن تفريغ الأعمال الجارية
+        expected = self._expected('no_cnn') or self._expected('full') or 1.0
+        return max(1, math.ceil(expected * self._in_flight / self.capacity))
+
+    # ----------------------------------------------------
+    # حد كل عميل (Token bucket)
+    # ----------------------------------------------------
+
+    def _take_token(self, client, now):
+        """يُرجع 0 إذا أُخذ رصيد، وإلا عدد الثواني حتى يتوفر رصيد."""
+        if self.rate <= 0 or client is None:
+            return 0
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1.0:
+            tokens -= 1.0
+            wait = 0
+        else:
+            wait = max(1, math.ceil((1.0 - tokens) / self.rate))
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+    # ----------------------------------------------------
+    # القبول
+    # ----------------------------------------------------
+
+    @contextmanager
+    def admit(self, client=None, record_latency=True):
+        """
+        قبول طلب تحليل وإرجاع مستواه (0..2) طوال تنفيذه، أو رفع AdmissionRejected.
+        زمن الكتلة يُسجَّل في متوسط النمط المنفذ ('no_cnn' أو 'full')، إلا مع
+        record_latency=False (الكتلة ترسل العمل إلى مكان آخر، مثل طابور المهام).
+        """
+        with self._lock:
+            level = self._level()
+            if level == LEVEL_REJECTED:
+                ADMISSIONS.inc(level=LEVEL_NAMES[level])
+                raise AdmissionRejected(
+                    503, self._retry_after(), level, 'الخادم مشغول حالياً، يرجى إعادة المحاولة لاحقاً.')
+            start = time.monotonic()
+            wait = self._take_token(client, start)
+            if wait:
+                ADMISSIONS.inc(level='rate_limited')
+                raise AdmissionRejected(429, wait, level, 'تم تجاوز حد الطلبات المسموح، يرجى إعادة المحاولة لاحقاً.')
+            # بدون عينات كاملة حديثة وتحت السعة: طلب تجريبي كامل واحد في كل مرة
+            probe = (
+                record_latency and level == LEVEL_NO_CNN and not self._probing and self._in_flight < self.capacity
+                and start - self._full_sampled_at >= self.probe_seconds
+            )
+            if probe:
+                level = LEVEL_FULL
+                self._probing = True
+            self._in_flight += 1
+        ADMISSIONS.inc(level=LEVEL_NAMES[level])
+
+        completed = False
+        try:
+            yield level
+            completed = True
+        finally:
+            now = time.monotonic()
+            with self._lock:
+                self._in_flight -= 1
+                if probe:
+                    self._probing = False
+                # الطلبات الفاشلة لا تمثل زمن التحليل
+                if not completed or not record_latency:
+                    pass
+                elif level >= LEVEL_NO_CNN:
+                    self._update(self._latency, 'no_cnn', now - start)
+                else:
+                    self._update(self._latency, 'full', now - start)
+                    self._full_sampled_at = now
+
+    def stats(self):
+        with self._lock:
+            return {
+                'level': LEVEL_NAMES[self._level()],
+                'in_flight': self._in_flight,
+                'target_seconds': self.target_seconds,
+                'latency_seconds': dict(self._latency),
+                'stage_latency_seconds': dict(self._stage_latency),
+                'clients': len(self._buckets),
+            }
+
+
+def create_admission_controller():
+    """المتحكم بإعدادات SIDQ_ADMISSION_* مع تسجيل زمن المراحل ومقاييسه."""
+    controller = AdmissionController()
+    add_stage_listener(controller.observe_stage)
+    gauge_callback(
+        'sidq_admission_level', 'Current degradation level (0 full .. 3 rejecting).',
+        lambda: {(): controller.current_level()},
+    )
+    gauge_callback(
+        'sidq_admission_in_flight', 'Analyses admitted and not yet finished.',
+        lambda: {(): controller.stats()['in_flight']},
+    )
+    return controller
@@ -1,28 +1,47 @@
-import tensorflow as tf
-from tensorflow.keras.models import Sequential, load_model
-from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense
-from tensorflow.keras.optimizers import Adam 
 import numpy as np
-from PIL import Image, ImageChops # ImageChops ضرورية لـ ELA
+from PIL import Image
 import io
-import cv2
+import os
+import threading
 import base64 
-from tf_keras_vis.gradcam import Gradcam 
-from tf_keras_vis.utils.model_modifiers import ReplaceToLinear 
-from tf_keras_vis.utils import normalize 
+from functools import partial
+from image_context import EXIF_MISSING, load_image_context, read_image_bytes
+from stage_scheduler import run_stages
+from cascade_scoring import CASCADE_ENABLED, STAGE_WEIGHTS, cascade_version, combine_scores, run_cascade
+from batch_inference import MicroBatcher
+from result_cache import create_result_cache
+import ela_analysis
+from ela_analysis import ELA_QUALITY, ELA_SCALE_FACTOR, compute_ela
+import copy_move
+from copy_move import detect_copy_move
+from prnu_fingerprints import create_fingerprint_db
+from inference_backends import INFERENCE_BACKEND, load_inference_backend
+from model_stamp import check_model_stamp
+from phash_index import create_phash_index, perceptual_hash, phash_version
+from metrics import IMAGE_BYTES, IMAGE_PIXELS, gauge_callback, stage_timer, timed
+
+# ملاحظة: TensorFlow لا يُستورد هنا؛ يُحمَّل عند أول حاجة للنموذج أو في خيط
+# التسخين (warm-up)، حتى يبقى استيراد التطبيق وفحوص الصحة سريعة.
 
 # الاستيراد من ملف تحليل الضوضاء
 try:
     from prnu_analysis import extract_noise_pattern
+    import prnu_analysis
 except ImportError:
+    prnu_analysis = None
     print("WARNING: فشل استيراد prnu_analysis. التحليل سيعتمد على AI و ELA فقط.")
-    def extract_noise_pattern(image_stream):
+    def extract_noise_pattern(image_context, include_visuals=True):
         # محاكاة لـ PRNU في حالة الفشل
-        return "❌ محاكاة: تحليل PRNU غير متوفر", 0.0, None
+        return "❌ محاكاة: تحليل PRNU غير متوفر", 0.0, None, None
+
+extract_noise_pattern = timed('prnu')(extract_noise_pattern)
 
 # حجم الصورة الذي يتطلبه النموذج 
 IMG_SIZE = 128
 MODEL_PATH = 'forensics_model.h5'
+# أصغر بُعد لفك ترميز JPEG المصغّر قبل التحجيم إلى IMG_SIZE (ضعف المدخل،
+# فيبقى التحجيم الأخير بمرشح كامل بدلاً من الاعتماد على مقياس DCT وحده)
+CNN_DECODE_MIN_SIZE = 2 * IMG_SIZE
 
 # =========================================================
 # 1. تعريف النموذج وتحميله
@@ -30,6 +49,9 @@ MODEL_PATH = 'forensics_model.h5'
 
 # (بناء النموذج كما هو في ملفك، مع التأكد من وجود forensics_model.h5)
 def build_forensics_model():
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense
+
     model = Sequential([
         Conv2D(32, (3, 3), activation='relu', input_shape=(IMG_SIZE, IMG_SIZE, 3)),
         MaxPooling2D((2, 2)),
@@ -43,54 +65,288 @@ def build_forensics_model():
     ])
     return model
 
-try:
-    LOADED_MODEL = load_model(MODEL_PATH)
-    # 🌟🌟🌟 الإصلاح 1: إضافة اسم الإخراج للنموذج المحمّل 🌟🌟🌟
-    if not LOADED_MODEL.output_names:
-        LOADED_MODEL.output_names = ['output_1']
-        
-    print(f"✅ نجاح: تم تحميل نموذج AI من {MODEL_PATH}")
-except Exception as e:
-# ... (بقية منطق التحميل يبقى كما هو) ...
-    print(f"❌ فشل تحميل نموذج AI: {e}. سيتم إيقاف التحليل الذكي.")
-    LOADED_MODEL = None
+
+# حالة النموذج: cold (لم يُحمّل) ← loading ← ready أو failed
+LOADED_MODEL = None
+# محرك الاستدلال الفعلي (SIDQ_INFERENCE_BACKEND، أو keras عند تعذر تحميل البديل)
+MODEL_BACKEND = INFERENCE_BACKEND
+PREDICTOR = None
+EXPLAINER = None
+MODEL_STATE = 'cold'
+# نتيجة التحقق من بصمة إصدار النموذج (تكتبها train_and_save_model.py)
+MODEL_STAMP_STATUS = None
+_model_lock = threading.Lock()
+_model_ready = threading.Event()
+
+
+def _predict_batch(batch):
+    """تمريرة أمامية واحدة لدفعة كاملة من الصور (N, IMG_SIZE, IMG_SIZE, 3)."""
+    if MODEL_BACKEND == 'keras':
+        return LOADED_MODEL.predict_on_batch(batch)[:, 0]
+    return LOADED_MODEL.predict_batch(batch)
+
+
+def load_forensics_model(warm_inference=True):
+    """
+    تحميل النموذج (Keras، أو المحرك البديل حسب SIDQ_INFERENCE_BACKEND)
+    وبناء طابور الاستدلال ومفسّر Grad-CAM (مرة واحدة).
+    warm_inference=True ينفذ تمريرة وهمية لتجهيز الرسم البياني قبل أول طلب حقيقي.
+    آمنة للاستدعاء من عدة خيوط؛ الاستدعاءات اللاحقة تعود فوراً.
+    """
+    global LOADED_MODEL, MODEL_BACKEND, PREDICTOR, EXPLAINER, MODEL_STATE
+    with _model_lock:
+        if MODEL_STATE in ('ready', 'failed'):
+            return LOADED_MODEL
+        MODEL_STATE = 'loading'
+        _check_model_stamp()
+
+        if INFERENCE_BACKEND != 'keras':
+            try:
+                backend = load_inference_backend(INFERENCE_BACKEND, MODEL_PATH)
+            except Exception as e:
+                print(f"WARNING: تعذر تحميل محرك الاستدلال {INFERENCE_BACKEND}: {e}. سيتم استخدام Keras.")
+                MODEL_BACKEND = 'keras'
+            else:
+                LOADED_MODEL = backend
+                MODEL_BACKEND = backend.version
+                print(f"✅ نجاح: تم تحميل محرك الاستدلال {MODEL_BACKEND}")
+                return _finish_loading(backend.explain_batch, warm_inference)
+
+        try:
+            from tensorflow.keras.models import load_model
+            model = load_model(MODEL_PATH)
+            # 🌟🌟🌟 الإصلاح 1: إضافة اسم الإخراج للنموذج المحمّل 🌟🌟🌟
+            if not model.output_names:
+                model.output_names = ['output_1']
+                
+            print(f"✅ نجاح: تم تحميل نموذج AI من {MODEL_PATH}")
+        except Exception as e:
+        # ... (بقية منطق التحميل يبقى كما هو) ...
+            print(f"❌ فشل تحميل نموذج AI: {e}. سيتم إيقاف التحليل الذكي.")
+            MODEL_STATE = 'failed'
+            _model_ready.set()
+            return None
+
+        LOADED_MODEL = model
+        MODEL_BACKEND = 'keras'
+        # مفسّر Grad-CAM يُبنى مرة واحدة ويُشارك بين جميع الطلبات (مع تجميع الدفعات)
+        try:
+            from gradcam_explainer import GradcamExplainer
+            explain_batch = GradcamExplainer(model).explain_batch
+        except Exception as e:
+            print(f"WARNING: فشل بناء مفسّر Grad-CAM: {e}. سيتم تخطي خرائط التفسير.")
+            explain_batch = None
+        return _finish_loading(explain_batch, warm_inference)
+
+
+def _check_model_stamp():
+    # تحذير فقط: النماذج القديمة بدون بصمة تبقى قابلة للاستخدام
+    global MODEL_STAMP_STATUS
+    stamp, problems = check_model_stamp(MODEL_PATH, IMG_SIZE)
+    for problem in problems:
+        print(f"WARNING: بصمة النموذج: {problem}")
+    MODEL_STAMP_STATUS = {
+        'ok': not problems,
+        'trained_at': stamp.get('trained_at') if stamp else None,
+        'mode': stamp.get('mode') if stamp else None,
+        'problems': problems,
+    }
+
+
+def _finish_loading(explain_batch, warm_inference):
+    # يُستدعى من load_forensics_model مع الاحتفاظ بـ _model_lock
+    global PREDICTOR, EXPLAINER, MODEL_STATE
+    # طابور الاستدلال المجمّع: يجمع الطلبات المتزامنة في تمريرة واحدة
+    PREDICTOR = MicroBatcher(_predict_batch, name='cnn-predict')
+    if explain_batch is not None:
+        EXPLAINER = MicroBatcher(explain_batch, name='gradcam')
+    elif MODEL_BACKEND != 'keras':
+        print("WARNING: لا توجد أوزان numpy لحساب Grad-CAM. سيتم تخطي خرائط التفسير.")
+
+    if warm_inference:
+        _run_warm_up_pass()
+
+    MODEL_STATE = 'ready'
+    _model_ready.set()
+    return LOADED_MODEL
+
+
+def _run_warm_up_pass():
+    # تمريرة وهمية مباشرة (بدون خيوط الطوابير) لتجهيز الرسم البياني وتتبع tf.function
+    dummy = np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+    try:
+        for batcher in (PREDICTOR, EXPLAINER):
+            if batcher is not None:
+                batcher.batch_fn(dummy)
+    except Exception as e:
+        print(f"WARNING: فشل تسخين النموذج: {e}")
+
+
+def preload_runtime():
+    """
+    استيراد وحدات TensorFlow/Keras فقط بدون إنشاء سياق التنفيذ أو تحميل النموذج،
+    لتتشاركها عمال gunicorn بعد fork (TensorFlow لا يتحمل fork بعد تشغيل خيوطه).
+    المحركات البديلة (numpy/tflite) لا تحتاج TensorFlow فلا يُستورد.
+    """
+    if INFERENCE_BACKEND != 'keras':
+        return
+    try:
+        import tensorflow.keras.models  # noqa: F401
+        import gradcam_explainer  # noqa: F401
+    except Exception as e:
+        print(f"WARNING: فشل التحميل المسبق لـ TensorFlow: {e}")
+
+
+def ensure_model_loaded():
+    """إرجاع النموذج، مع تحميله الآن إذا لم يكتمل التسخين بعد (ينتظر خيط التسخين)."""
+    if MODEL_STATE not in ('ready', 'failed'):
+        load_forensics_model()
+    return LOADED_MODEL
+
+
+def start_model_warm_up(mode=None):
+    """
+    تسخين النموذج حسب SIDQ_MODEL_WARMUP:
+    background (افتراضي): خيط خلفي، والتطبيق يستقبل الطلبات فوراً.
+    eager: تحميل وتسخين متزامن الآن.
+    preload: استيراد TensorFlow فقط (للعملية الرئيسية في gunicorn قبل fork)،
+             ثم يُحمَّل النموذج داخل كل عامل بعد fork.
+    lazy: لا شيء؛ يُحمَّل النموذج مع أول طلب تحليل.
+    """
+    mode = mode or os.environ.get('SIDQ_MODEL_WARMUP', 'background')
+    if mode == 'eager':
+        load_forensics_model()
+    elif mode == 'preload':
+        preload_runtime()
+    elif mode == 'background' and MODEL_STATE == 'cold':
+        threading.Thread(target=load_forensics_model, name='sidq-warmup', daemon=True).start()
+
+
+def get_model_status():
+    """حالة جاهزية الاستدلال لنقطة /api/ready."""
+    return {
+        'state': MODEL_STATE,
+        'ready': MODEL_STATE == 'ready',
+        'model_path': MODEL_PATH,
+        'backend': MODEL_BACKEND,
+        'stamp': MODEL_STAMP_STATUS,
+        'gradcam': EXPLAINER is not None,
+    }
+
+
+def _model_version():
+    """إصدار ملف النموذج (الحجم ووقت التعديل) لإبطال النتائج المخزنة عند تغييره."""
+    if MODEL_STATE == 'failed':
+        return 'no-model'
+    try:
+        stat = os.stat(MODEL_PATH)
+        # المحرك جزء من الإصدار: التكميم int8 يغيّر الدرجات قليلاً
+        return f'{stat.st_size}-{int(stat.st_mtime)}-{MODEL_BACKEND}'
+    except OSError:
+        return 'no-model'
+
+
+def analysis_version():
+    """بصمة إصدار التحليل: أي تغيير في النموذج أو المعاملات يُبطل النتائج المخزنة."""
+    return '|'.join(str(part) for part in (
+        _model_version(),
+        IMG_SIZE,
+        ELA_QUALITY,
+        ELA_SCALE_FACTOR,
+        ela_analysis.ELA_EXTRA_QUALITIES,
+        ela_analysis.ELA_GHOST_CROP,
+        ela_analysis.ELA_BLOCK_SIZE,
+        ela_analysis.ELA_MAX_PIXELS,
+        ela_analysis.ELA_TILE_SIZE,
+        CNN_DECODE_MIN_SIZE,
+        getattr(prnu_analysis, 'LOW_VAR_THRESHOLD', None),
+        getattr(prnu_analysis, 'HIGH_VAR_THRESHOLD', None),
+        getattr(prnu_analysis, 'PRNU_WINDOW', None),
+        getattr(prnu_analysis, 'PRNU_TILE_SIZE', None),
+        getattr(prnu_analysis, 'PRNU_MAX_PIXELS', None),
+        FINGERPRINT_DB.version() if FINGERPRINT_DB else None,
+        sorted(STAGE_WEIGHTS.items()),
+        copy_move.COPY_MOVE_MAX_PIXELS,
+        copy_move.COPY_MOVE_MIN_PAIRS,
+        copy_move.COPY_MOVE_MIN_RATIO,
+        copy_move.COPY_MOVE_LATTICE_FRACTION,
+        cascade_version(),
+        phash_version(),
+    ))
+
+
+# قاعدة بصمات الكاميرات المرجعية (None إذا لم تُضبط SIDQ_PRNU_DB)
+FINGERPRINT_DB = create_fingerprint_db()
+
+# ذاكرة مؤقتة للنتائج حسب محتوى الملف (None إذا كانت معطلة)
+RESULT_CACHE = create_result_cache()
+
+
+def _result_cache_key(content_digest, include_visuals, include_ai=True):
+    return RESULT_CACHE.make_key(
+        content_digest, f'{analysis_version()}|visuals={int(include_visuals)}|ai={int(include_ai)}')
+
+
+def get_cache_stats():
+    """عدادات الإصابة/الإخفاق للذاكرة المؤقتة للنتائج."""
+    return RESULT_CACHE.stats() if RESULT_CACHE else {'enabled': False}
+
+
+def get_inference_stats():
+    """مقاييس طوابير الاستدلال والتفسير (عمق الطابور وأحجام الدفعات)."""
+    return {
+        batcher.name: batcher.metrics()
+        for batcher in (PREDICTOR, EXPLAINER) if batcher
+    }
+
+
+# قيم لحظية تُقرأ عند كل طلب لـ /metrics
+gauge_callback(
+    'sidq_batch_queue_depth', 'Items waiting in each micro-batch queue.',
+    lambda: {name: stats['queue_depth'] for name, stats in get_inference_stats().items()}, ['batcher'],
+)
+gauge_callback(
+    'sidq_model_ready', 'Whether the CNN is loaded and warmed up (1) or not (0).',
+    lambda: {(): int(MODEL_STATE == 'ready')},
+)
+gauge_callback(
+    'sidq_result_cache_lookups', 'Result cache lookups by outcome since start.',
+    lambda: {
+        outcome: stats[outcome] for stats in [get_cache_stats()] if 'hits' in stats
+        for outcome in ('hits', 'disk_hits', 'misses')
+    }, ['outcome'],
+)
 
 
 # =========================================================
 # 2. دالة تحليل ELA (Error Level Analysis) - الآن كاملة
 # =========================================================
 
-def analyze_ela(image_stream, quality=95, scale_factor=15):
+def _png_base64(img):
+    """ترميز صورة PIL بصيغة PNG ثم Base64 لغرض التقرير."""
+    with stage_timer('encode_png'):
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+@timed('ela')
+def analyze_ela(image_context, quality=ELA_QUALITY, scale_factor=ELA_SCALE_FACTOR, include_visuals=True):
     """
     تحليل مستوى الخطأ (ELA) لتحديد المناطق التي تم تعديلها.
-    تقوم بحفظ الصورة ثم إعادة فتحها بضغط 95% لمعرفة الفرق.
+    تقوم بحفظ الصورة ثم إعادة فتحها بضغط 95% (وبجودات إضافية) لمعرفة الفرق.
+    عند include_visuals=False تُحسب الدرجة فقط بدون ترميز صورة ELA.
+
+    تُرجع (الدرجة، الحكم، صورة ELA Base64، إحصاءات الجودات والكتل).
     """
-    image_stream.seek(0)
-    original_img = Image.open(image_stream).convert('RGB')
-    
-    # 1. إعادة حفظ الصورة بجودة أقل (95%)
-    ela_buffer = io.BytesIO()
-    original_img.save(ela_buffer, format='JPEG', quality=quality)
-    ela_buffer.seek(0)
-    compressed_img = Image.open(ela_buffer).convert('RGB')
-    
-    # 2. حساب الفرق (Error) بين الأصل والمضغوط
-    diff = ImageChops.difference(original_img, compressed_img)
-    
-    # 3. تضخيم الإشارات لسهولة الرؤية (Scaling)
-    # نستخدم عامل مقياس لتضخيم الفروقات اللونية
-    diff_array = np.array(diff).astype(np.float32) * scale_factor
-    diff_array = np.clip(diff_array, 0, 255).astype(np.uint8)
-    ela_img = Image.fromarray(diff_array)
-
-    # 4. حفظ صورة ELA المشفرة لغرض التقرير
-    ela_img_buffer = io.BytesIO()
-    ela_img.save(ela_img_buffer, format='PNG')
-    ela_base64_image = base64.b64encode(ela_img_buffer.getvalue()).decode('utf-8')
-    
-    # 5. تحليل النتيجة (تبسيط: حساب متوسط الاختلاف)
-    mean_error = np.mean(diff_array)
-    
+    # 1-3. إعادة الضغط وحساب الفرق المضخّم (انظر ela_analysis)
+    mean_error, ela_stats, error_img = compute_ela(
+        image_context.rgb_image, quality, scale_factor, keep_error_image=include_visuals
+    )
+
+    # 4. حفظ صورة ELA المشفرة لغرض التقرير (عند الطلب فقط)
+    ela_base64_image = _png_base64(error_img) if include_visuals else None
+
     # تحديد درجة ELA
     if mean_error < 5.0:
         ela_score = 90.0 # أصالة عالية
@@ -101,55 +357,97 @@ def analyze_ela(image_stream, quality=95, scale_factor=15):
     else:
         ela_score = 30.0 # تزوير
         ela_verdict = f"❌ تباين عالٍ في ELA ({mean_error:.2f}). يشير إلى مناطق معدلة."
-        
-    return ela_score, ela_verdict, ela_base64_image
+
+    # 5. مناطق محلية عالية الخطأ رغم انخفاض المتوسط العام
+    if mean_error < 15.0 and ela_stats['high_error_ratio'] > 0:
+        ela_verdict += f" كتل عالية الخطأ: {ela_stats['high_error_ratio'] * 100:.1f}%."
+
+    return ela_score, ela_verdict, ela_base64_image, ela_stats
 
 
 # =========================================================
-# 3. دالة التحليل الجنائي الشاملة
+# 2.1 كشف النسخ واللصق داخل الصورة (Copy-Move)
 # =========================================================
 
-def analyze_full_forensics(image_stream):
-    
-    # ----------------------------------------------------
-    # أ. استخلاص بيانات EXIF الأساسية
-    # ----------------------------------------------------
-    image_stream.seek(0)
-    img = Image.open(image_stream)
-    metadata = {
-        'make': img.getexif().get(271) if img.getexif() else 'غير متوفر',
-        'model': img.getexif().get(272) if img.getexif() else 'غير متوفر',
-        'datetime': img.getexif().get(36867) if img.getexif() else 'غير متوفر',
-        'format': img.format,
-        'size': f"{img.width}x{img.height}",
-    }
-    
-    # ----------------------------------------------------
-    # ب. تحليل PRNU
-    # ----------------------------------------------------
-    prnu_verdict, prnu_score, prnu_img_base64 = extract_noise_pattern(image_stream)
-    
-    # ----------------------------------------------------
-    # ج. تحليل ELA
-    # ----------------------------------------------------
-    ela_score, ela_verdict, ela_img_base64 = analyze_ela(image_stream)
-    
-    # ----------------------------------------------------
-    # د. تحليل الذكاء الاصطناعي (AI CNN)
-    # ----------------------------------------------------
+# نسبة المساحة المنسوخة التي تُعد تزويراً مؤكداً (أقل منها: تحذير)
+COPY_MOVE_FORGED_RATIO = 0.005
+
+
+@timed('copymove')
+def analyze_copy_move(image_context, include_visuals=True):
+    """
+    كشف المناطق المنسوخة داخل نفس الصورة (ختم أو رقم مكرر) بمطابقة الكتل.
+    عند include_visuals=False تُحسب الدرجة فقط بدون ترميز صورة القناع.
+
+    تُرجع (الدرجة، الحكم، صورة القناع Base64، الإحصاءات).
+    """
+    stats, mask_img = detect_copy_move(image_context.gray_image, keep_mask_image=include_visuals)
+    mask_base64_image = _png_base64(mask_img) if include_visuals else None
+
+    if not stats['shifts']:
+        score = 90.0
+        verdict = "✅ لا توجد مناطق منسوخة داخل الصورة."
+    else:
+        shift = stats['shifts'][0]
+        score = 20.0 if stats['cloned_ratio'] >= COPY_MOVE_FORGED_RATIO else 50.0
+        verdict = (
+            f"{'❌' if score < 50.0 else '🟡'} مناطق متطابقة داخل الصورة بإزاحة ({shift['dx']}, {shift['dy']}) بكسل"
+            f" تغطي {stats['cloned_ratio'] * 100:.2f}% من المساحة. تشير إلى نسخ ولصق."
+        )
+    return score, verdict, mask_base64_image, stats
+
+
+# =========================================================
+# 3. دالة تحليل الذكاء الاصطناعي (CNN + Grad-CAM)
+# =========================================================
+
+def _cnn_input(image_context):
+    """تحجيم الصورة إلى مدخل النموذج (IMG_SIZE x IMG_SIZE) بقيم بين 0 و 1."""
+    # فك ترميز مصغّر: لا حاجة للصورة كاملة الدقة من أجل مدخل 128x128
+    img_resized = image_context.reduced_image(CNN_DECODE_MIN_SIZE).resize((IMG_SIZE, IMG_SIZE))
+    return np.array(img_resized) / 255.0
+
+
+def render_gradcam(image_context, img_array=None):
+    """
+    توليد خريطة Grad-CAM (Base64 PNG) بواسطة المفسّر المشترك
+    (بدون نسخ النموذج أو إعادة تتبع التدرج لكل طلب).
+    """
+    if EXPLAINER is None:
+        raise RuntimeError("مفسّر Grad-CAM غير متوفر")
+    if img_array is None:
+        img_array = _cnn_input(image_context)
+
+    cam = EXPLAINER(img_array)
+    heatmap = np.uint8(cam * 255)
+
+    # حفظ صورة Grad-CAM
+    return _png_base64(Image.fromarray(heatmap, 'L').convert('RGB'))
+
+
+@timed('ai')
+def analyze_ai(image_context, include_visuals=True):
+    """
+    تقدير الأصالة بواسطة نموذج CNN مع خريطة Grad-CAM للتفسير.
+    عند include_visuals=False تُحسب الدرجة فقط بدون Grad-CAM.
+    """
     ai_trust_score = 50.0 
     gradcam_img_base64 = None
     ai_verdict = "❌ فشل التحليل بواسطة الذكاء الاصطناعي (النموذج مفقود أو غير فعال)."
 
-    if LOADED_MODEL:
+    # انتظار اكتمال تحميل النموذج (صفر تقريباً بعد التسخين)
+    with stage_timer('model_wait'):
+        model = ensure_model_loaded()
+
+    if model:
         try:
-            image_stream.seek(0)
-            img_resized = Image.open(image_stream).convert('RGB').resize((IMG_SIZE, IMG_SIZE))
-            img_array = np.array(img_resized) / 255.0
+            with stage_timer('cnn_preprocess'):
+                img_array = _cnn_input(image_context)
             
-            # التنبؤ
-            prediction = LOADED_MODEL.predict(np.expand_dims(img_array, axis=0))
-            ai_trust_score = (1.0 - prediction[0][0]) * 100.0 # الثقة في الأصالة
+            # التنبؤ (عبر طابور الدفعات المشترك، يشمل زمن انتظار الدفعة)
+            with stage_timer('predict'):
+                prediction = PREDICTOR(img_array)
+            ai_trust_score = (1.0 - prediction) * 100.0 # الثقة في الأصالة
 
             if ai_trust_score > 70:
                 ai_verdict = f"✅ تحليل AI: ثقة عالية في الأصالة ({ai_trust_score:.2f}%)"
@@ -159,41 +457,218 @@ def analyze_full_forensics(image_stream):
                 ai_verdict = f"❌ تحليل AI: كشف تلاعب أو توليد آلي. ({ai_trust_score:.2f}%)"
             
             # ----------------------------------------------------
-            # هـ. منطق توليد Grad-CAM (للتفسير)
+            # منطق توليد Grad-CAM (للتفسير)
             # ----------------------------------------------------
-            # يجب تعريف دالة الهدف هنا، ولغرض التدريب نستخدم النتيجة مباشرة
-            def loss(output):
-                return (output[0][0])
-                
-            gradcam = Gradcam(LOADED_MODEL, model_modifier=ReplaceToLinear(), clone=True)
-            cam = gradcam(loss, img_array[np.newaxis, ...], penultimate_layer=-1)
-            heatmap = np.uint8(cam[0] * 255)
-            
-            # حفظ صورة Grad-CAM
-            gradcam_img = Image.fromarray(heatmap, 'L').convert('RGB')
-            gradcam_img_buffer = io.BytesIO()
-            gradcam_img.save(gradcam_img_buffer, format='PNG')
-            gradcam_img_base64 = base64.b64encode(gradcam_img_buffer.getvalue()).decode('utf-8')
+            if include_visuals:
+                with stage_timer('gradcam'):
+                    gradcam_img_base64 = render_gradcam(image_context, img_array)
             
         except Exception as e:
             print(f"Critical error in AI analysis/GradCAM: {e}")
 
-        
+    return ai_trust_score, ai_verdict, gradcam_img_base64
+
+
+# =========================================================
+# 3.1 مطابقة بصمة الكاميرا المذكورة في EXIF
+# =========================================================
+
+# درجة PRNU عند تطابق/عدم تطابق البصمة مع الكاميرا المذكورة في EXIF
+PRNU_MATCH_SCORE = 90.0
+PRNU_MISMATCH_SCORE = 25.0
+
+
+@timed('camera_match')
+def match_camera_fingerprint(image_context):
+    """
+    مقارنة ضوضاء الصورة ببصمات الكاميرا التي يدّعيها EXIF (make/model).
+    تُرجع أفضل تطابق، أو None إذا لم تتوفر القاعدة أو بصمات لهذه الكاميرا.
+    """
+    if FINGERPRINT_DB is None:
+        return None
+    metadata = image_context.metadata
+    make, model = metadata['make'], metadata['model']
+    if make in (None, EXIF_MISSING) or model in (None, EXIF_MISSING):
+        return None
+    if not FINGERPRINT_DB.has_camera(make, model):
+        return None
+    try:
+        matches = FINGERPRINT_DB.match(image_context.gray, make, model)
+    except Exception as e:
+        print(f"WARNING: فشلت مطابقة بصمة الكاميرا: {e}")
+        return None
+    return matches[0] if matches else None
+
+
+def _apply_camera_match(prnu_score, prnu_verdict, camera_match):
+    # تطابق البصمة دليل أقوى من تباين الضوضاء العام، فيتقدم عليه
+    if camera_match is None:
+        return prnu_score, prnu_verdict
+    if camera_match['matched']:
+        return (
+            max(prnu_score, PRNU_MATCH_SCORE),
+            f"{prnu_verdict} ✅ تطابق بصمة الكاميرا {camera_match['camera']} (PCE={camera_match['pce']:.1f}).",
+        )
+    return (
+        min(prnu_score, PRNU_MISMATCH_SCORE),
+        f"{prnu_verdict} ⚠️ لا تطابق بصمة الكاميرا المذكورة {camera_match['camera']} (PCE={camera_match['pce']:.1f}).",
+    )
+
+
+# =========================================================
+# 3.2 البحث عن قوالب مزورة أو سليمة سبق الحكم عليها (pHash)
+# =========================================================
+
+# فهرس البصمات الإدراكية للأحكام السابقة (None إذا لم تُضبط SIDQ_PHASH_INDEX)
+PHASH_INDEX = create_phash_index()
+
+
+@timed('phash')
+def match_known_template(image_context):
+    """
+    البحث في فهرس pHash عن صورة قريبة (نفس القالب بعد قص أو إعادة ضغط أو تعديل بسيط).
+    تُرجع (البصمة، أقرب حكم سابق أو None)، أو (None, None) إذا كان الفهرس معطلاً.
+    """
+    if PHASH_INDEX is None:
+        return None, None
+    try:
+        # نفس الصورة المصغّرة التي يستخدمها CNN (فك ترميز واحد للمرحلتين)
+        image_hash = perceptual_hash(image_context.reduced_image(CNN_DECODE_MIN_SIZE))
+        return image_hash, PHASH_INDEX.lookup(image_hash)
+    except Exception as e:
+        print(f"WARNING: فشل البحث في فهرس pHash: {e}")
+        return None, None
+
+
+def record_template(image_hash, abshr_verdict, final_score):
+    """حفظ الحكم الحاسم للصورة في فهرس pHash لمطابقة نسخها المعدّلة لاحقاً."""
+    if PHASH_INDEX is None or image_hash is None:
+        return
+    try:
+        PHASH_INDEX.record(image_hash, abshr_verdict, float(final_score))
+    except Exception as e:
+        print(f"WARNING: فشل حفظ البصمة في فهرس pHash: {e}")
+
+
+# =========================================================
+# 4. دالة التحليل الجنائي الشاملة
+# =========================================================
+
+# نتيجة مرحلة تخطاها التقييم المتتالي (الدرجة None)
+SKIPPED_STAGE_VERDICT = "⏭️ تم تخطي هذه المرحلة: القرار محسوم من المراحل السابقة."
+# نتيجة مرحلة CNN التي أسقطها التحكم في القبول تحت الضغط (انظر admission_control)
+SHED_AI_VERDICT = "⏭️ تم تخطي تحليل الذكاء الاصطناعي مؤقتاً بسبب ضغط الخادم."
+
+
+def _prnu_result(prnu_result, camera_match):
+    """دمج PRNU مع مطابقة البصمة: (الدرجة، الحكم، الصورة، خريطة الضوضاء، التطابق)."""
+    prnu_verdict, prnu_score, prnu_img_base64, prnu_noise_map = prnu_result
+    prnu_score, prnu_verdict = _apply_camera_match(prnu_score, prnu_verdict, camera_match)
+    return prnu_score, prnu_verdict, prnu_img_base64, prnu_noise_map, camera_match
+
+
+def _prnu_stage(image_context, include_visuals):
+    # مرحلة PRNU في التقييم المتتالي (خيط الطلب): البصمة والضوضاء بالتوازي
+    camera_match, prnu_result = run_stages([
+        (match_camera_fingerprint, (image_context,)),
+        (extract_noise_pattern, (image_context, include_visuals)),
+    ])
+    return _prnu_result(prnu_result, camera_match)
+
+
+@timed('full_analysis')
+def analyze_full_forensics(image_stream, include_visuals=True, include_ai=True):
+    """
+    التحليل الجنائي الكامل للصورة.
+
+    include_visuals=False هو المسار السريع (الحكم فقط): تُحسب الدرجات فقط،
+    وتبقى حقول الصور (*_img_base64) فارغة لتُولَّد لاحقاً عند الطلب
+    عبر render_artefact.
+    include_ai=False يُسقط مرحلة CNN (تحت الضغط): درجتها None وتُذكر في skipped_stages،
+    فتُحسب الدرجة النهائية بمداها الكامل كما في التقييم المتتالي.
+    """
+
+    # إعادة إرسال نفس الملف: إرجاع النتيجة المخزنة بدون إعادة التحليل
+    raw_bytes = read_image_bytes(image_stream)
+    if RESULT_CACHE is not None:
+        with stage_timer('cache_lookup'):
+            content_digest = RESULT_CACHE.content_digest(raw_bytes)
+            cached_results = RESULT_CACHE.get(_result_cache_key(content_digest, include_visuals, include_ai))
+        if cached_results is not None:
+            return dict(cached_results, metadata=dict(cached_results['metadata']))
+
+    # قراءة الترويسة ورفض الصور التي تتجاوز حد البكسلات؛ فك الترميز الكامل
+    # يحدث مرة واحدة عند أول مرحلة تحتاجه ويُشارك مع بقية المحللات
+    with stage_timer('decode'):
+        image_context = load_image_context(raw_bytes)
+    IMAGE_BYTES.observe(len(raw_bytes))
+    IMAGE_PIXELS.observe(image_context.width * image_context.height)
+
     # ----------------------------------------------------
-    # و. دمج النتائج وتقرير النتيجة النهائية
+    # أ. استخلاص بيانات EXIF الأساسية
     # ----------------------------------------------------
+    with stage_timer('exif'):
+        metadata = image_context.metadata
+
+    # قالب مشابه سبق الحكم عليه: إشارة إضافية في النتيجة، لا تغيّر الدرجة
+    image_hash, phash_match = match_known_template(image_context)
     
-    final_score_unclamped = (0.4 * ai_trust_score) + (0.3 * prnu_score) + (0.3 * ela_score)
-    final_score = np.clip(final_score_unclamped, 0.0, 100.0) 
-
-    # بناء رسالة القرار الأمني (الختم)
-    if final_score < 40:
-        abshr_verdict = "FORGED"
-    elif final_score < 75:
-        abshr_verdict = "CAUTION"
+    # ----------------------------------------------------
+    # ب، ج، د. تحليل PRNU و ELA و AI (CNN)
+    # ----------------------------------------------------
+    if CASCADE_ENABLED:
+        # بالتتابع (الأغلى أخيراً) مع التوقف عند حسم القرار، انظر cascade_scoring
+        stages = {
+            'ai': partial(analyze_ai, image_context, include_visuals),
+            'prnu': partial(_prnu_stage, image_context, include_visuals),
+            'ela': partial(analyze_ela, image_context, ELA_QUALITY, ELA_SCALE_FACTOR, include_visuals),
+            'copymove': partial(analyze_copy_move, image_context, include_visuals),
+        }
+        if not include_ai:
+            del stages['ai']
+        stage_results, skipped_stages, decided_verdict = run_cascade(stages)
     else:
-        abshr_verdict = "CLEAN"
-        
+        # بالتوازي: المراحل مستقلة عن بعضها، ومعظمها يحرر الـ GIL (NumPy، PIL، TF)
+        # لذلك يقترب زمن الطلب من زمن أبطأ مرحلة بدلاً من مجموعها.
+        stages = [
+            (match_camera_fingerprint, (image_context,)),
+            (extract_noise_pattern, (image_context, include_visuals)),
+            (analyze_ela, (image_context, ELA_QUALITY, ELA_SCALE_FACTOR, include_visuals)),
+            (analyze_copy_move, (image_context, include_visuals)),
+        ]
+        if include_ai:
+            stages.append((analyze_ai, (image_context, include_visuals)))
+        camera_match, prnu_result, ela_result, copy_move_result, *ai_result = run_stages(stages)
+        stage_results = {
+            'prnu': _prnu_result(prnu_result, camera_match), 'ela': ela_result, 'copymove': copy_move_result,
+        }
+        if ai_result:
+            stage_results['ai'] = ai_result[0]
+        skipped_stages, decided_verdict = [], None
+
+    if not include_ai:
+        skipped_stages = ['ai'] + skipped_stages
+    ai_trust_score, ai_verdict, gradcam_img_base64 = stage_results.get(
+        'ai', (None, SKIPPED_STAGE_VERDICT if include_ai else SHED_AI_VERDICT, None))
+    prnu_score, prnu_verdict, prnu_img_base64, prnu_noise_map, camera_match = stage_results.get(
+        'prnu', (None, SKIPPED_STAGE_VERDICT, None, None, None))
+    ela_score, ela_verdict, ela_img_base64, ela_stats = stage_results.get(
+        'ela', (None, SKIPPED_STAGE_VERDICT, None, None))
+    copymove_score, copymove_verdict, copymove_img_base64, copymove_stats = stage_results.get(
+        'copymove', (None, SKIPPED_STAGE_VERDICT, None, None))
+
+    # ----------------------------------------------------
+    # و. دمج النتائج وتقرير النتيجة النهائية (الختم)
+    # ----------------------------------------------------
+    # بدون CNN تُعاد موازنة أوزان المراحل المنفذة بدلاً من افتراض مدى CNN كاملاً
+    # (الذي يحصر القرار في CAUTION أياً كانت بقية الدرجات)
+    final_score, abshr_verdict = combine_scores({
+        'ai': ai_trust_score, 'prnu': prnu_score, 'ela': ela_score, 'copymove': copymove_score,
+    }, omitted=() if include_ai else ('ai',), decided=decided_verdict)
+    # الحكم بدون كل المراحل (تقييم متتالي أو تخفيف حمل) لا يصلح مرجعاً لنسخ القالب
+    if not skipped_stages:
+        record_template(image_hash, abshr_verdict, final_score)
+
     
     # ----------------------------------------------------
     # ز. تجميع كل البيانات في قاموس واحد
@@ -211,13 +686,75 @@ def analyze_full_forensics(image_stream):
         'prnu_score': prnu_score,
         'prnu_verdict': prnu_verdict,
         'prnu_img_base64': prnu_img_base64,
+        # خريطة تباين الضوضاء لكل بلاطة (المناطق غير المتسقة)
+        'prnu_noise_map': prnu_noise_map,
+        # أفضل تطابق مع بصمات الكاميرا المذكورة في EXIF (None إذا لم تتوفر)
+        'prnu_camera_match': camera_match,
         
         'ela_score': ela_score,
         'ela_verdict': ela_verdict,
         'ela_img_base64': ela_img_base64,
+        # متوسط الخطأ لكل جودة وإحصاءات الكتل
+        'ela_stats': ela_stats,
+
+        'copymove_score': copymove_score,
+        'copymove_verdict': copymove_verdict,
+        'copymove_img_base64': copymove_img_base64,
+        # نسبة المساحة المنسوخة وأقوى الإزاحات
+        'copymove_stats': copymove_stats,
+
+        # المراحل التي تخطاها التقييم المتتالي أو التحكم في القبول (درجاتها None)
+        'skipped_stages': skipped_stages,
+
+        # أقرب صورة سبق الحكم عليها في فهرس pHash (الحكم، الدرجة، مسافة هامنغ)، أو None
+        'phash_match': phash_match,
         
-        # نحتاج الأصل ليكون في التقرير
-        'original_img_base64': base64.b64encode(image_stream.getvalue()).decode('utf-8') if image_stream else None
+        # الأصل لا يُضمَّن في النتيجة (+33% Base64 في كل نتيجة مخزنة): يُشار إليه بمعرّف
+        # التحليل ويُقدَّم من المخزن مباشرة عبر /api/artefact/original
+        'original_img_base64': None
     }
+
+    if RESULT_CACHE is not None:
+        # المفتاح يُعاد حسابه لأن حالة النموذج قد تتغير أثناء التحليل (تحميل/فشل)
+        RESULT_CACHE.put(_result_cache_key(content_digest, include_visuals, include_ai), analysis_results)
         
-    return analysis_results
\ No newline at end of file
+    return analysis_results
+
+
+# =========================================================
+# 5. توليد الصور التوضيحية عند الطلب (Lazy Artefacts)
+# =========================================================
+
+# أسماء الصور التوضيحية ومفاتيحها في قاموس النتائج
+ARTEFACT_KEYS = {
+    'prnu': 'prnu_img_base64',
+    'ela': 'ela_img_base64',
+    'copymove': 'copymove_img_base64',
+    'gradcam': 'gradcam_img_base64',
+    'original': 'original_img_base64',
+}
+
+
+def render_artefact(image_context, name):
+    """
+    توليد صورة توضيحية واحدة (Base64) من سياق الصورة.
+    تُستدعى فقط عند طلب التقرير أو الصورة، وليس في مسار الحكم السريع.
+    """
+    if name == 'original':
+        return base64.b64encode(image_context.raw_bytes).decode('utf-8') if image_context.raw_bytes else None
+    if name == 'prnu':
+        return extract_noise_pattern(image_context)[2]
+    if name == 'ela':
+        return analyze_ela(image_context)[2]
+    if name == 'copymove':
+        return analyze_copy_move(image_context)[2]
+    if name == 'gradcam':
+        if not ensure_model_loaded():
+            return None
+        try:
+            with stage_timer('gradcam'):
+                return render_gradcam(image_context)
+        except Exception as e:
+            print(f"Critical error in AI analysis/GradCAM: {e}")
+            return None
+    raise KeyError(name)
\ No newline at end of file
@@ -0,0 +1,275 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# نفس المخزن والتحليل والتقرير المستخدمة في وضع WSGI (يبدأ تسخين النموذج عند الاستيراد)
+from admission_control import ADMISSION_CLIENT_HEADER, LEVEL_NO_CNN, LEVEL_NO_VISUALS, AdmissionRejected
+from app_flask import (
+    ADMISSION, IMAGE_MAX_CONTENT_LENGTH, JOB_RETRY_AFTER_SECONDS, TRACE_ALL_REQUESTS, TRACE_HEADER, abshr_response,
+    admission_rejected_body, analyze_full_forensics, get_analysis_record, get_model_status, get_report_pdf,
+    store_analysis,
+)
+from image_context import ImageTooLargeError
+from job_queue import QueueFull
+from metrics import (
+    HTTP_SECONDS, PROMETHEUS_CONTENT_TYPE, REGISTRY, end_trace, format_server_timing, gauge_callback, start_trace,
+)
+from report_pdf import iter_chunks
+from upload_buffer import spool_upload
+
+# =========================================================
+# وضع الخدمة غير المتزامن (ASGI) لنقطتي التحليل والتقرير
+#
+# في وضع WSGI يحجز كل رفع بطيء أو تنزيل تقرير عاملاً كاملاً (ونسخة من النموذج) طوال
+# مدته. هنا تُستقبل الملفات وتُبث الردود على حلقة أحداث واحدة، ويُرسل العمل الحسابي فقط
+# إلى مجمع خيوط محدود، فالاتصالات الخاملة أو البطيئة شبه مجانية.
+#
+# التشغيل:
+#   uvicorn app_asgi:app --workers 2
+#   gunicorn app_asgi:app -k uvicorn.workers.UvicornWorker
+# =========================================================
+
+# عدد التحليلات المتزامنة في كل عامل (كل تحليل يستخدم أيضاً مجمع المراحل المشترك)
+ANALYSIS_WORKERS = int(os.environ.get('SIDQ_ASGI_ANALYSIS_WORKERS', '2'))
+# أقصى عدد أعمال (منفذة أو منتظرة) قبل رفض الطلبات بـ 503
+ANALYSIS_MAX_PENDING = int(os.environ.get('SIDQ_ASGI_MAX_PENDING', '16'))
+
+
+class BoundedExecutor:
+    """
+    مجمع خيوط بطابور محدود لحلقة الأحداث. عند امتلائه يرفع QueueFull فوراً بدلاً من
+    تكديس الطلبات في الذاكرة. يُنشأ المجمع عند أول استخدام ويُعاد إنشاؤه بعد fork.
+    """
+
+    def __init__(self, max_workers, max_pending, thread_name_prefix='sidq-asgi'):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._executor_pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def run(self, func, *args):
+        """تنفيذ func في المجمع بنسخة من سياق الطلب (يصل إليها تتبع المراحل)."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull()
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, contextvars.copy_context().run, func, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+ANALYSIS_EXECUTOR = BoundedExecutor(ANALYSIS_WORKERS, ANALYSIS_MAX_PENDING)
+gauge_callback(
+    'sidq_asgi_analysis_pending', 'Analyses running or waiting in the ASGI executor.',
+    lambda: {(): ANALYSIS_EXECUTOR.pending},
+)
+
+
+def _error(message, status_code, status='error', headers=None):
+    return JSONResponse({'status': status, 'message': message}, status_code=status_code, headers=headers)
+
+
+def _busy():
+    return _error(
+        'الخادم مشغول حالياً، يرجى إعادة المحاولة لاحقاً.', 503, status='busy',
+        headers={'Retry-After': str(JOB_RETRY_AFTER_SECONDS)},
+    )
+
+
+# =========================================================
+# 1. المقاييس وتتبع زمن المراحل (نفس ترويسة X-Sidq-Trace في وضع WSGI)
+# =========================================================
+
+def instrumented(endpoint):
+    """مزخرف يسجل زمن الطلب في sidq_http_request_seconds ويضيف Server-Timing عند التتبع."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            start = time.perf_counter()
+            trace_token = None
+            if TRACE_ALL_REQUESTS or request.headers.get(TRACE_HEADER) == '1':
+                trace_token = start_trace()
+            try:
+                response = await handler(request)
+            finally:
+                trace = end_trace(trace_token) if trace_token is not None else None
+            elapsed = time.perf_counter() - start
+            HTTP_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+            if trace is not None:
+                response.headers['Server-Timing'] = format_server_timing(trace + [('total', elapsed)])
+            return response
+        return wrapper
+    return decorator
+
+
+# =========================================================
+# 2. نقطة نهاية تحليل الأمن (الربط مع أبشر)
+# =========================================================
+
+def _admission_client(request):
+    if ADMISSION_CLIENT_HEADER and request.headers.get(ADMISSION_CLIENT_HEADER):
+        return request.headers[ADMISSION_CLIENT_HEADER].split(',')[0].strip()
+    return request.client.host if request.client else None
+
+
+class _BodyTooLarge(Exception):
+    """جسم الطلب تجاوز الحد أثناء استقباله."""
+
+
+def _limited_request(request, limit):
+    """
+    نسخة من الطلب تعدّ بايتات الجسم أثناء استقباله وترفع _BodyTooLarge عند تجاوز الحد،
+    فالطلب المجزأ (بدون Content-Length) لا يُكتب كاملاً قبل فحص حجمه.
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > limit:
+                raise _BodyTooLarge()
+        return message
+
+    return Request(request.scope, receive)
+
+
+def _analyze_and_store(raw_upload, level):
+    full_analysis_data = analyze_full_forensics(raw_upload, include_visuals=False, include_ai=level < LEVEL_NO_CNN)
+    return abshr_response(full_analysis_data, store_analysis(full_analysis_data, raw_upload), level)
+
+
+@instrumented('abshr_security_forensics')
+async def abshr_security_forensics(request):
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > IMAGE_MAX_CONTENT_LENGTH:
+        return _error('حجم الملف يتجاوز الحد الأقصى (5MB).', 413)
+
+    # الجسم يُقرأ على حلقة الأحداث ويُكتب في ملف مؤقت (الرفع البطيء لا يحجز خيطاً)،
+    # ويُقطع عند تجاوز الحد (الملفات المؤقتة تُغلق عند فشل التحليل النحوي)
+    try:
+        form = await _limited_request(request, IMAGE_MAX_CONTENT_LENGTH).form(max_files=1, max_fields=8)
+    except _BodyTooLarge:
+        return _error('حجم الملف يتجاوز الحد الأقصى (5MB).', 413)
+    try:
+        upload = form.get('image')
+        if upload is None or isinstance(upload, str):
+            return _error('لم يتم العثور على ملف الصورة.', 400)
+        if upload.size is not None and upload.size > IMAGE_MAX_CONTENT_LENGTH:
+            return _error('حجم الملف يتجاوز الحد الأقصى (5MB).', 413)
+
+        # الملف المؤقت يُربط بالذاكرة بدلاً من نسخه (يبقى صالحاً بعد إغلاق النموذج)
+        raw_upload = spool_upload(upload.file)
+        # زمن القبول يشمل الانتظار في المجمع (هو ما يراه العميل)
+        with ADMISSION.admit(_admission_client(request)) as level:
+            return JSONResponse(await ANALYSIS_EXECUTOR.run(_analyze_and_store, raw_upload, level))
+
+    except AdmissionRejected as e:
+        return JSONResponse(
+            admission_rejected_body(e), status_code=e.status_code, headers={'Retry-After': str(e.retry_after)})
+    except QueueFull:
+        return _busy()
+    except ImageTooLargeError as e:
+        return _error(str(e), 413)
+    except Exception as e:
+        print(f"Error during forensics analysis: {e}")
+        return _error(f'فشل في عملية التحليل: {str(e)}', 500)
+    finally:
+        await form.close()
+
+
+# =========================================================
+# 3. نقطة نهاية تقرير PDF (البث على حلقة الأحداث)
+# =========================================================
+
+async def _stream_chunks(data):
+    # العميل البطيء ينتظر هنا بدون حجز خيط
+    for chunk in iter_chunks(data):
+        yield chunk
+
+
+def _load_report(analysis_id, include_gradcam):
+    """بايتات التقرير أو None إذا لم يوجد تحليل بهذا المعرّف."""
+    record = get_analysis_record(analysis_id)
+    if not record:
+        return None
+    # أول طلب يبني التقرير، والطلبات التالية تُقدَّم من المخزن
+    return get_report_pdf(analysis_id, record, include_gradcam)
+
+
+@instrumented('generate_report')
+async def generate_report(request):
+    # لا جلسات في هذا الوضع: المعرّف من الاستعلام فقط (?id=)
+    analysis_id = request.query_params.get('id')
+    try:
+        # قراءة السجل (SQLite في المخزن المشترك) وبناء التقرير كلاهما في المجمع؛
+        # تحت الضغط بدون Grad-CAM (لا يُخزَّن، انظر get_report_pdf)
+        pdf_bytes = await ANALYSIS_EXECUTOR.run(
+            _load_report, analysis_id, ADMISSION.current_level() < LEVEL_NO_VISUALS)
+    except QueueFull:
+        return _busy()
+    if pdf_bytes is None:
+        return _error('لا توجد نتائج تحليل سابقة لإصدار تقرير.', 404)
+
+    return StreamingResponse(_stream_chunks(pdf_bytes), media_type='application/pdf', headers={
+        'Content-Length': str(len(pdf_bytes)),
+        'Content-Disposition': 'attachment; filename=Sidq_Report.pdf',
+    })
+
+
+# =========================================================
+# 4. فحوص الصحة والجاهزية والمقاييس
+# =========================================================
+
+async def healthz(request):
+    return JSONResponse({'status': 'ok'})
+
+
+async def readiness(request):
+    model_status = get_model_status()
+    return JSONResponse(model_status, status_code=200 if model_status['ready'] else 503)
+
+
+async def prometheus_metrics(request):
+    return Response(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/abshr/security-forensics', abshr_security_forensics, methods=['POST']),
+        Route('/api/report', generate_report, methods=['GET']),
+        Route('/healthz', healthz, methods=['GET']),
+        Route('/api/ready', readiness, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+)
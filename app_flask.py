@@ -1,20 +1,57 @@
-from flask import Flask, request, jsonify, send_file, session 
+from flask import Flask, Request, request, jsonify, send_file, session, Response, stream_with_context, g
 from flask_cors import CORS 
 from werkzeug.exceptions import RequestEntityTooLarge 
 import io
 import os
 import datetime
 import base64
+import uuid
+import zipfile
+import time
+from functools import partial
 from PIL import Image
 import numpy as np
 
+from admission_control import (
+    ADMISSION_CLIENT_HEADER, LEVEL_NAMES, LEVEL_NO_CNN, LEVEL_NO_VISUALS, AdmissionRejected,
+    create_admission_controller,
+)
+from artefact_cache import ArtefactCache
+from batch_analysis import (
+    BatchItemError, iter_manifest_items, iter_multipart_items, iter_zip_items, open_zip_archive,
+    stream_batch_results,
+)
+from image_context import ImageTooLargeError
+from job_queue import JobQueue, QueueFull
+from metrics import (
+    HTTP_SECONDS, PROMETHEUS_CONTENT_TYPE, REGISTRY, end_trace, format_server_timing, gauge_callback,
+    stage_timer, start_trace,
+)
+from report_pdf import build_report_pdf, iter_chunks, render_report_asset, report_asset_names
+from result_store import create_result_store
+from upload_buffer import BufferReader, spool_upload, upload_stream_factory
+
 # استيراد دالة التحليل
 try:
-    from ai_forensics import analyze_full_forensics
+    from ai_forensics import (
+        analyze_full_forensics, get_inference_stats, get_cache_stats, render_artefact, ARTEFACT_KEYS,
+        get_model_status, start_model_warm_up,
+    )
 except ImportError:
     print("FATAL ERROR: Could not import ai_forensics.py. Analysis will fail.")
-    def analyze_full_forensics(image_stream):
-        return {'abshr_verdict': 'ERROR', 'final_score': 0, 'ai_score': 0, 'prnu_score': 0, 'ela_score': 0, 'ai_verdict': 'فشل حاد في تحميل دالة التحليل.', 'prnu_verdict': '', 'ela_verdict': '', 'metadata': {}, 'prnu_img_base64': None, 'ela_img_base64': None, 'gradcam_img_base64': None, 'original_img_base64': None}
+    ARTEFACT_KEYS = {}
+    def get_model_status():
+        return {'state': 'failed', 'ready': False}
+    def start_model_warm_up(mode=None):
+        pass
+    def get_cache_stats():
+        return {'enabled': False}
+    def get_inference_stats():
+        return {}
+    def render_artefact(image_context, name):
+        return None
+    def analyze_full_forensics(image_stream, include_visuals=True, include_ai=True):
+        return {'abshr_verdict': 'ERROR', 'final_score': 0, 'ai_score': 0, 'prnu_score': 0, 'ela_score': 0, 'copymove_score': 0, 'ai_verdict': 'فشل حاد في تحميل دالة التحليل.', 'prnu_verdict': '', 'ela_verdict': '', 'copymove_verdict': '', 'metadata': {}, 'prnu_img_base64': None, 'ela_img_base64': None, 'copymove_img_base64': None, 'gradcam_img_base64': None, 'original_img_base64': None}
 
 def clean_for_json(data):
     """
@@ -37,232 +74,456 @@ app = Flask(__name__)
 CORS(app) 
 # يجب أن يكون المفتاح السري موجوداً لتمكين الجلسات (session)
 app.secret_key = os.environ.get("SECRET_KEY", 'a_secure_secret_key_for_sidq') 
-app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024 # 5 ميجابايت
+# حد الصورة الواحدة (5 ميجابايت) لكل الطلبات، وحد أكبر تضبطه نقطة الدفعات لطلبها فقط.
+# Werkzeug يطبق الحد على Content-Length وعلى البايتات المستلمة فعلاً (الطلب المجزأ)
+IMAGE_MAX_CONTENT_LENGTH = 5 * 1024 * 1024
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('SIDQ_BATCH_MAX_CONTENT_LENGTH', str(512 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = IMAGE_MAX_CONTENT_LENGTH
+
+# نتائج التحليل تُحفظ على الخادم بمعرّف التحليل، والجلسة تحمل المعرّف فقط
+# (SIDQ_RESULT_STORE=memory أو sqlite:///results.db للمشاركة بين العمال)
+RESULTS = create_result_store()
+
+# الصور التوضيحية (PRNU، ELA، Grad-CAM، الأصل) تُولَّد عند أول طلب فقط
+ARTEFACTS = ArtefactCache(render_artefact, RESULTS)
+
+
+class SidqRequest(Request):
+    """الملفات المرفوعة في BytesIO أو ملف مؤقت حقيقي (انظر upload_buffer.spool_upload)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_stream_factory(total_content_length, content_type, filename, content_length)
+
+
+app.request_class = SidqRequest
+
+
+def get_analysis_record(analysis_id):
+    """جلب سجل التحليل {'results', 'timestamp'} من المخزن بالمعرّف."""
+    if not analysis_id:
+        return None
+    return RESULTS.get(f'{analysis_id}:results')
+
+
+def store_analysis(full_analysis_data, raw_bytes):
+    """حفظ نتيجة التحليل وبايتات الأصل في المخزن وإرجاع معرّف التحليل."""
+    analysis_id = uuid.uuid4().hex
+    ARTEFACTS.register(analysis_id, raw_bytes)
+    RESULTS.put(f'{analysis_id}:results', {
+        'results': clean_for_json(full_analysis_data),
+        'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    return analysis_id
+
+
+def requested_analysis_id():
+    """معرّف التحليل من الاستعلام (?id=) أو من الجلسة."""
+    return request.args.get('id') or session.get('analysis_id')
 
 # =========================================================
-# 2. إعدادات التقرير (ReportLab)
+# 1.1 المقاييس وتتبع زمن المراحل (Prometheus و Server-Timing)
 # =========================================================
 
-try:
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    from reportlab.lib.utils import ImageReader
-    from reportlab.lib import colors
-    
-    # ⚠️ **هام:** يجب أن يكون ملف الخط 'Tajawal-Bold.ttf' موجوداً
-    pdfmetrics.registerFont(TTFont('Tajawal', 'Tajawal-Bold.ttf'))
-    ARABIC_FONT = 'Tajawal'
-except Exception as e:
-    print(f"WARNING: فشل تحميل خط Tajawal أو ReportLab: {e}. سيتم استخدام الخط الافتراضي.")
-    ARABIC_FONT = 'Helvetica'
+# ترويسة الطلب التي تفعّل تتبع المراحل؛ الرد يحمل التفصيل في Server-Timing
+TRACE_HEADER = 'X-Sidq-Trace'
+# تفعيل التتبع لكل الطلبات بدون الترويسة (للتشخيص فقط)
+TRACE_ALL_REQUESTS = os.environ.get('SIDQ_TRACE_ALL') == '1'
+
+
+@app.before_request
+def _start_request_metrics():
+    g.request_start = time.perf_counter()
+    if TRACE_ALL_REQUESTS or request.headers.get(TRACE_HEADER) == '1':
+        g.trace_token = start_trace()
+
+
+@app.after_request
+def _finish_request_metrics(response):
+    elapsed = time.perf_counter() - g.pop('request_start', time.perf_counter())
+    HTTP_SECONDS.observe(
+        elapsed, endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code,
+    )
+    trace_token = g.pop('trace_token', None)
+    if trace_token is not None:
+        trace = end_trace(trace_token) + [('total', elapsed)]
+        response.headers['Server-Timing'] = format_server_timing(trace)
+    return response
+
+# =========================================================
+# 1.2 التحكم في القبول وتخفيف الحمل، انظر admission_control.py
+# =========================================================
+
+ADMISSION = create_admission_controller()
+
+
+def admission_client():
+    """معرّف العميل لحد الطلبات: الترويسة المحددة (أول قيمة) أو عنوان الاتصال."""
+    if ADMISSION_CLIENT_HEADER and request.headers.get(ADMISSION_CLIENT_HEADER):
+        return request.headers[ADMISSION_CLIENT_HEADER].split(',')[0].strip()
+    return request.remote_addr
+
+
+def degradation_fields(level):
+    """مستوى الخدمة في الرد (0 كامل، 1 بدون صور توضيحية، 2 بدون CNN، 3 مرفوض)."""
+    return {'degradation_level': level, 'degradation': LEVEL_NAMES[level]}
+
+
+def admission_rejected_body(e):
+    return {
+        'status': 'busy' if e.status_code == 503 else 'error', 'message': str(e), **degradation_fields(e.level),
+    }
+
+
+# تحميل TensorFlow والنموذج في الخلفية (أو مسبقاً في العملية الرئيسية مع
+# SIDQ_PRELOAD_MODEL=1، انظر gunicorn.conf.py) حتى لا ينتظر الإقلاع وفحوص الصحة
+start_model_warm_up()
+
+# =========================================================
+# 2. إعدادات التقرير (ReportLab)، انظر report_pdf.py
+# =========================================================
+
+# صور التقرير المصغّرة (JPEG) تُخزن بجانب النتيجة وتُولَّد مرة واحدة لكل تحليل
+REPORT_IMAGES = ArtefactCache(
+    partial(render_report_asset, render_artefact=render_artefact), RESULTS,
+    namespace='report_asset', uncached=(),
+)
 
 
 # =========================================================
 # 3. نقطة نهاية تحليل الأمن (الربط مع أبشر) - مُحدثة
 # =========================================================
 
+def abshr_response(full_analysis_data, analysis_id, level=0):
+    """الرد المختصر لواجهة أبشر (مشترك مع وضع ASGI، انظر app_asgi.py)."""
+    return {
+        # مستوى الخدمة الذي نُفذ به التحليل تحت الضغط
+        **degradation_fields(level),
+        'status': 'success',
+        # درجة الثقة النهائية (الختم الأمني)
+        'confidence_score': full_analysis_data['final_score'], 
+        # القرار الأمني (CLEAN, CAUTION, FORGED)
+        'abshr_verdict': full_analysis_data['abshr_verdict'], 
+        'analysis_id': analysis_id,
+        # حكم سابق لقالب مشابه من فهرس pHash (None إذا لم يوجد)
+        'phash_match': full_analysis_data.get('phash_match'),
+        # URL التقرير الذي سيستدعيه الزر في الواجهة
+        'report_url': f'/api/report?id={analysis_id}' 
+    }
+
+
 @app.route('/api/abshr/security-forensics', methods=['POST'])
 def abshr_security_forensics():
     try:
         if 'image' not in request.files:
             return jsonify({'status': 'error', 'message': 'لم يتم العثور على ملف الصورة.'}), 400
 
-        file = request.files['image']
-        image_stream = io.BytesIO(file.read())
+        # الملف المرفوع يُربط بالذاكرة بدلاً من نسخه (نفس البايتات للتحليل وللمخزن)
+        raw_upload = spool_upload(request.files['image'])
         
-        # 1. تنفيذ التحليل الجنائي الكامل
-        full_analysis_data = analyze_full_forensics(image_stream)
+        # 1. تنفيذ التحليل الجنائي (المسار السريع: الدرجات والحكم فقط)
+        # الصور التوضيحية تُولَّد لاحقاً عند طلب التقرير أو الصورة
+        # تحت الضغط يُسقط التحكم في القبول مرحلة CNN أو يرفض الطلب
+        with ADMISSION.admit(admission_client()) as level:
+            full_analysis_data = analyze_full_forensics(
+                raw_upload, include_visuals=False, include_ai=level < LEVEL_NO_CNN)
         
-        # 2. حفظ نتائج التحليل الكاملة في جلسة المستخدم (لتوليد التقرير لاحقاً)
-        # يجب تخزين البيانات في الجلسة لاستخدامها في /api/report
-        session['last_analysis_results'] = full_analysis_data 
-        session['analysis_timestamp'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # 2. حفظ نتائج التحليل في مخزن النتائج (لتوليد التقرير لاحقاً)
+        # الجلسة (ملف تعريف الارتباط) تحمل معرّف التحليل فقط
+        analysis_id = store_analysis(full_analysis_data, raw_upload)
+        session['analysis_id'] = analysis_id
 
         # 3. إرجاع النتيجة الأساسية لـ واجهة أبشر
-        response_to_abshr = {
-            'status': 'success',
-            # درجة الثقة النهائية (الختم الأمني)
-            'confidence_score': full_analysis_data['final_score'], 
-            # القرار الأمني (CLEAN, CAUTION, FORGED)
-            'abshr_verdict': full_analysis_data['abshr_verdict'], 
-            # URL التقرير الذي سيستدعيه الزر في الواجهة
-            'report_url': '/api/report' 
-        }
-
-        return jsonify(response_to_abshr)
+        return jsonify(abshr_response(full_analysis_data, analysis_id, level))
 
+    except AdmissionRejected as e:
+        response = jsonify(admission_rejected_body(e))
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status_code
     except RequestEntityTooLarge:
         return jsonify({'status': 'error', 'message': 'حجم الملف يتجاوز الحد الأقصى (5MB).'}), 413
+    except ImageTooLargeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 413
     except Exception as e:
         print(f"Error during forensics analysis: {e}")
         return jsonify({'status': 'error', 'message': f'فشل في عملية التحليل: {str(e)}'}), 500
 
 
+# =========================================================
+# 3.1 نقطة نهاية التحليل الدفعي (بث النتائج بصيغة NDJSON)
+# =========================================================
+
+def _detach_uploaded_files():
+    """
+    Flask يغلق ملفات الطلب عند انتهاء دالة العرض، بينما يستمر البث بعدها.
+    نفصل الملفات عن الطلب ونغلقها بأنفسنا عند انتهاء البث.
+    """
+    files = request.files
+    request.__dict__.pop('files', None)
+    return files
+
+
+def _close_after(generator, files):
+    try:
+        yield from generator
+    finally:
+        for _, file in files.items(multi=True):
+            file.close()
+
+
+def _analyze_batch_item(name, raw_bytes, client=None):
+    # كل صورة تمر بالتحكم في القبول كطلب مستقل (الدفعة لا تتجاوز تخفيف الحمل)
+    try:
+        with ADMISSION.admit(client) as level:
+            full_analysis_data = analyze_full_forensics(
+                raw_bytes, include_visuals=False, include_ai=level < LEVEL_NO_CNN)
+    except AdmissionRejected as e:
+        raise BatchItemError(str(e), retry_after=e.retry_after, **degradation_fields(e.level)) from e
+    analysis_id = store_analysis(full_analysis_data, raw_bytes)
+    return {
+        **degradation_fields(level),
+        'analysis_id': analysis_id,
+        'confidence_score': float(full_analysis_data['final_score']),
+        'abshr_verdict': full_analysis_data['abshr_verdict'],
+        'report_url': f'/api/report?id={analysis_id}',
+    }
+
+
+@app.route('/api/abshr/batch-forensics', methods=['POST'])
+def abshr_batch_forensics():
+    """
+    يقبل أحد المدخلات التالية:
+    - قائمة ملفات multipart باسم 'images'
+    - أرشيف ZIP باسم 'archive'
+    - ملف بيان JSONL باسم 'manifest' أو جسم الطلب بنوع application/x-ndjson
+    ويبث سطر NDJSON لكل صورة فور اكتمال تحليلها.
+    """
+    # الحد الأكبر لهذا الطلب فقط، قبل أي قراءة للجسم
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+    try:
+        content_type = (request.mimetype or '').lower()
+        if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+            files = None
+            items = iter_manifest_items(request.stream)
+        else:
+            # الملفات المرفوعة تُحفظ مؤقتاً على القرص بواسطة Werkzeug (ليست في الذاكرة)
+            files = _detach_uploaded_files()
+            if files.getlist('images'):
+                items = iter_multipart_items(files.getlist('images'))
+            elif 'archive' in files:
+                try:
+                    items = iter_zip_items(open_zip_archive(files['archive'].stream))
+                except zipfile.BadZipFile:
+                    return jsonify({'status': 'error', 'message': 'ملف الأرشيف غير صالح.'}), 400
+            elif 'manifest' in files:
+                items = iter_manifest_items(files['manifest'].stream)
+            else:
+                return jsonify({'status': 'error', 'message': 'لم يتم العثور على صور أو أرشيف أو ملف بيان.'}), 400
+
+    except RequestEntityTooLarge:
+        return jsonify({'status': 'error', 'message': 'حجم الدفعة يتجاوز الحد الأقصى.'}), 413
+
+    # معرّف العميل يُحسب هنا: عمال الدفعة يعملون خارج سياق الطلب
+    results = stream_batch_results(items, partial(_analyze_batch_item, client=admission_client()))
+    if files is not None:
+        results = _close_after(results, files)
+    return Response(stream_with_context(results), mimetype='application/x-ndjson')
+
+
+# =========================================================
+# 3.2 وضع المهام غير المتزامنة (إرسال ثم استعلام)
+# =========================================================
+
+# مدة الانتظار المقترحة للعميل عند امتلاء الطابور (بالثواني)
+JOB_RETRY_AFTER_SECONDS = 5
+
+
+def _complete_job(full_analysis_data, raw_bytes):
+    analysis_id = store_analysis(full_analysis_data, raw_bytes)
+    return {
+        'analysis_id': analysis_id,
+        'confidence_score': float(full_analysis_data['final_score']),
+        'abshr_verdict': full_analysis_data['abshr_verdict'],
+        'report_url': f'/api/report?id={analysis_id}',
+    }
+
+
+JOBS = JobQueue(_complete_job, RESULTS)
+gauge_callback('sidq_jobs_in_flight', 'Queued or running jobs in this worker.', lambda: {(): JOBS.stats()['in_flight']})
+
+
+@app.route('/api/abshr/jobs', methods=['POST'])
+def submit_forensics_job():
+    try:
+        if 'image' not in request.files:
+            return jsonify({'status': 'error', 'message': 'لم يتم العثور على ملف الصورة.'}), 400
+
+        raw_bytes = request.files['image'].read()
+        # المهمة تعمل في مجمع العمليات: القبول هنا لحد العميل ومستوى الخدمة فقط،
+        # وزمن الإرسال لا يدخل في تقدير زمن التحليل
+        with ADMISSION.admit(admission_client(), record_latency=False) as level:
+            job_id = JOBS.submit(raw_bytes, include_ai=level < LEVEL_NO_CNN)
+
+    except AdmissionRejected as e:
+        response = jsonify(admission_rejected_body(e))
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({'status': 'error', 'message': 'حجم الملف يتجاوز الحد الأقصى (5MB).'}), 413
+    except QueueFull:
+        response = jsonify({'status': 'busy', 'message': 'الخادم مشغول حالياً، يرجى إعادة المحاولة لاحقاً.'})
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER_SECONDS)
+        return response, 503
+
+    return jsonify({
+        'status': 'accepted',
+        **degradation_fields(level),
+        'job_id': job_id,
+        'status_url': f'/api/abshr/jobs/{job_id}',
+    }), 202
+
+
+@app.route('/api/abshr/jobs/<job_id>', methods=['GET'])
+def get_forensics_job(job_id):
+    job_state = JOBS.status(job_id)
+    if job_state is None:
+        return jsonify({'status': 'error', 'message': 'المهمة غير موجودة أو انتهت صلاحيتها.'}), 404
+    return jsonify(dict(job_state, job_id=job_id))
+
+
 # =========================================================
 # 4. نقطة نهاية توليد تقرير PDF (المطلوبة!) - تمت الإضافة
 # =========================================================
 
+def _report_key(analysis_id):
+    return f'{analysis_id}:report'
+
+
+def get_report_pdf(analysis_id, record, include_gradcam=True):
+    """
+    بايتات تقرير PDF للتحليل: يُبنى مرة واحدة لكل تحليل ثم يُقدَّم من المخزن.
+    include_gradcam=False (تحت الضغط) يبني تقريراً بدون Grad-CAM لا يُخزَّن،
+    فيُبنى التقرير الكامل عند أول طلب بعد زوال الضغط.
+    """
+    pdf_bytes = RESULTS.get(_report_key(analysis_id))
+    if pdf_bytes is None:
+        asset_names = report_asset_names(record['results'])
+        if not include_gradcam:
+            asset_names = tuple(name for name in asset_names if name != 'gradcam')
+        # صور التقرير تُصغَّر وتُرمَّز JPEG الآن من الأصل المخزن (مرة واحدة لكل تحليل)
+        try:
+            with stage_timer('report_assets'):
+                images = REPORT_IMAGES.get_many(analysis_id, asset_names)
+        except KeyError:
+            images = {}
+
+        with stage_timer('report_render'):
+            pdf_bytes = build_report_pdf(record['results'], record.get('timestamp', 'غير متوفر'), images)
+        if include_gradcam:
+            RESULTS.put(_report_key(analysis_id), pdf_bytes)
+    return pdf_bytes
+
+
 @app.route('/api/report', methods=['GET'])
 def generate_report():
     
-    # 1. التحقق من وجود نتائج تحليل سابقة في الجلسة
-    analysis_data = session.get('last_analysis_results')
-    timestamp = session.get('analysis_timestamp', 'غير متوفر')
+    # 1. التحقق من وجود نتائج تحليل سابقة في مخزن النتائج
+    analysis_id = requested_analysis_id()
+    record = get_analysis_record(analysis_id)
     
-    if not analysis_data:
+    if not record:
         return jsonify({'status': 'error', 'message': 'لا توجد نتائج تحليل سابقة لإصدار تقرير.'}), 404
 
-    # 2. تهيئة ملف PDF
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    
-    # إعداد الخط الأساسي
-    font_size = 12
-    p.setFont(ARABIC_FONT, font_size)
-    line_height = font_size * 1.5
-    margin = 50
-    x, y = width - margin, height - margin
-
-    # 3. رأس التقرير والختم
-    p.setFont(ARABIC_FONT, 20)
-    p.drawRightString(x, y, "تقرير الأدلة الجنائية لخدمة صِدق (Sidq Report)")
-    y -= line_height * 2
-    
-    p.setFont(ARABIC_FONT, 10)
-    p.drawRightString(x, y, f"تاريخ ووقت التحليل: {timestamp}")
-    y -= line_height
+    # 2. التقرير يُبنى مرة واحدة لكل تحليل ثم يُقدَّم من المخزن
+    # (بدون Grad-CAM تحت الضغط حتى لا ينافس التحليلات على النموذج)
+    pdf_bytes = get_report_pdf(analysis_id, record, include_gradcam=ADMISSION.current_level() < LEVEL_NO_VISUALS)
 
-    # 4. قسم القرار الأمني (الختم)
-    p.setFillColor(colors.white)
-    
-    if analysis_data['abshr_verdict'] == 'CLEAN':
-        box_color = colors.green
-        verdict_text = "✅ أصالة مُؤكَّدة (CLEAN)"
-    elif analysis_data['abshr_verdict'] == 'CAUTION':
-        box_color = colors.orange
-        verdict_text = "⚠️ احتمالية تلاعب (CAUTION)"
-    else:
-        box_color = colors.red
-        verdict_text = "❌ تزوير مُؤكَّد (FORGED)"
-        
-    p.setFillColor(box_color)
-    p.rect(margin, y - 50, width - 2 * margin, 60, fill=1) # رسم مستطيل خلفي
-    
-    p.setFillColor(colors.white)
-    p.setFont(ARABIC_FONT, 18)
-    p.drawCentredString(width / 2, y - 30, verdict_text)
-    y -= line_height * 4
-
-    # 5. جدول المعلومات الأساسية
-    p.setFillColor(colors.black)
-    p.setFont(ARABIC_FONT, font_size)
-    p.drawRightString(x, y, "أ. البيانات الأساسية للوثيقة")
-    y -= line_height
-    
-    # دالة بسيطة لرسم سطر المعلومات
-    def draw_info_line(key, value):
-        nonlocal y
-        p.setFont(ARABIC_FONT, font_size)
-        p.drawRightString(x, y, key)
-        p.drawString(margin + 150, y, str(value))
-        y -= line_height
-    
-    draw_info_line("الدرجة النهائية:", f"{analysis_data['final_score']:.2f}%")
-    draw_info_line("صانع الكاميرا:", analysis_data['metadata']['make'])
-    draw_info_line("طراز الكاميرا:", analysis_data['metadata']['model'])
-    draw_info_line("تاريخ الالتقاط:", analysis_data['metadata']['datetime'])
-    draw_info_line("الأبعاد (بكسل):", analysis_data['metadata']['size'])
-    draw_info_line("صيغة الملف:", analysis_data['metadata']['format'])
-    y -= line_height
-
-    # 6. قسم نتائج التحليل التفصيلية (التحليل الجنائي)
-    p.drawRightString(x, y, "ب. نتائج التحليل الجنائي")
-    y -= line_height
-    
-    # دالة لرسم قسم التحليل
-    def draw_analysis_section(title, score, verdict, base64_img):
-        nonlocal y
-        p.setFillColor(colors.blue)
-        p.setFont(ARABIC_FONT, font_size)
-        p.drawRightString(x, y, title)
-        y -= line_height
-        
-        p.setFillColor(colors.black)
-        draw_info_line("الدرجة:", f"{score:.2f}%")
-        draw_info_line("الخلاصة:", verdict)
-        y -= line_height
-        
-        # عرض صورة الدليل الجنائي
-        if base64_img:
-            try:
-                img_data = base64.b64decode(base64_img)
-                img_stream = io.BytesIO(img_data)
-                img = ImageReader(img_stream)
-                # رسم الصورة (300 بكسل عرض)
-                img_w, img_h = 300, 300 * (img.getSize()[1] / img.getSize()[0])
-                
-                # التحقق من تجاوز حدود الصفحة
-                if y - img_h < margin:
-                    p.showPage()
-                    p.setFont(ARABIC_FONT, font_size)
-                    y = height - margin - line_height * 2 # بدء صفحة جديدة
-                
-                p.drawInlineImage(img, width - margin - img_w, y - img_h, width=img_w, height=img_h)
-                y -= img_h + line_height
-            except Exception as e:
-                p.setFillColor(colors.red)
-                p.drawRightString(x, y, f"❌ خطأ في عرض الصورة: {e}")
-                y -= line_height
-                p.setFillColor(colors.black)
-
-    # التحليل حسب الترتيب
-    draw_analysis_section("PRNU (تحليل ضوضاء الكاميرا)", 
-                          analysis_data['prnu_score'], 
-                          analysis_data['prnu_verdict'], 
-                          analysis_data['prnu_img_base64'])
-                          
-    draw_analysis_section("ELA (تحليل مستوى الخطأ)", 
-                          analysis_data['ela_score'], 
-                          analysis_data['ela_verdict'], 
-                          analysis_data['ela_img_base64'])
-
-    draw_analysis_section("AI/GradCAM (الذكاء الاصطناعي)", 
-                          analysis_data['ai_score'], 
-                          analysis_data['ai_verdict'], 
-                          analysis_data['gradcam_img_base64'])
-                          
-    # 7. الصورة الأصلية في نهاية التقرير
-    if analysis_data['original_img_base64']:
-        p.showPage() # صفحة جديدة للصورة الأصلية
-        y = height - margin
-        p.setFont(ARABIC_FONT, 14)
-        p.drawRightString(x, y, "ج. الصورة الأصلية المرسلة للتحليل")
-        y -= line_height * 2
-        
-        try:
-            img_data = base64.b64decode(analysis_data['original_img_base64'])
-            img_stream = io.BytesIO(img_data)
-            img = ImageReader(img_stream)
-            
-            # تحجيم الصورة لتناسب عرض الصفحة (بحد أقصى)
-            img_w, img_h = width - 2 * margin, (width - 2 * margin) * (img.getSize()[1] / img.getSize()[0])
-            
-            # رسم الصورة في منتصف الصفحة
-            p.drawInlineImage(img, margin, y - img_h, width=img_w, height=img_h)
-            y -= img_h
-        except Exception as e:
-            p.setFillColor(colors.red)
-            p.drawRightString(x, y, f"❌ خطأ في عرض الصورة الأصلية: {e}")
-            
-    # 8. حفظ التقرير وإرجاعه
-    p.save()
-    buffer.seek(0)
-    
-    # إرجاع ملف PDF للمتصفح
-    return send_file(buffer, as_attachment=True, download_name='Sidq_Report.pdf', mimetype='application/pdf')
+    # 3. بث ملف PDF للمتصفح على أجزاء
+    return Response(iter_chunks(pdf_bytes), mimetype='application/pdf', headers={
+        'Content-Length': str(len(pdf_bytes)),
+        'Content-Disposition': 'attachment; filename=Sidq_Report.pdf',
+    })
+
+
+# =========================================================
+# 4.1 الصور التوضيحية عند الطلب (PRNU، ELA، Grad-CAM، الأصل)
+# =========================================================
+
+@app.route('/api/artefact/<name>', methods=['GET'])
+def get_artefact(name):
+    if name not in ARTEFACT_KEYS:
+        return jsonify({'status': 'error', 'message': 'نوع الصورة غير معروف.'}), 404
+    # Grad-CAM يحتاج النموذج: يُؤجَّل تحت الضغط
+    level = ADMISSION.current_level() if name == 'gradcam' else 0
+    if level >= LEVEL_NO_VISUALS:
+        response = jsonify({
+            'status': 'busy', 'message': 'الخادم مشغول حالياً، يرجى إعادة المحاولة لاحقاً.', **degradation_fields(level),
+        })
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER_SECONDS)
+        return response, 503
+
+    analysis_id = requested_analysis_id()
+    record = get_analysis_record(analysis_id)
+    try:
+        if record and name == 'original':
+            # الأصل يُقدَّم من المخزن كما هو (بدون Base64 ذهاباً وإياباً)
+            source = ARTEFACTS.source(analysis_id)
+        else:
+            artefact_base64 = ARTEFACTS.get(analysis_id, name) if record else None
+    except KeyError:
+        record = None
+    if not record:
+        return jsonify({'status': 'error', 'message': 'لا توجد نتائج تحليل سابقة لهذه الصورة.'}), 404
+
+    if name == 'original':
+        image_format = record['results'].get('metadata', {}).get('format')
+        response = send_file(BufferReader(source), mimetype=Image.MIME.get(image_format, 'application/octet-stream'))
+        response.content_length = len(source)
+        return response
+    if not artefact_base64:
+        return jsonify({'status': 'error', 'message': 'تعذر توليد الصورة المطلوبة.'}), 404
+    return send_file(io.BytesIO(base64.b64decode(artefact_base64)), mimetype='image/png')
+
+
+# =========================================================
+# 4.2 فحوص الصحة والجاهزية
+# =========================================================
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # فحص الحياة: لا يلمس النموذج ولا TensorFlow
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    # فحص الجاهزية: 200 فقط عندما يكون الاستدلال جاهزاً (النموذج محمّل ومسخّن)
+    model_status = get_model_status()
+    return jsonify(model_status), (200 if model_status['ready'] else 503)
+
+
+# =========================================================
+# 4.3 مقاييس طابور الاستدلال المجمّع والذاكرة المؤقتة
+# =========================================================
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # مقاييس هذه العملية فقط (كل عامل gunicorn يُجمع منه على حدة)
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.route('/api/inference/stats', methods=['GET'])
+def inference_stats():
+    return jsonify(clean_for_json(get_inference_stats()))
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(clean_for_json(get_cache_stats()))
+
+
+@app.route('/api/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(ADMISSION.stats())
 
 
 # =========================================================
@@ -0,0 +1,86 @@
+import threading
+
+from image_context import load_image_context
+
+# =========================================================
+# الصور التوضيحية المولَّدة عند الطلب (فوق مخزن النتائج)
+# =========================================================
+
+# قيمة مميزة للتفريق بين "غير موجود" و "تم توليده لكنه فارغ"
+_MISSING = object()
+
+# صور تُشتق مباشرة من بايتات الأصل ولا تستحق نسخة مخزنة إضافية
+_UNCACHED_ARTEFACTS = ('original',)
+
+
+class ArtefactCache:
+    """
+    تحتفظ ببايتات الصورة الأصلية لكل تحليل في مخزن النتائج، وتولّد صور
+    PRNU و ELA و Grad-CAM عند أول طلب لها فقط ثم تخزنها بجانب النتيجة.
+
+    render_fn(image_context, name): دالة توليد صورة توضيحية واحدة (Base64).
+    store: مخزن النتائج (result_store) الذي يطبق TTL وحدود الحجم.
+    namespace: بادئة مفاتيح الصور، لعدة أنواع من الصور فوق نفس الأصل المخزن.
+    uncached: أسماء صور تُولَّد في كل مرة بدلاً من تخزينها.
+    """
+
+    def __init__(self, render_fn, store, lock_stripes=64, namespace='artefact', uncached=_UNCACHED_ARTEFACTS):
+        self.render_fn = render_fn
+        self.store = store
+        self.namespace = namespace
+        self.uncached = tuple(uncached)
+        # أقفال موزعة حسب معرّف التحليل لمنع توليد نفس الصورة مرتين بالتوازي
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    @staticmethod
+    def _source_key(analysis_id):
+        return f'{analysis_id}:source'
+
+    def _artefact_key(self, analysis_id, name):
+        return f'{analysis_id}:{self.namespace}:{name}'
+
+    def register(self, analysis_id, raw_bytes):
+        # نسخة bytes: العرض المربوط بالملف المؤقت (spool_upload) يُبقي واصف الملف
+        # مفتوحاً طالما بقي السجل في المخزن
+        if not isinstance(raw_bytes, bytes):
+            raw_bytes = bytes(raw_bytes)
+        self.store.put(self._source_key(analysis_id), raw_bytes)
+
+    def __contains__(self, analysis_id):
+        return self._source_key(analysis_id) in self.store
+
+    def source(self, analysis_id):
+        """بايتات الصورة الأصلية للتحليل (KeyError إذا انتهت صلاحيته)."""
+        raw_bytes = self.store.get(self._source_key(analysis_id))
+        if raw_bytes is None:
+            raise KeyError(analysis_id)
+        return raw_bytes
+
+    def get_many(self, analysis_id, names):
+        """
+        إرجاع الصور المطلوبة {name: base64}، مع توليد المفقود منها فقط.
+        يُفك ترميز الأصل مرة واحدة لكل دفعة توليد.
+        """
+        with self._locks[hash(analysis_id) % len(self._locks)]:
+            artefacts = {}
+            missing = []
+            for name in names:
+                value = _MISSING
+                if name not in self.uncached:
+                    value = self.store.get(self._artefact_key(analysis_id, name), _MISSING)
+                if value is _MISSING:
+                    missing.append(name)
+                else:
+                    artefacts[name] = value
+
+            if missing:
+                image_context = load_image_context(self.source(analysis_id))
+                for name in missing:
+                    artefacts[name] = self.render_fn(image_context, name)
+                    if name not in self.uncached:
+                        self.store.put(self._artefact_key(analysis_id, name), artefacts[name])
+
+            return artefacts
+
+    def get(self, analysis_id, name):
+        return self.get_many(analysis_id, [name])[name]
@@ -0,0 +1,180 @@
+import base64
+import json
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# =========================================================
+# التحليل الدفعي (Batch) مع بث النتائج بصيغة NDJSON
+# =========================================================
+
+# عدد العمال المتوازيين لتحليل صور الدفعة
+BATCH_WORKERS = int(os.environ.get('SIDQ_BATCH_WORKERS', '4'))
+# أقصى عدد من الصور المحمّلة في الذاكرة في نفس الوقت (قيد التحليل أو بانتظاره)
+BATCH_MAX_IN_FLIGHT = int(os.environ.get('SIDQ_BATCH_MAX_IN_FLIGHT', str(2 * BATCH_WORKERS)))
+# الحد الأقصى لحجم الصورة الواحدة داخل الدفعة
+BATCH_ITEM_MAX_BYTES = int(os.environ.get('SIDQ_BATCH_ITEM_MAX_BYTES', str(5 * 1024 * 1024)))
+# المجلد المسموح بقراءة مسارات ملف البيان (JSONL) منه؛ فارغ = المسارات غير مسموحة
+BATCH_MANIFEST_ROOT = os.environ.get('SIDQ_BATCH_ROOT', '')
+
+# امتدادات الصور المقبولة داخل الأرشيف
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+
+class BatchItemError(Exception):
+    """خطأ في عنصر واحد من الدفعة (لا يوقف بقية الدفعة)، مع حقول إضافية لسطر النتيجة."""
+
+    def __init__(self, message, **fields):
+        super().__init__(message)
+        self.fields = fields
+
+
+# ----------------------------------------------------
+# مصادر الدفعة: قائمة ملفات، أرشيف ZIP، ملف بيان JSONL
+# كل مصدر يُرجع (الاسم، دالة قراءة البايتات) بشكل كسول
+# ----------------------------------------------------
+
+def _read_limited(stream, name):
+    data = stream.read(BATCH_ITEM_MAX_BYTES + 1)
+    if len(data) > BATCH_ITEM_MAX_BYTES:
+        raise BatchItemError(f'حجم الملف {name} يتجاوز الحد الأقصى.')
+    return data
+
+
+def iter_multipart_items(files):
+    for file in files:
+        yield file.filename, (lambda file=file: _read_limited(file.stream, file.filename))
+
+
+def open_zip_archive(archive_stream):
+    """فتح أرشيف ZIP (يرفع zipfile.BadZipFile إذا كان الملف تالفاً)."""
+    return zipfile.ZipFile(archive_stream)
+
+
+def iter_zip_items(archive):
+    for info in archive.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        def load(info=info):
+            if info.file_size > BATCH_ITEM_MAX_BYTES:
+                raise BatchItemError(f'حجم الملف {info.filename} يتجاوز الحد الأقصى.')
+            with archive.open(info) as member:
+                return _read_limited(member, info.filename)
+
+        yield info.filename, load
+
+
+def _resolve_manifest_path(path):
+    if not BATCH_MANIFEST_ROOT:
+        raise BatchItemError('قراءة المسارات من ملف البيان غير مفعّلة (SIDQ_BATCH_ROOT).')
+    root = os.path.realpath(BATCH_MANIFEST_ROOT)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root:
+        raise BatchItemError(f'المسار خارج المجلد المسموح: {path}')
+    return full_path
+
+
+def iter_manifest_items(lines):
+    """
+    كل سطر JSON يحتوي على 'path' (نسبي إلى SIDQ_BATCH_ROOT) أو 'image_base64'،
+    مع 'id' أو 'name' اختياري للتعريف بالنتيجة.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            def load(line_number=line_number):
+                raise BatchItemError(f'سطر JSON غير صالح ({line_number}).')
+            yield f'line-{line_number}', load
+            continue
+
+        name = str(entry.get('id') or entry.get('name') or entry.get('path') or f'line-{line_number}')
+
+        def load(entry=entry, name=name):
+            if entry.get('image_base64'):
+                # فحص الطول المرمّز قبل فك الترميز (كل 4 محارف = 3 بايتات)
+                if len(entry['image_base64']) * 3 // 4 > BATCH_ITEM_MAX_BYTES + 2:
+                    raise BatchItemError(f'حجم الملف {name} يتجاوز الحد الأقصى.')
+                data = base64.b64decode(entry['image_base64'])
+                if len(data) > BATCH_ITEM_MAX_BYTES:
+                    raise BatchItemError(f'حجم الملف {name} يتجاوز الحد الأقصى.')
+                return data
+            if entry.get('path'):
+                with open(_resolve_manifest_path(entry['path']), 'rb') as f:
+                    return _read_limited(f, name)
+            raise BatchItemError("السطر لا يحتوي على 'path' أو 'image_base64'.")
+
+        yield name, load
+
+
+# ----------------------------------------------------
+# تشغيل الدفعة وبث النتائج فور اكتمال كل صورة
+# ----------------------------------------------------
+
+def stream_batch_results(items, process_fn, max_workers=BATCH_WORKERS, max_in_flight=BATCH_MAX_IN_FLIGHT):
+    """
+    تحليل عناصر الدفعة عبر مجمع عمال وإرجاع سطر NDJSON لكل صورة حال اكتمالها.
+
+    items: مولّد (الاسم، دالة القراءة). تُقرأ البايتات فقط عند الإرسال للتحليل،
+    ولا يتجاوز عدد الصور في الذاكرة max_in_flight، فلا تُحمَّل الدفعة كاملة.
+    process_fn(name, raw_bytes) -> dict: نتيجة صورة واحدة.
+    """
+    max_in_flight = max(1, max_in_flight)
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='sidq-batch')
+    pending = {}
+    items = iter(enumerate(items))
+    exhausted = False
+    processed = 0
+    failed = 0
+
+    def to_line(payload):
+        return json.dumps(payload, ensure_ascii=False) + '\n'
+
+    try:
+        while pending or not exhausted:
+            # ملء نافذة العمل حتى الحد الأقصى
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    index, (name, load) = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    raw_bytes = load()
+                except Exception as e:
+                    processed += 1
+                    failed += 1
+                    yield to_line({'index': index, 'name': name, 'status': 'error', 'message': str(e)})
+                    continue
+                pending[executor.submit(process_fn, name, raw_bytes)] = (index, name)
+
+            if not pending:
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, name = pending.pop(future)
+                processed += 1
+                try:
+                    payload = {'index': index, 'name': name, 'status': 'success'}
+                    payload.update(future.result())
+                except Exception as e:
+                    failed += 1
+                    payload = {'index': index, 'name': name, 'status': 'error', 'message': str(e)}
+                    payload.update(getattr(e, 'fields', None) or {})
+                yield to_line(payload)
+
+        # سطر ختامي بملخص الدفعة
+        yield to_line({'status': 'done', 'processed': processed, 'failed': failed})
+    finally:
+        # عند انقطاع اتصال العميل: إلغاء ما لم يبدأ بعد
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
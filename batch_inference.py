@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+
+from metrics import BATCH_SECONDS, BATCH_SIZE
+
+# =========================================================
+# خادم الاستدلال المجمّع (Micro-batching) أمام نموذج CNN
+# =========================================================
+
+# الحد الأقصى لعدد الصور في الدفعة الواحدة
+BATCH_MAX_SIZE = int(os.environ.get('SIDQ_BATCH_MAX_SIZE', '16'))
+# أقصى زمن انتظار (بالمللي ثانية) لتجميع الدفعة قبل تشغيلها
+BATCH_MAX_WAIT_MS = float(os.environ.get('SIDQ_BATCH_MAX_WAIT_MS', '5'))
+
+
+class MicroBatcher:
+    """
+    طابور داخل العملية يجمع الطلبات المتزامنة حتى N عنصر أو T مللي ثانية،
+    ثم ينفذ تمريرة أمامية واحدة ويوزع النتائج على المستدعين.
+
+    batch_fn: دالة تستقبل مصفوفة (N, ...) وتعيد N نتيجة بنفس الترتيب.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, name='batcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        # المقاييس
+        self._batches_total = 0
+        self._items_total = 0
+        self._last_batch_size = 0
+        self._batch_size_counts = {}
+
+    # ----------------------------------------------------
+    # واجهة المستدعين
+    # ----------------------------------------------------
+
+    def submit(self, item):
+        """إضافة عنصر واحد إلى الطابور وإرجاع Future بنتيجته."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def metrics(self):
+        with self._lock:
+            batches = self._batches_total
+            return {
+                'name': self.name,
+                'queue_depth': self._queue.qsize(),
+                'batches_total': batches,
+                'items_total': self._items_total,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': (self._items_total / batches) if batches else 0.0,
+                'batch_size_counts': dict(self._batch_size_counts),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+            }
+
+    # ----------------------------------------------------
+    # خيط التجميع
+    # ----------------------------------------------------
+
+    def _ensure_worker(self):
+        # الخيوط لا تنتقل مع fork، لذلك نعيد التشغيل داخل كل عامل gunicorn
+        with self._lock:
+            # الخيط الميت (استثناء أفلت من الحلقة) يُستبدل، وإلا تعلق كل الطلبات التالية
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name=f'sidq-{self.name}', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _collect(self):
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    pending.append(self._queue.get_nowait())
+                else:
+                    pending.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return pending
+
+    def _run(self):
+        while True:
+            pending = []
+            try:
+                pending = self._collect()
+                self._run_batch(pending)
+            except Exception as e:
+                # لا يُسمح للخيط بالموت ولا لطلب بالبقاء معلقاً: المستدعون ينتظرون نتائجهم منه
+                print(f"WARNING: خطأ غير متوقع في خيط التجميع {self.name}: {e}")
+                for _, future in pending:
+                    try:
+                        if not future.done():
+                            future.set_exception(e)
+                    except InvalidStateError:
+                        pass
+
+    def _run_batch(self, pending):
+        # تجاهل الطلبات التي ألغاها أصحابها أثناء الانتظار
+        pending = [(item, future) for item, future in pending if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+        items = [item for item, _ in pending]
+        futures = [future for _, future in pending]
+
+        start = time.perf_counter()
+        try:
+            results = self.batch_fn(np.stack(items))
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+            if not all(future.done() for future in futures):
+                raise RuntimeError(f'{self.name}: عدد النتائج أقل من عدد عناصر الدفعة')
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+        size = len(items)
+        BATCH_SECONDS.observe(time.perf_counter() - start, batcher=self.name)
+        BATCH_SIZE.observe(size, batcher=self.name)
+        with self._lock:
+            self._batches_total += 1
+            self._items_total += size
+            self._last_batch_size = size
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
@@ -0,0 +1,310 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# =========================================================
+# معيار أداء خط التحليل الجنائي (تشغيل محلي على CPU)
+#
+# أمثلة:
+#   python benchmark.py --output base.json
+#   SIDQ_STAGE_WORKERS=1 python benchmark.py --compare base.json
+#   python benchmark.py --scenarios full,flask --concurrency 4 --batch-max-size 8 --cache off
+# =========================================================
+
+DEFAULT_RESOLUTIONS = '640x480,1920x1080,4000x3000'
+DEFAULT_FORMATS = 'jpeg,png'
+DEFAULT_SCENARIOS = 'decode,prnu,ela,copymove,ai,full,flask'
+
+
+# ----------------------------------------------------
+# 1. صور اصطناعية قابلة لإعادة الإنتاج
+# ----------------------------------------------------
+
+def synthetic_image(width, height, seed):
+    """
+    صورة اصطناعية بمحتوى يشبه الصور الطبيعية (تدرجات، أشكال، ضوضاء مستشعر)
+    حتى يكون حجم ضغط JPEG/PNG وزمن المعالجة واقعيين. نفس البذرة = نفس الصورة.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.empty((height, width, 3), dtype=np.float32)
+    for channel in range(3):
+        fx, fy = rng.uniform(0.5, 4.0, size=2)
+        base[..., channel] = 128 + 60 * np.sin(fx * 2 * np.pi * x / width + channel) * np.cos(fy * 2 * np.pi * y / height)
+
+    # مستطيلات ملونة (حواف حادة لـ ELA)
+    for _ in range(12):
+        w, h = rng.integers(width // 20, width // 4), rng.integers(height // 20, height // 4)
+        x0, y0 = rng.integers(0, width - w), rng.integers(0, height - h)
+        base[y0:y0 + h, x0:x0 + w] = rng.uniform(20, 235, size=3)
+
+    # ضوضاء مستشعر (لـ PRNU)
+    base += rng.normal(0, 4, size=(height, width, 1))
+    return Image.fromarray(np.clip(base, 0, 255).astype(np.uint8), 'RGB')
+
+
+def encode_image(img, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'jpeg':
+        img.save(buffer, format='JPEG', quality=90)
+    else:
+        img.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def build_workload(resolution, image_format, count, unique):
+    """count صورة مرمّزة؛ unique=False يكرر نفس الصورة (لقياس الذاكرة المؤقتة)."""
+    width, height = resolution
+    seeds = range(count) if unique else [0] * count
+    cache = {}
+    workload = []
+    for seed in seeds:
+        if seed not in cache:
+            cache[seed] = encode_image(synthetic_image(width, height, seed + 1000 * width), image_format)
+        workload.append(cache[seed])
+    return workload
+
+
+# ----------------------------------------------------
+# 2. القياس
+# ----------------------------------------------------
+
+def peak_rss_mb():
+    # ru_maxrss بالكيلوبايت على Linux وبالبايت على macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(latencies, wall_seconds):
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000.0
+    return {
+        'count': int(latencies_ms.size),
+        'throughput_per_s': round(latencies_ms.size / wall_seconds, 3) if wall_seconds > 0 else None,
+        'latency_ms': {
+            'mean': round(float(latencies_ms.mean()), 2),
+            'min': round(float(latencies_ms.min()), 2),
+            'p50': round(float(np.percentile(latencies_ms, 50)), 2),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 2),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 2),
+            'max': round(float(latencies_ms.max()), 2),
+        },
+    }
+
+
+def run_timed(func, workload, concurrency, warmup):
+    """تشغيل func على كل عنصر (بالتوازي حسب concurrency) وقياس زمن كل استدعاء."""
+    # صور الإحماء منفصلة عن صور القياس حتى لا تُحسب إصابات للذاكرة المؤقتة
+    for payload in workload[:warmup]:
+        func(payload)
+    workload = workload[warmup:]
+
+    latencies = []
+    lock = threading.Lock()
+
+    def timed_call(payload):
+        start = time.perf_counter()
+        func(payload)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    wall_start = time.perf_counter()
+    if concurrency <= 1:
+        for payload in workload:
+            timed_call(payload)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed_call, workload))
+    return summarize(latencies, time.perf_counter() - wall_start)
+
+
+# ----------------------------------------------------
+# 3. السيناريوهات
+# ----------------------------------------------------
+
+def build_scenarios(include_visuals):
+    # الاستيراد هنا بعد ضبط متغيرات البيئة من سطر الأوامر
+    import ai_forensics
+    from image_context import load_image_context
+
+    def decode(raw):
+        load_image_context(raw).gray
+
+    def prnu(raw):
+        ai_forensics.extract_noise_pattern(load_image_context(raw), include_visuals)
+
+    def ela(raw):
+        ai_forensics.analyze_ela(load_image_context(raw), include_visuals=include_visuals)
+
+    def copymove(raw):
+        ai_forensics.analyze_copy_move(load_image_context(raw), include_visuals)
+
+    def ai(raw):
+        ai_forensics.analyze_ai(load_image_context(raw), include_visuals)
+
+    def full(raw):
+        ai_forensics.analyze_full_forensics(io.BytesIO(raw), include_visuals=include_visuals)
+
+    client = None
+
+    def flask(raw):
+        nonlocal client
+        if client is None:
+            import app_flask
+            client = app_flask.app.test_client()
+        response = client.post(
+            '/api/abshr/security-forensics',
+            data={'image': (io.BytesIO(raw), 'benchmark.jpg')},
+            content_type='multipart/form-data',
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f'security-forensics: HTTP {response.status_code}')
+        if include_visuals:
+            report = client.get(response.get_json()['report_url'])
+            if report.status_code != 200:
+                raise RuntimeError(f'report: HTTP {report.status_code}')
+
+    return {
+        'decode': decode, 'prnu': prnu, 'ela': ela, 'copymove': copymove, 'ai': ai, 'full': full, 'flask': flask,
+    }
+
+
+def environment_info():
+    info = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'config': {k: v for k, v in sorted(os.environ.items()) if k.startswith('SIDQ_')},
+    }
+    try:
+        import PIL
+        info['pillow'] = PIL.__version__
+    except Exception:
+        pass
+    if 'tensorflow' in sys.modules:
+        info['tensorflow'] = sys.modules['tensorflow'].__version__
+    return info
+
+
+def compare(results, baseline_path):
+    """طباعة الفرق النسبي مقابل نتيجة سابقة (لمقارنة الإصدارات والإعدادات)."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {
+            (r['scenario'], r['format'], r['resolution']): r for r in json.load(f)['results']
+        }
+    print(f"\nمقارنة مع {baseline_path} (موجب = أبطأ):", file=sys.stderr)
+    for result in results:
+        key = (result['scenario'], result['format'], result['resolution'])
+        if key not in baseline or 'error' in result or 'error' in baseline[key]:
+            continue
+        line = [f"  {'/'.join(key):32}"]
+        for stat in ('p50', 'p95', 'p99'):
+            old, new = baseline[key]['latency_ms'][stat], result['latency_ms'][stat]
+            line.append(f"{stat} {((new - old) / old * 100.0) if old else 0.0:+6.1f}%")
+        print('  '.join(line), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sidq forensics pipeline benchmark')
+    parser.add_argument('--resolutions', default=DEFAULT_RESOLUTIONS, help='WxH,...')
+    parser.add_argument('--formats', default=DEFAULT_FORMATS, help='jpeg,png')
+    parser.add_argument('--scenarios', default=DEFAULT_SCENARIOS, help=DEFAULT_SCENARIOS)
+    parser.add_argument('--iterations', type=int, default=10, help='عدد الصور المقاسة لكل حالة')
+    parser.add_argument('--warmup', type=int, default=1, help='استدعاءات إحماء غير محسوبة')
+    parser.add_argument('--concurrency', type=int, default=1, help='عدد الطلبات المتزامنة')
+    parser.add_argument('--visuals', action='store_true', help='توليد الصور التوضيحية والتقرير أيضاً')
+    parser.add_argument('--repeat-same', action='store_true', help='نفس الصورة في كل تكرار (إصابات الذاكرة المؤقتة)')
+    parser.add_argument('--stage-workers', type=int, help='SIDQ_STAGE_WORKERS')
+    parser.add_argument('--batch-max-size', type=int, help='SIDQ_BATCH_MAX_SIZE')
+    parser.add_argument('--batch-max-wait-ms', type=float, help='SIDQ_BATCH_MAX_WAIT_MS')
+    parser.add_argument('--cache', choices=('on', 'off'), help='SIDQ_RESULT_CACHE')
+    parser.add_argument('--cascade', choices=('on', 'off'), help='SIDQ_CASCADE')
+    parser.add_argument('--label', default='', help='اسم للتشغيل يُحفظ في النتيجة')
+    # ملف وليس المخرج القياسي: الوحدات تطبع رسائل حالة عند الاستيراد
+    parser.add_argument('--output', default='benchmark_results.json', help='ملف JSON للنتائج')
+    parser.add_argument('--compare', help='ملف JSON سابق للمقارنة')
+    args = parser.parse_args(argv)
+
+    # الإعدادات تُقرأ عند استيراد الوحدات، لذلك تُضبط قبل أي استيراد
+    overrides = {
+        'SIDQ_STAGE_WORKERS': args.stage_workers,
+        'SIDQ_BATCH_MAX_SIZE': args.batch_max_size,
+        'SIDQ_BATCH_MAX_WAIT_MS': args.batch_max_wait_ms,
+        'SIDQ_RESULT_CACHE': {'on': '1', 'off': '0', None: None}[args.cache],
+        'SIDQ_CASCADE': {'on': '1', 'off': '0', None: None}[args.cascade],
+    }
+    for key, value in overrides.items():
+        if value is not None:
+            os.environ[key] = str(value)
+    # النموذج يُحمَّل مرة واحدة قبل القياس بدلاً من أول طلب
+    os.environ.setdefault('SIDQ_MODEL_WARMUP', 'eager')
+
+    scenarios = build_scenarios(args.visuals)
+    import ai_forensics
+    ai_forensics.start_model_warm_up()
+
+    resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in args.resolutions.split(',') if r]
+    formats = [f.strip().lower() for f in args.formats.split(',') if f.strip()]
+    names = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f'سيناريو غير معروف: {", ".join(unknown)}')
+
+    results = []
+    for image_format in formats:
+        for resolution in resolutions:
+            workload = build_workload(resolution, image_format, args.iterations + args.warmup, not args.repeat_same)
+            for name in names:
+                result = {
+                    'scenario': name,
+                    'format': image_format,
+                    'resolution': f'{resolution[0]}x{resolution[1]}',
+                    'upload_bytes': int(np.mean([len(raw) for raw in workload])),
+                    'concurrency': args.concurrency,
+                }
+                try:
+                    result.update(run_timed(scenarios[name], workload, args.concurrency, args.warmup))
+                except Exception as e:
+                    result['error'] = str(e)
+                result['peak_rss_mb'] = peak_rss_mb()
+                results.append(result)
+
+                summary = result.get('latency_ms', {})
+                print(
+                    f"{name:6} {image_format:4} {result['resolution']:>10}  "
+                    f"p50 {summary.get('p50', '-'):>9} ms  p95 {summary.get('p95', '-'):>9} ms  "
+                    f"p99 {summary.get('p99', '-'):>9} ms  {result.get('throughput_per_s', '-')}/s  "
+                    f"rss {result['peak_rss_mb']} MB {result.get('error', '')}",
+                    file=sys.stderr,
+                )
+
+    report = {
+        'label': args.label,
+        'environment': environment_info(),
+        'options': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'inference': ai_forensics.get_inference_stats(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f'تم حفظ النتائج في {args.output}', file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import os
+
+from metrics import counter
+
+# =========================================================
+# الدرجة النهائية والتقييم المتتالي مع الخروج المبكر (Cascade)
+# =========================================================
+
+# أوزان المراحل في الدرجة النهائية
+STAGE_WEIGHTS = {'ai': 0.35, 'prnu': 0.25, 'ela': 0.25, 'copymove': 0.15}
+
+# حدود القرار الأمني: أقل من 40 تزوير، أقل من 75 تحذير، وإلا أصالة
+FORGED_BELOW = 40.0
+CLEAN_FROM = 75.0
+
+# المدى الممكن لدرجة كل مرحلة (يحدد متى لا تستطيع المراحل المتبقية تغيير القرار):
+# AI بين 0 و 100، PRNU بين 0 و 90 (تطابق البصمة)، ELA إحدى 30 أو 75 أو 90،
+# النسخ واللصق إحدى 20 أو 50 أو 90
+DEFAULT_STAGE_SCORE_BOUNDS = {
+    'ai': (0.0, 100.0), 'prnu': (0.0, 90.0), 'ela': (30.0, 90.0), 'copymove': (20.0, 90.0),
+}
+
+# التقييم المتتالي اختياري (SIDQ_CASCADE=1): المراحل تُنفذ بالتتابع بدلاً من التوازي
+# ويُتوقف عند حسم القرار. الترتيب الافتراضي يؤخر المراحل الأغلى: PRNU ثم ELA ثم النسخ
+# واللصق (الأغلى في benchmark.py) ثم CNN (تحميل النموذج وانتظار الدفعة).
+CASCADE_ENABLED = os.environ.get('SIDQ_CASCADE', '0') == '1'
+CASCADE_ORDER = tuple(
+    stage.strip() for stage in os.environ.get('SIDQ_CASCADE_ORDER', 'prnu,ela,copymove,ai').split(',')
+    if stage.strip()
+)
+
+# مع الأوزان الافتراضية لا تحسم المدياتُ وحدها القرار قبل CNN (مساهمته تصل إلى 35 =
+# عرض نطاق التحذير)، لذا تحسمه قواعد على إشارات مراحل منفردة قاطعة بذاتها:
+# (القرار، {المرحلة: (أدنى، أعلى) درجة شاملة}) وتنطبق القاعدة عند تنفيذ كل مراحلها.
+CASCADE_RULES = (
+    # منطقة منسوخة مؤكدة (نسبة المنسوخ ≥ COPY_MOVE_FORGED_RATIO بعد استبعاد الأنماط الدورية)
+    ('FORGED', {'copymove': (0.0, 20.0)}),
+    # ضوضاء المستشعر مفقودة أو لا تطابق الكاميرا المذكورة، مع خطأ ضغط مرتفع في ELA
+    ('FORGED', {'prnu': (0.0, 25.0), 'ela': (0.0, 30.0)}),
+    # تطابق بصمة الكاميرا (PCE، الدرجة 90 لا تأتي إلا منه) مع ELA منخفض وبدون نسخ
+    ('CLEAN', {'prnu': (90.0, 100.0), 'ela': (90.0, 100.0), 'copymove': (90.0, 100.0)}),
+)
+
+CASCADE_SKIPPED = counter('sidq_cascade_skipped_total', 'Stages skipped by the early-exit cascade.', ['stage'])
+
+
+def _parse_bounds(value, defaults=DEFAULT_STAGE_SCORE_BOUNDS):
+    """SIDQ_CASCADE_BOUNDS بصيغة 'ai=10:90,ela=30:90' (المراحل غير المذكورة تبقى افتراضية)."""
+    bounds = dict(defaults)
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        try:
+            stage, limits = item.split('=')
+            low, high = (float(v) for v in limits.split(':'))
+        except ValueError:
+            print(f"WARNING: قيمة غير صالحة في SIDQ_CASCADE_BOUNDS: {item!r}. سيتم تجاهلها.")
+            continue
+        bounds[stage.strip()] = (min(low, high), max(low, high))
+    return bounds
+
+
+STAGE_SCORE_BOUNDS = _parse_bounds(os.environ.get('SIDQ_CASCADE_BOUNDS', ''))
+
+
+def cascade_version():
+    """بصمة إعدادات التقييم المتتالي (تدخل في إصدار التحليل لأن النتائج تختلف)."""
+    if not CASCADE_ENABLED:
+        return 'cascade=off'
+    return f'cascade={",".join(CASCADE_ORDER)}:{sorted(STAGE_SCORE_BOUNDS.items())}:{CASCADE_RULES}'
+
+
+def verdict_for(score):
+    if score < FORGED_BELOW:
+        return "FORGED"
+    if score < CLEAN_FROM:
+        return "CAUTION"
+    return "CLEAN"
+
+
+def final_score_range(scores, bounds=STAGE_SCORE_BOUNDS, omitted=()):
+    """
+    أدنى وأعلى درجة نهائية ممكنة بمعلومية درجات المراحل المنفذة فقط
+    (None أو مرحلة غائبة = لم تُنفذ بعد، فتؤخذ بمداها الكامل).
+    omitted: مراحل لن تُنفذ أصلاً (مثلاً CNN عند تخفيف الحمل)، فتُستبعد وتُعاد
+    موازنة أوزان بقية المراحل لتجمع 1.
+    """
+    weights = {stage: weight for stage, weight in STAGE_WEIGHTS.items() if stage not in omitted}
+    total = sum(weights.values())
+    low = high = 0.0
+    for stage, weight in weights.items():
+        weight /= total
+        score = scores.get(stage)
+        if score is None:
+            stage_low, stage_high = bounds[stage]
+            low += weight * stage_low
+            high += weight * stage_high
+        else:
+            low += weight * score
+            high += weight * score
+    return min(max(low, 0.0), 100.0), min(max(high, 0.0), 100.0)
+
+
+def decisive_verdict(scores, rules=CASCADE_RULES):
+    """قرار أول قاعدة حسم تنطبق على درجات المراحل المنفذة، أو None."""
+    for verdict, conditions in rules:
+        if all(
+            scores.get(stage) is not None and low <= scores[stage] <= high
+            for stage, (low, high) in conditions.items()
+        ):
+            return verdict
+    return None
+
+
+def combine_scores(scores, omitted=(), decided=None):
+    """
+    الدرجة النهائية والقرار الأمني من درجات المراحل.
+    عند تخطي مراحل تُرجع الحد الأحوط المتسق مع القرار (الأدنى للأصالة والأعلى للتزوير).
+    المراحل في omitted لم تُنفذ عمداً وتُوزع أوزانها على البقية (انظر final_score_range).
+    decided: قرار قاعدة حسم (انظر run_cascade)؛ الدرجة تُحسب من المراحل المنفذة فقط
+    وتُحصر في نطاق القرار.
+    """
+    if decided is not None:
+        skipped = tuple(stage for stage in STAGE_WEIGHTS if scores.get(stage) is None)
+        score, _ = final_score_range(scores, omitted=tuple(omitted) + skipped)
+        if decided == "FORGED":
+            return min(score, FORGED_BELOW - 1.0), decided
+        return max(score, CLEAN_FROM), decided
+    low, high = final_score_range(scores, omitted=omitted)
+    verdict = verdict_for(low) if verdict_for(low) == verdict_for(high) else "CAUTION"
+    if verdict == "CLEAN":
+        return low, verdict
+    if verdict == "FORGED":
+        return high, verdict
+    return (low + high) / 2.0, verdict
+
+
+def run_cascade(stages, order=CASCADE_ORDER):
+    """
+    تنفيذ المراحل بالترتيب order والتوقف عندما يُحسم القرار الأمني: بقاعدة من
+    CASCADE_RULES، أو لأن درجات المراحل المتبقية لا تستطيع تغييره.
+
+    stages: {اسم المرحلة: دالة بدون معاملات تُرجع مجموعة أولها الدرجة}.
+    المراحل غير المذكورة في order تُنفذ في النهاية، والمراحل الموزونة الغائبة عن
+    stages تُعامل كمستبعدة (omitted).
+    تُرجع (النتائج حسب الاسم، أسماء المراحل المتخطاة، قرار قاعدة الحسم أو None)
+    ويُمرر القرار إلى combine_scores(decided=...).
+    """
+    order = [stage for stage in order if stage in stages] + [stage for stage in stages if stage not in order]
+    # المراحل الموزونة غير الممررة لن تُنفذ (أُسقطت عمداً)، فتُستبعد من المدى
+    omitted = tuple(stage for stage in STAGE_WEIGHTS if stage not in stages)
+    results, scores = {}, {}
+    for index, stage in enumerate(order):
+        results[stage] = stages[stage]()
+        scores[stage] = results[stage][0]
+
+        decided = decisive_verdict(scores)
+        low, high = final_score_range(scores, omitted=omitted)
+        if decided is not None or verdict_for(low) == verdict_for(high):
+            skipped = order[index + 1:]
+            for skipped_stage in skipped:
+                CASCADE_SKIPPED.inc(stage=skipped_stage)
+            return results, skipped, decided
+    return results, [], None
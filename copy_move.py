@@ -0,0 +1,206 @@
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+# =========================================================
+# كشف النسخ واللصق داخل الصورة (Copy-Move) بمطابقة الكتل المتجهة
+#
+# ختم أو رقم منسوخ داخل نفس المستند يترك كتلاً متطابقة بإزاحة ثابتة. بدلاً من
+# مقارنة كل كتلة بكل كتلة (تربيعي)، تُحسب ميزات DCT لكل الكتل المتداخلة دفعة واحدة،
+# وتُرتب معجمياً فتتجاور الكتل المتطابقة، ثم تُجمع أزواجها حسب متجه الإزاحة:
+# الإزاحة التي تتكرر لعدد كافٍ من الكتل = منطقة منسوخة. الزمن شبه خطي في المساحة.
+# =========================================================
+
+# ميزانية البكسلات: الصور الأكبر تُصغّر قبل التحليل (النسخ يبقى نسخاً بعد التصغير)
+COPY_MOVE_MAX_PIXELS = int(os.environ.get('SIDQ_COPY_MOVE_MAX_PIXELS', str(1000 * 1000)))
+# حجم الكتلة، والخطوة بين الكتل المتداخلة (الخطوة 2 تربع عدد الكتل إلى الربع)
+COPY_MOVE_BLOCK_SIZE = 8
+COPY_MOVE_STRIDE = 2
+# عدد معاملات DCT منخفضة التردد لكل بُعد (4×4 = 16 ميزة لكل كتلة)
+COPY_MOVE_FEATURES = 4
+# مفتاح الترتيب المعجمي: أول 3 معاملات (المتوسط وأول ترددين) مكممة بهذه الخطوة
+COPY_MOVE_SORT_KEYS = 3
+COPY_MOVE_QUANTIZATION = 8.0
+# كل كتلة تُقارن بالكتل التالية لها في الترتيب فقط، وتُعد مطابقة تحت هذه المسافة
+# (إعادة ضغط JPEG والضوضاء تمنع التطابق التام للمعاملات)
+COPY_MOVE_NEIGHBOURS = 4
+COPY_MOVE_MAX_DISTANCE = 15.0
+# الكتل شبه المسطحة (خلفية المستند) تتطابق دائماً، فتُستبعد تحت هذا الانحراف المعياري
+COPY_MOVE_MIN_STD = 4.0
+# أقل طول لمتجه الإزاحة بالبكسل (الكتل المتجاورة متشابهة طبيعياً)
+COPY_MOVE_MIN_SHIFT = 32
+# أقل عدد أزواج كتل بنفس الإزاحة لاعتبارها منطقة منسوخة
+COPY_MOVE_MIN_PAIRS = 32
+# الحروف المتكررة والتدرجات تعطي تطابقات طبيعية بإزاحات كثيرة؛ المنطقة المنسوخة
+# إزاحة شاذة: أزواجها لا تقل عن هذا المضاعف من خط الأساس (وسيط أكثر الإزاحات تكراراً)
+COPY_MOVE_MIN_RATIO = 3.0
+COPY_MOVE_BASELINE_SHIFTS = 16
+# الخانات المتكررة بمسافات ثابتة (أرقام الهوية وجداول النماذج) تتطابق بإزاحة دورية v
+# ومضاعفها 2v معاً، بينما المنطقة المنسوخة إزاحة منفردة. تُستبعد الإزاحة إذا بلغت أزواج
+# مضاعفها هذه النسبة من أزواجها
+COPY_MOVE_LATTICE_FRACTION = 0.25
+
+
+def _dct_matrix(size, count):
+    """أول count صفاً من مصفوفة DCT-II المتعامدة (size × size)."""
+    n = np.arange(size)
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n[None, :] + 1) * np.arange(count)[:, None] / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def _window_sums(values, size):
+    """مجموع كل نافذة size × size تنتهي عند كل بكسل (صورة تكاملية مع حشو بالأصفار)."""
+    integral = np.pad(values, ((size, 0), (size, 0))).cumsum(0).cumsum(1)
+    return integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+
+
+def _analysis_image(gray_img, max_pixels):
+    """الصورة الرمادية ضمن الميزانية (float32) ومعامل التصغير."""
+    width, height = gray_img.size
+    factor = max(1.0, float(np.sqrt(width * height / max_pixels)))
+    if factor > 1.0:
+        gray_img = gray_img.resize((max(1, int(width / factor)), max(1, int(height / factor))), Image.BOX)
+    return np.asarray(gray_img, dtype=np.float32), factor
+
+
+def block_features(gray, block_size=COPY_MOVE_BLOCK_SIZE, stride=COPY_MOVE_STRIDE, features=COPY_MOVE_FEATURES):
+    """
+    معاملات DCT منخفضة التردد لكل الكتل المتداخلة (كل stride بكسل) دفعة واحدة.
+    DCT ثنائي الأبعاد قابل للفصل: تمريرة رأسية ثم أفقية على نوافذ متدرجة (بدون نسخ الكتل)،
+    فالتكلفة خطية في المساحة. تُرجع (المعاملات rows × cols × features², الانحراف المعياري لكل كتلة).
+    """
+    dct = _dct_matrix(block_size, features)
+    # (rows, W, block) @ (block, features) -> (rows, W, features)
+    vertical = sliding_window_view(gray, block_size, axis=0)[::stride] @ dct.T
+    # (rows, cols, features, block) @ (block, features) -> (rows, cols, features, features)
+    coefficients = sliding_window_view(vertical, block_size, axis=1)[:, ::stride] @ dct.T
+    rows, cols = coefficients.shape[:2]
+
+    # الانحراف المعياري لكل كتلة من مجاميع نوافذ x و x² (النافذة المنتهية عند
+    # الزاوية السفلى للكتلة = الكتلة التي تبدأ عند موضعها)
+    area = block_size * block_size
+    corner = np.s_[block_size - 1::stride, block_size - 1::stride]
+    gray = gray.astype(np.float64)
+    mean = _window_sums(gray, block_size)[corner] / area
+    variance = _window_sums(np.square(gray), block_size)[corner] / area - np.square(mean)
+    std = np.sqrt(np.maximum(variance, 0.0))[:rows, :cols]
+    return coefficients.reshape(rows, cols, features * features), std
+
+
+def match_blocks(coefficients, std, stride=COPY_MOVE_STRIDE):
+    """
+    مطابقة الكتل المتشابهة عبر الترتيب المعجمي ثم مقارنة كل كتلة بجيرانها في الترتيب.
+    تُرجع (مصفوفة الكتل المنسوخة rows × cols، الإزاحات المعتمدة [(dy, dx, عدد الأزواج)]، خط الأساس).
+    """
+    rows, cols = std.shape
+    mask = np.zeros((rows, cols), dtype=bool)
+    textured = np.flatnonzero(std.ravel() >= COPY_MOVE_MIN_STD)
+    if textured.size < 2:
+        return mask, [], 0.0
+
+    features = coefficients.reshape(rows * cols, -1)[textured]
+    keys = np.round(features[:, :COPY_MOVE_SORT_KEYS] / COPY_MOVE_QUANTIZATION).astype(np.int32)
+    order = np.lexsort(keys.T[::-1])
+    features, textured = features[order], textured[order]
+
+    firsts, seconds = [], []
+    for offset in range(1, min(COPY_MOVE_NEIGHBOURS, textured.size - 1) + 1):
+        distance = np.sqrt(np.square(features[offset:] - features[:-offset]).sum(axis=1))
+        close = distance <= COPY_MOVE_MAX_DISTANCE
+        firsts.append(textured[:-offset][close])
+        seconds.append(textured[offset:][close])
+    first, second = np.concatenate(firsts), np.concatenate(seconds)
+
+    # متجه الإزاحة لكل زوج بالبكسل، موحّد الاتجاه (dy > 0 أو dy = 0 و dx > 0)
+    dy = (second // cols - first // cols) * stride
+    dx = (second % cols - first % cols) * stride
+    flip = (dy < 0) | ((dy == 0) & (dx < 0))
+    dy, dx = np.where(flip, -dy, dy), np.where(flip, -dx, dx)
+    far = dy * dy + dx * dx >= COPY_MOVE_MIN_SHIFT * COPY_MOVE_MIN_SHIFT
+    first, second, dy, dx = first[far], second[far], dy[far], dx[far]
+    if first.size == 0:
+        return mask, [], 0.0
+
+    # عدّ الأزواج لكل إزاحة، والإزاحات الشاذة عن خط الأساس هي مناطق منسوخة
+    shift_keys = dy.astype(np.int64) * (2 * cols * stride + 1) + dx
+    _, representative, inverse, counts = np.unique(
+        shift_keys, return_index=True, return_inverse=True, return_counts=True)
+    ranked = np.argsort(-counts, kind='stable')
+    baseline = float(np.median(counts[ranked[:COPY_MOVE_BASELINE_SHIFTS]]))
+    threshold = max(COPY_MOVE_MIN_PAIRS, COPY_MOVE_MIN_RATIO * baseline)
+
+    candidates = {
+        (int(dy[representative[index]]), int(dx[representative[index]])): int(counts[index])
+        for index in np.flatnonzero(counts >= COPY_MOVE_MIN_PAIRS)
+    }
+    keep = np.zeros(counts.size, dtype=bool)
+    for index in np.flatnonzero(counts >= threshold):
+        shift = (int(dy[representative[index]]), int(dx[representative[index]]))
+        keep[index] = not _is_lattice_shift(shift, int(counts[index]), candidates, stride)
+
+    accepted = keep[inverse]
+    mask.ravel()[first[accepted]] = True
+    mask.ravel()[second[accepted]] = True
+    shifts = [
+        (int(dy[representative[index]]), int(dx[representative[index]]), int(counts[index]))
+        for index in ranked if keep[index]
+    ]
+    return mask, shifts, baseline
+
+
+def _is_lattice_shift(shift, count, candidates, stride):
+    """
+    هل الإزاحة دورية: مضاعفها 2v مطابق أيضاً بعدد كافٍ من الأزواج
+    (بتسامح خطوة واحدة في كل بعد لأن الإزاحات مكممة بالخطوة).
+    """
+    needed = max(COPY_MOVE_MIN_PAIRS, COPY_MOVE_LATTICE_FRACTION * count)
+    for jitter_y in (-stride, 0, stride):
+        for jitter_x in (-stride, 0, stride):
+            double_y, double_x = 2 * shift[0] + jitter_y, 2 * shift[1] + jitter_x
+            if double_y < 0 or (double_y == 0 and double_x < 0):
+                double_y, double_x = -double_y, -double_x
+            if candidates.get((double_y, double_x), 0) >= needed:
+                return True
+    return False
+
+
+def detect_copy_move(gray_img, max_pixels=COPY_MOVE_MAX_PIXELS, keep_mask_image=False):
+    """
+    كشف المناطق المنسوخة داخل الصورة.
+    تُرجع (الإحصاءات، صورة القناع فوق الصورة المحللة أو None).
+
+    الإحصاءات: نسبة المساحة المنسوخة، عدد الأزواج لأقوى إزاحة، وأقوى الإزاحات
+    (بمقياس الصورة الأصلية).
+    """
+    gray, factor = _analysis_image(gray_img, max_pixels)
+    if min(gray.shape) < COPY_MOVE_BLOCK_SIZE:
+        return {'cloned_ratio': 0.0, 'top_pairs': 0, 'baseline_pairs': 0.0, 'shifts': [], 'scale': round(factor, 3)}, None
+
+    coefficients, std = block_features(gray)
+    mask, shifts, baseline = match_blocks(coefficients, std)
+
+    # البكسل منسوخ إذا غطّته كتلة منسوخة (تبدأ ضمن block_size بكسل قبله في البعدين)
+    starts = np.zeros(gray.shape, dtype=np.int32)
+    starts[::COPY_MOVE_STRIDE, ::COPY_MOVE_STRIDE][:mask.shape[0], :mask.shape[1]] = mask
+    pixel_mask = _window_sums(starts, COPY_MOVE_BLOCK_SIZE) > 0
+
+    stats = {
+        'cloned_ratio': round(float(pixel_mask.mean()), 4),
+        'top_pairs': shifts[0][2] if shifts else 0,
+        'baseline_pairs': round(baseline, 1),
+        'shifts': [
+            {'dy': round(dy * factor), 'dx': round(dx * factor), 'pairs': count} for dy, dx, count in shifts[:5]
+        ],
+        'scale': round(factor, 3),
+    }
+    return stats, (_mask_overlay(gray, pixel_mask) if keep_mask_image else None)
+
+
+def _mask_overlay(gray, pixel_mask):
+    """المناطق المنسوخة بالأحمر فوق الصورة المحللة."""
+    base = Image.fromarray(gray.astype(np.uint8), 'L').convert('RGB')
+    red = Image.new('RGB', base.size, (255, 0, 0))
+    return Image.composite(red, base, Image.fromarray(pixel_mask.astype(np.uint8) * 160, 'L'))
@@ -0,0 +1,159 @@
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image, ImageChops, ImageStat
+
+from image_context import iter_tiles
+
+# =========================================================
+# محرك ELA (Error Level Analysis) قليل النسخ بعدة جودات
+# =========================================================
+
+# الجودة الأساسية (التي تُحسب منها الدرجة) ومعامل تضخيم الفروق
+ELA_QUALITY = 95
+ELA_SCALE_FACTOR = 15
+# جودات إضافية تُحلل في نفس الاستدعاء (Multi-quality ELA / JPEG ghosts)
+ELA_EXTRA_QUALITIES = tuple(
+    int(q) for q in os.environ.get('SIDQ_ELA_EXTRA_QUALITIES', '90,75').split(',') if q.strip()
+)
+# الجودات الإضافية تُحسب على مربع مركزي بهذا الحجم (محاذٍ لشبكة كتل JPEG)
+# فتبقى تكلفتها ثابتة مهما كانت دقة الصورة
+ELA_GHOST_CROP = 1024
+# حجم الكتلة لإحصاءات الخطأ المكانية (بكسل)
+ELA_BLOCK_SIZE = 32
+# متوسط خطأ الكتلة الذي يُعد مرتفعاً (نفس عتبة "تزوير" للمتوسط العام)
+ELA_HIGH_BLOCK_ERROR = 15.0
+# ميزانية البكسلات: الصور الأكبر تُحلل بلاطةً بلاطة بدقتها الأصلية (إعادة الضغط
+# بعد التصغير تُفسد شبكة JPEG)، مع عينة منتظمة من البلاطات ضمن الميزانية،
+# فلا تُنشأ صور خطأ أو نسخ معاد ضغطها بحجم الصورة كاملة
+ELA_MAX_PIXELS = int(os.environ.get('SIDQ_ELA_MAX_PIXELS', str(12 * 1000 * 1000)))
+# حجم البلاطة: مضاعف لـ 16 (كتل JPEG مع 4:2:0) ولـ ELA_BLOCK_SIZE
+ELA_TILE_SIZE = 512
+
+# مخزن ترميز JPEG مؤقت لكل خيط (يُعاد استخدامه بين الطلبات)
+_buffers = threading.local()
+
+
+def _jpeg_buffer():
+    buffer = getattr(_buffers, 'jpeg', None)
+    if buffer is None:
+        buffer = _buffers.jpeg = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    return buffer
+
+
+def _scale_lut(scale_factor, bands):
+    # تضخيم وقص بعدد صحيح عبر جدول بحث (بدون مصفوفات float32 بحجم الصورة)
+    lut = [min(255, value * scale_factor) for value in range(256)]
+    return lut * bands
+
+
+def _error_image(original_img, quality, lut):
+    """صورة الفرق المضخّمة بين الأصل ونسخته المعاد ضغطها بجودة quality."""
+    buffer = _jpeg_buffer()
+    original_img.save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    with Image.open(buffer) as compressed_img:
+        compressed_img.load()
+        # الفرق ثم التضخيم داخل PIL (بايت لكل قناة، بدون نسخ NumPy)
+        return ImageChops.difference(original_img, compressed_img).point(lut)
+
+
+def _block_means(error_img, block_size=ELA_BLOCK_SIZE):
+    """
+    متوسط الخطأ لكل كتلة عبر التصغير بالمتوسط داخل PIL (reduce)،
+    فلا تُنشأ نسخة كاملة الدقة في NumPy.
+    """
+    return np.asarray(error_img.reduce(block_size), dtype=np.float32).mean(axis=2)
+
+
+def _block_stats(blocks, width, height, block_size=ELA_BLOCK_SIZE):
+    """إحصاءات الخطأ لكل كتلة (blocks: متوسطات الكتل المحللة، بأي شكل)."""
+    return {
+        'block_size': block_size,
+        'rows': -(-height // block_size),
+        'cols': -(-width // block_size),
+        'block_mean_max': round(float(blocks.max()), 2),
+        'block_mean_p95': round(float(np.percentile(blocks, 95)), 2),
+        'block_mean_std': round(float(blocks.std()), 2),
+        'high_error_ratio': round(float(np.mean(blocks >= ELA_HIGH_BLOCK_ERROR)), 4),
+    }
+
+
+def _ghost_box(width, height, size=ELA_GHOST_CROP):
+    # إزاحة من مضاعفات 16 (كتل الألوان مع 4:2:0) حتى تبقى كتل JPEG الأصلية في مكانها
+    crop_w, crop_h = min(width, size), min(height, size)
+    left = ((width - crop_w) // 2) // 16 * 16
+    top = ((height - crop_h) // 2) // 16 * 16
+    return left, top, left + crop_w, top + crop_h
+
+
+def _mean(img):
+    # المتوسط من الهيستوجرام (دقيق وبدون نسخ)
+    return float(np.mean(ImageStat.Stat(img).mean))
+
+
+def _tiled_error(original_img, quality, lut, max_pixels, keep_error_image):
+    """
+    ELA بلاطةً بلاطة لعينة منتظمة من البلاطات ضمن max_pixels.
+    تُرجع (متوسط الخطأ، متوسطات الكتل، نسبة التغطية، صورة خطأ مصغّرة أو None).
+    صورة الخطأ المصغّرة تجمع البلاطات المحللة فقط (البقية سوداء) بمساحة لا تتجاوز الميزانية.
+    """
+    width, height = original_img.size
+    factor = int(np.ceil(np.sqrt(width * height / max_pixels)))
+    canvas = Image.new('RGB', (-(-width // factor), -(-height // factor))) if keep_error_image else None
+
+    total_error, analysed_pixels, blocks = 0.0, 0, []
+    for _, _, y0, y1, x0, x1 in iter_tiles(height, width, ELA_TILE_SIZE, max_pixels):
+        tile_error = _error_image(original_img.crop((x0, y0, x1, y1)), quality, lut)
+        pixels = (x1 - x0) * (y1 - y0)
+        total_error += _mean(tile_error) * pixels
+        analysed_pixels += pixels
+        blocks.append(_block_means(tile_error).ravel())
+        if canvas is not None:
+            canvas.paste(tile_error.reduce(factor), (x0 // factor, y0 // factor))
+
+    return total_error / analysed_pixels, np.concatenate(blocks), analysed_pixels / (width * height), canvas
+
+
+def compute_ela(original_img, quality=ELA_QUALITY, scale_factor=ELA_SCALE_FACTOR,
+                extra_qualities=ELA_EXTRA_QUALITIES, keep_error_image=False, max_pixels=ELA_MAX_PIXELS):
+    """
+    ELA بعدة جودات في استدعاء واحد.
+    تُرجع (متوسط الخطأ بالجودة الأساسية، الإحصاءات، صورة الخطأ أو None).
+
+    الإحصاءات: متوسط الخطأ لكل جودة على المربع المركزي، والجودة ذات الخطأ
+    الأدنى (تقدير جودة الضغط الأصلية، JPEG ghost)، وإحصاءات الكتل للجودة الأساسية.
+    الصور الأكبر من max_pixels تُحلل على بلاطات (coverage < 1) وصورة خطأها مصغّرة.
+    """
+    lut = _scale_lut(scale_factor, len(original_img.getbands()))
+    width, height = original_img.size
+    box = _ghost_box(width, height)
+
+    if width * height <= max_pixels:
+        error_img = _error_image(original_img, quality, lut)
+        mean_error = _mean(error_img)
+        blocks, coverage = _block_means(error_img), 1.0
+        ghost_error = _mean(error_img.crop(box))
+    else:
+        mean_error, blocks, coverage, error_img = _tiled_error(original_img, quality, lut, max_pixels, keep_error_image)
+        ghost_error = None
+
+    stats = _block_stats(blocks, width, height)
+    stats['coverage'] = round(coverage, 4)
+
+    extra_qualities = [q for q in extra_qualities if q != quality]
+    ghost_img = original_img.crop(box) if extra_qualities or ghost_error is None else None
+    if ghost_error is None:
+        ghost_error = _mean(_error_image(ghost_img, quality, lut))
+    quality_errors = {quality: round(ghost_error, 3)}
+    for extra_quality in extra_qualities:
+        quality_errors[extra_quality] = round(_mean(_error_image(ghost_img, extra_quality, lut)), 3)
+
+    stats['quality_errors'] = {str(q): e for q, e in sorted(quality_errors.items(), reverse=True)}
+    stats['min_error_quality'] = min(quality_errors, key=quality_errors.get)
+
+    return mean_error, stats, (error_img if keep_error_image else None)
@@ -0,0 +1,54 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D
+
+from inference_backends import normalize_cams
+
+# =========================================================
+# مفسّر Grad-CAM مشترك (يُبنى مرة واحدة عند تحميل النموذج)
+# =========================================================
+
+
+class GradcamExplainer:
+    """
+    بديل عن Gradcam(model, ReplaceToLinear(), clone=True) داخل مسار الطلب.
+
+    تُنسخ الشبكة مرة واحدة بتفعيل خطي في طبقة الإخراج، وتُجمَّع خطوة التدرج
+    في tf.function بتوقيع ثابت، فلا يُعاد النسخ أو التتبع مع كل صورة.
+    تدعم دفعات كاملة (N, H, W, C) لتوزيع كلفة التفسير كما في الاستدلال.
+    """
+
+    def __init__(self, model):
+        # نسخة من النموذج بإخراج خطي (ما يعادل ReplaceToLinear)
+        linear_model = tf.keras.models.clone_model(model)
+        linear_model.set_weights(model.get_weights())
+        linear_model.layers[-1].activation = tf.keras.activations.linear
+
+        # آخر طبقة تلافيفية (ما يعادل penultimate_layer=-1 في tf_keras_vis)
+        conv_layer = [layer for layer in linear_model.layers if isinstance(layer, Conv2D)][-1]
+        self._grad_model = tf.keras.Model(linear_model.inputs, [conv_layer.output, linear_model.output])
+
+        input_shape = tuple(model.input_shape[1:])
+        self._input_size = input_shape[:2]
+        self._step = tf.function(
+            self._compute_cams,
+            input_signature=[tf.TensorSpec((None,) + input_shape, tf.float32)],
+        )
+
+    def _compute_cams(self, images):
+        with tf.GradientTape() as tape:
+            conv_output, score = self._grad_model(images, training=False)
+            # العينات مستقلة، لذا تدرج المجموع يعطي تدرج كل عينة على حدة
+            target = tf.reduce_sum(score[:, 0])
+        grads = tape.gradient(target, conv_output)
+
+        weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        return tf.nn.relu(tf.reduce_sum(conv_output * weights, axis=-1))
+
+    def explain_batch(self, images):
+        """خرائط Grad-CAM لدفعة صور (N, H, W, C) بقيم بين 0 و 1."""
+        cams = self._step(tf.convert_to_tensor(np.asarray(images, dtype=np.float32))).numpy()
+        return normalize_cams(cams, self._input_size)
+
+    def __call__(self, image):
+        return self.explain_batch(image[np.newaxis, ...])[0]
@@ -0,0 +1,19 @@
+import os
+
+# =========================================================
+# إعدادات gunicorn (تُقرأ تلقائياً من مجلد التشغيل)
+# =========================================================
+
+# وضع التحميل المسبق: تُستورد وحدات TensorFlow مرة واحدة في العملية الرئيسية
+# قبل fork، فتتشارك العمال صفحاتها (copy-on-write) ويختصر زمن إقلاع كل عامل.
+# لا يُنشأ سياق TensorFlow ولا يُحمَّل النموذج في العملية الرئيسية (TensorFlow
+# يتوقف عن العمل بعد fork إذا شُغّلت خيوطه)، بل داخل كل عامل بعد fork.
+if os.environ.get('SIDQ_PRELOAD_MODEL') == '1':
+    preload_app = True
+    os.environ.setdefault('SIDQ_MODEL_WARMUP', 'preload')
+
+
+def post_fork(server, worker):
+    if os.environ.get('SIDQ_PRELOAD_MODEL') == '1':
+        import ai_forensics
+        ai_forensics.start_model_warm_up('background')
@@ -0,0 +1,164 @@
+import os
+import threading
+import warnings
+from functools import cached_property
+
+import numpy as np
+from PIL import Image
+
+from upload_buffer import BufferReader
+
+# قيمة افتراضية عند غياب حقول EXIF
+EXIF_MISSING = 'غير متوفر'
+
+# أرقام وسوم EXIF المستخدمة في التقرير
+EXIF_MAKE = 271
+EXIF_MODEL = 272
+EXIF_DATETIME_ORIGINAL = 36867
+
+# أقصى عدد بكسلات مقبول للصورة: ملف JPEG بحجم 5MB قد يُفك إلى أكثر من 50 ميغابكسل،
+# لذا يُرفض ما فوق الحد من الترويسة قبل فك الترميز
+MAX_IMAGE_PIXELS = int(os.environ.get('SIDQ_MAX_IMAGE_PIXELS', str(64 * 1000 * 1000)))
+# حماية PIL من قنابل فك الضغط بنفس الحد (خطأ فوق ضعفه). تحذير PIL بين الحدين
+# لا حاجة له لأن ImageContext يرفض هذه الصور بنفسه
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+
+class ImageTooLargeError(ValueError):
+    """أبعاد الصورة تتجاوز MAX_IMAGE_PIXELS."""
+
+
+# =========================================================
+# سياق الصورة المشترك (فك الترميز مرة واحدة لكل طلب)
+# =========================================================
+
+class ImageContext:
+    """
+    صورة مفكوكة الترميز مرة واحدة لكل طلب، تُمرَّر إلى جميع المحللات
+    (PRNU و ELA و CNN) بدلاً من إعادة فتح الدفق في كل مرحلة.
+
+    تُقرأ الترويسة فقط عند الإنشاء؛ فك الترميز الكامل يحدث عند أول طلب لـ rgb_image،
+    والمراحل التي تحتاج صورة مصغّرة فقط تستخدم reduced_image (فك ترميز JPEG
+    بدقة مخفّضة) فلا تُنشأ الصورة الكاملة من أجلها.
+    """
+
+    def __init__(self, raw_bytes, image):
+        self.raw_bytes = raw_bytes
+        self.format = image.format
+        self.width, self.height = image.size
+        if self.width * self.height > MAX_IMAGE_PIXELS:
+            raise ImageTooLargeError(
+                f"أبعاد الصورة ({self.width}x{self.height}) تتجاوز الحد المسموح ({MAX_IMAGE_PIXELS} بكسل)."
+            )
+        # قراءة EXIF مرة واحدة فقط
+        self.exif = image.getexif()
+
+        self._image = image
+        self._rgb_image = None
+        self._decode_lock = threading.Lock()
+        self._reduced_images = {}
+
+    @property
+    def rgb_image(self):
+        """الصورة كاملة الدقة بصيغة RGB (تُفك مرة واحدة، وآمنة من عدة خيوط)."""
+        if self._rgb_image is None:
+            with self._decode_lock:
+                if self._rgb_image is None:
+                    image = self._image
+                    image.load()
+                    # تجنب نسخة إضافية إذا كانت الصورة RGB أصلاً
+                    self._rgb_image = image if image.mode == 'RGB' else image.convert('RGB')
+                    self._image = None
+        return self._rgb_image
+
+    def reduced_image(self, min_size):
+        """
+        صورة RGB لا يقل أي من بُعديها عن min_size (أو الأصل إن كان أصغر)، للمراحل
+        التي تُصغّر الصورة على أي حال (مدخل CNN، صور التقرير المصغّرة).
+        JPEG يُفك بمقياس 1/2 أو 1/4 أو 1/8 مباشرة من معاملات DCT (draft) ما لم تكن
+        الصورة الكاملة مفكوكة أصلاً؛ بقية الصيغ تستخدم الصورة الكاملة.
+        """
+        reduced = self._reduced_images.get(min_size)
+        if reduced is not None:
+            return reduced
+        if self._rgb_image is None and self.format == 'JPEG':
+            with Image.open(BufferReader(self.raw_bytes)) as image:
+                image.draft('RGB', (min_size, min_size))
+                reduced = image.convert('RGB')
+        else:
+            reduced = self.rgb_image
+        self._reduced_images[min_size] = reduced
+        return reduced
+
+    @cached_property
+    def gray_image(self):
+        return self.rgb_image.convert('L')
+
+    @cached_property
+    def rgb(self):
+        return np.asarray(self.rgb_image)
+
+    @cached_property
+    def gray(self):
+        return np.asarray(self.gray_image)
+
+    @property
+    def metadata(self):
+        """البيانات الوصفية الأساسية بنفس الصيغة التي يتوقعها التقرير."""
+        exif = self.exif
+        return {
+            'make': exif.get(EXIF_MAKE) if exif else EXIF_MISSING,
+            'model': exif.get(EXIF_MODEL) if exif else EXIF_MISSING,
+            'datetime': exif.get(EXIF_DATETIME_ORIGINAL) if exif else EXIF_MISSING,
+            'format': self.format,
+            'size': f"{self.width}x{self.height}",
+        }
+
+
+def read_image_bytes(image_stream):
+    """
+    البايتات الخام من دفق (BytesIO)، أو المخزن نفسه بدون نسخ إذا كان bytes
+    أو memoryview (الملف المرفوع المربوط بالذاكرة، انظر upload_buffer.spool_upload).
+    """
+    if isinstance(image_stream, bytes):
+        return image_stream
+    if isinstance(image_stream, (bytearray, memoryview)):
+        return memoryview(image_stream).toreadonly()
+    if hasattr(image_stream, 'getvalue'):
+        return image_stream.getvalue()
+    image_stream.seek(0)
+    return image_stream.read()
+
+
+def load_image_context(image_stream):
+    """
+    بناء سياق الصورة من دفق (BytesIO) أو من بايتات خام (bytes أو memoryview).
+    يرفع ImageTooLargeError إذا تجاوزت أبعاد الصورة MAX_IMAGE_PIXELS.
+    """
+    raw_bytes = read_image_bytes(image_stream)
+    try:
+        image = Image.open(BufferReader(raw_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"أبعاد الصورة تتجاوز الحد المسموح ({MAX_IMAGE_PIXELS} بكسل).") from e
+    return ImageContext(raw_bytes, image)
+
+
+def iter_tiles(height, width, tile_size, max_pixels):
+    """
+    إرجاع (الصف، العمود، y0، y1، x0، x1) لكل بلاطة ستُعالج.
+    إذا تجاوزت الصورة ميزانية البكسلات تُختار البلاطات بخطوة منتظمة في الاتجاهين،
+    فتبقى تكلفة المرحلة وذاكرتها محدودة مهما كانت دقة الصورة.
+    """
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+
+    stride = 1
+    if height * width > max_pixels:
+        budget_tiles = max(1, max_pixels // (tile_size * tile_size))
+        stride = int(np.ceil(np.sqrt(rows * cols / budget_tiles)))
+
+    for row in range(stride // 2 if rows > stride else 0, rows, stride):
+        for col in range(stride // 2 if cols > stride else 0, cols, stride):
+            y0, x0 = row * tile_size, col * tile_size
+            yield row, col, y0, min(y0 + tile_size, height), x0, min(x0 + tile_size, width)
@@ -0,0 +1,422 @@
+import argparse
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.ndimage import zoom
+
+# =========================================================
+# محركات استدلال بديلة لنموذج CNN (بدون TensorFlow داخل العمال)
+#
+# keras (افتراضي): load_model + predict كما في السابق.
+# numpy: تنفيذ مباشر لطبقات Conv/Pool/Dense الثابتة بأوزان مصدّرة (npz)،
+#        مع Grad-CAM تحليلي؛ لا يُستورد TensorFlow إطلاقاً.
+# tflite: نموذج TFLite مصدّر (float32 أو int8)، وGrad-CAM من محرك numpy.
+#
+# التصدير والتحقق من التطابق (مرة واحدة بعد كل تدريب):
+#   python inference_backends.py export [--int8 --calibration-dir صور/]
+#   python inference_backends.py check [--images صور/]
+# =========================================================
+
+INFERENCE_BACKENDS = ('keras', 'numpy', 'tflite')
+INFERENCE_BACKEND = os.environ.get('SIDQ_INFERENCE_BACKEND', 'keras')
+NUMPY_WEIGHTS_PATH = os.environ.get('SIDQ_NUMPY_WEIGHTS', 'forensics_model.npz')
+TFLITE_MODEL_PATH = os.environ.get('SIDQ_TFLITE_MODEL', 'forensics_model.tflite')
+
+# حدود الفرق المقبولة في فحص التطابق مع Keras (احتمال الإخراج بين 0 و 1)
+PARITY_TOLERANCE = 1e-4
+PARITY_TOLERANCE_INT8 = 0.02
+# مطابق لـ tf.keras.backend.epsilon() في تطبيع خرائط Grad-CAM
+CAM_EPSILON = 1e-7
+
+
+def model_file_version(path):
+    """إصدار ملف (الحجم ووقت التعديل)، يُخزن في الملفات المصدّرة لكشف تقادمها."""
+    try:
+        stat = os.stat(path)
+        return f'{stat.st_size}-{int(stat.st_mtime)}'
+    except OSError:
+        return None
+
+
+def normalize_cams(cams, input_size):
+    """
+    تكبير خرائط Grad-CAM (N, h, w) إلى حجم المدخل ثم تطبيعها لكل عينة إلى [0, 1]
+    (نفس الاستيفاء الخطي والتطبيع في tf_keras_vis).
+    """
+    factors = (1.0,) + tuple(t / s for s, t in zip(cams.shape[1:], input_size))
+    cams = zoom(cams, factors, order=1)
+    cam_min = cams.min(axis=(1, 2), keepdims=True)
+    cam_max = cams.max(axis=(1, 2), keepdims=True)
+    return (cams - cam_min) / (cam_max - cam_min + CAM_EPSILON)
+
+
+# =========================================================
+# 1. التصدير (يتطلب TensorFlow؛ يُشغّل خارج مسار الطلب)
+# =========================================================
+
+def _layer_spec(layer):
+    """وصف طبقة Keras بصيغة يفهمها NumpyForensicsModel، أو ValueError إن لم تكن مدعومة."""
+    kind = type(layer).__name__
+    config = layer.get_config()
+    activation = config.get('activation', 'linear')
+    if kind == 'Conv2D':
+        if tuple(config['strides']) != (1, 1) or config['padding'] != 'valid' \
+                or tuple(config['dilation_rate']) != (1, 1):
+            raise ValueError(f'{layer.name}: Conv2D مدعومة فقط بخطوة 1 وحشو valid')
+        return {'type': 'conv', 'activation': activation}
+    if kind == 'MaxPooling2D':
+        pool = tuple(config['pool_size'])
+        if tuple(config['strides'] or pool) != pool or config['padding'] != 'valid' or pool[0] != pool[1]:
+            raise ValueError(f'{layer.name}: MaxPooling2D مدعومة فقط بنافذة مربعة وخطوة مساوية لها')
+        return {'type': 'maxpool', 'size': pool[0]}
+    if kind == 'Flatten':
+        return {'type': 'flatten'}
+    if kind == 'Dense':
+        return {'type': 'dense', 'activation': activation}
+    raise ValueError(f'{layer.name}: طبقة غير مدعومة ({kind})')
+
+
+def export_numpy_weights(model, path=NUMPY_WEIGHTS_PATH, source_path=None):
+    """حفظ أوزان النموذج ووصف طبقاته في ملف npz لمحرك numpy."""
+    layers, arrays = [], {}
+    for index, layer in enumerate(model.layers):
+        spec = _layer_spec(layer)
+        if spec['type'] in ('conv', 'dense'):
+            kernel, bias = layer.get_weights()
+            arrays[f'kernel_{index}'] = kernel.astype(np.float32)
+            arrays[f'bias_{index}'] = bias.astype(np.float32)
+        layers.append(spec)
+
+    manifest = {
+        'input_shape': list(model.input_shape[1:]),
+        'layers': layers,
+        'source_version': model_file_version(source_path) if source_path else None,
+    }
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, manifest=np.array(json.dumps(manifest)), **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def export_tflite(model, path=TFLITE_MODEL_PATH, source_path=None, int8=False, calibration_images=None):
+    """
+    تحويل النموذج إلى TFLite. int8=True يطبق تكميماً بعد التدريب (الأوزان والتنشيطات
+    int8، والمدخل والمخرج float32) بمعايرة على calibration_images (N, H, W, 3) بقيم 0..1.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if int8:
+        if calibration_images is None or len(calibration_images) == 0:
+            raise ValueError('التكميم int8 يتطلب صور معايرة')
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [np.asarray(image, dtype=np.float32)[np.newaxis, ...]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(converter.convert())
+    os.replace(tmp_path, path)
+
+    # ملف وصفي بجانب النموذج (TFLite لا يحمل إصدار المصدر)
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'source_version': model_file_version(source_path) if source_path else None,
+            'quantization': 'int8' if int8 else 'float32',
+        }, f)
+    return path
+
+
+# =========================================================
+# 2. محرك NumPy
+# =========================================================
+
+def _activate(x, activation):
+    if activation == 'relu':
+        return np.maximum(x, 0.0, out=x)
+    if activation == 'sigmoid':
+        return 1.0 / (1.0 + np.exp(-x))
+    if activation == 'linear':
+        return x
+    raise ValueError(f'تنشيط غير مدعوم: {activation}')
+
+
+def _conv2d_valid(x, kernel, bias):
+    """التفاف valid بخطوة 1 كضرب مصفوفة واحد (im2col) عبر نوافذ منزلقة."""
+    kh, kw, in_channels, out_channels = kernel.shape
+    windows = sliding_window_view(x, (kh, kw), axis=(1, 2))  # (N, H', W', C, kh, kw) بدون نسخ
+    n, out_h, out_w = windows.shape[:3]
+    columns = windows.transpose(0, 1, 2, 4, 5, 3).reshape(n * out_h * out_w, kh * kw * in_channels)
+    out = columns @ kernel.reshape(kh * kw * in_channels, out_channels)
+    out += bias
+    return out.reshape(n, out_h, out_w, out_channels)
+
+
+def _maxpool(x, size):
+    n, h, w, c = x.shape
+    out_h, out_w = h // size, w // size
+    x = x[:, :out_h * size, :out_w * size, :].reshape(n, out_h, size, out_w, size, c)
+    return x.max(axis=(2, 4))
+
+
+class NumpyForensicsModel:
+    """
+    تنفيذ مباشر بـ NumPy لشبكة build_forensics_model (Conv/MaxPool/Flatten/Dense)
+    بأوزان export_numpy_weights. آمن للاستدعاء من عدة خيوط (لا حالة مشتركة).
+    """
+
+    name = 'numpy'
+
+    def __init__(self, path=NUMPY_WEIGHTS_PATH):
+        with np.load(path) as data:
+            manifest = json.loads(str(data['manifest']))
+            self.layers = []
+            for index, spec in enumerate(manifest['layers']):
+                spec = dict(spec)
+                if spec['type'] in ('conv', 'dense'):
+                    spec['kernel'] = data[f'kernel_{index}']
+                    spec['bias'] = data[f'bias_{index}']
+                self.layers.append(spec)
+        self.input_shape = tuple(manifest['input_shape'])
+        self.source_version = manifest.get('source_version')
+        self.version = f'numpy-{model_file_version(path)}'
+        # آخر طبقة تلافيفية (هدف Grad-CAM كما في GradcamExplainer)
+        self._last_conv = max(i for i, spec in enumerate(self.layers) if spec['type'] == 'conv')
+
+    @staticmethod
+    def _apply_layer(spec, x, activate=True):
+        if spec['type'] == 'conv':
+            return _activate(_conv2d_valid(x, spec['kernel'], spec['bias']), spec['activation'])
+        if spec['type'] == 'maxpool':
+            return _maxpool(x, spec['size'])
+        if spec['type'] == 'flatten':
+            return x.reshape(x.shape[0], -1)
+        x = x @ spec['kernel'] + spec['bias']
+        return _activate(x, spec['activation']) if activate else x
+
+    def _forward(self, x, stop=None):
+        for spec in self.layers[:stop]:
+            x = self._apply_layer(spec, x)
+        return x
+
+    def predict_batch(self, images):
+        """احتمال الإخراج لدفعة صور (N, H, W, 3) بقيم بين 0 و 1."""
+        images = np.asarray(images, dtype=np.float32)
+        return self._forward(images)[:, 0]
+
+    def explain_batch(self, images):
+        """
+        خرائط Grad-CAM لدفعة (N, H, W, 3) بنفس تعريف GradcamExplainer
+        (تدرج الإخراج الخطي بالنسبة لآخر طبقة تلافيفية)، بتدرج تحليلي.
+        """
+        images = np.asarray(images, dtype=np.float32)
+        conv_output = self._forward(images, stop=self._last_conv + 1)
+        weights = self._channel_weights(conv_output)
+        cams = np.maximum(np.einsum('nhwc,nc->nhw', conv_output, weights), 0.0)
+        return normalize_cams(cams, self.input_shape[:2])
+
+    def _channel_weights(self, conv_output):
+        """
+        متوسط تدرج الإخراج الخطي (ما يعادل ReplaceToLinear) لكل قناة عبر الأبعاد المكانية.
+        نافذة التجميع العظمى تمرر تدرجها لعنصر واحد فقط، فمجموع التدرج المكاني لكل قناة
+        يساوي مجموع تدرج مخرج التجميع، ولا حاجة لمعرفة موضع القيمة العظمى.
+        """
+        tail = self.layers[self._last_conv + 1:]
+        last = len(tail) - 1
+
+        # التمرير الأمامي مع حفظ مدخل ومخرج كل طبقة للاشتقاق
+        inputs, outputs = [], []
+        x = conv_output
+        for position, spec in enumerate(tail):
+            inputs.append(x)
+            x = self._apply_layer(spec, x, activate=position != last)
+            outputs.append(x)
+
+        grad = np.ones((conv_output.shape[0], 1), dtype=np.float32)
+        for position in range(last, -1, -1):
+            spec = tail[position]
+            if spec['type'] == 'dense':
+                if position != last and spec['activation'] == 'relu':
+                    grad = grad * (outputs[position] > 0)
+                elif position != last and spec['activation'] != 'linear':
+                    raise ValueError(f"Grad-CAM: تنشيط غير مدعوم بعد آخر التفاف ({spec['activation']})")
+                grad = grad @ spec['kernel'].T
+            elif spec['type'] == 'flatten':
+                grad = grad.reshape(inputs[position].shape)
+            elif not (spec['type'] == 'maxpool' and position == 0):
+                raise ValueError('Grad-CAM: بنية غير مدعومة بعد آخر التفاف')
+
+        spatial = conv_output.shape[1] * conv_output.shape[2]
+        return grad.sum(axis=(1, 2)) / spatial
+
+
+# =========================================================
+# 3. محرك TFLite
+# =========================================================
+
+def _tflite_interpreter(path):
+    # tflite_runtime (حزمة صغيرة بدون TensorFlow) إن وُجدت، وإلا المفسّر المضمّن في TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=path, num_threads=1)
+
+
+class TFLiteForensicsModel:
+    """
+    نموذج TFLite مصدّر بمدخل دفعة 1 (صورة لكل استدعاء invoke).
+    Grad-CAM يتطلب تدرجات غير متاحة في TFLite، فيُحسب بمحرك numpy إن وُجدت أوزانه.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, path=TFLITE_MODEL_PATH, numpy_weights_path=NUMPY_WEIGHTS_PATH):
+        self._interpreter = _tflite_interpreter(path)
+        self._interpreter.allocate_tensors()
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        # المفسّر غير آمن للاستدعاء المتزامن
+        self._lock = threading.Lock()
+
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        self.source_version = meta.get('source_version')
+        self.quantization = meta.get('quantization', 'float32')
+        self.version = f'tflite-{self.quantization}-{model_file_version(path)}'
+
+        self.explain_batch = None
+        if os.path.exists(numpy_weights_path):
+            self.explain_batch = NumpyForensicsModel(numpy_weights_path).explain_batch
+
+    def predict_batch(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        predictions = np.empty(len(images), dtype=np.float32)
+        with self._lock:
+            for index, image in enumerate(images):
+                self._interpreter.set_tensor(self._input_index, image[np.newaxis, ...])
+                self._interpreter.invoke()
+                predictions[index] = self._interpreter.get_tensor(self._output_index)[0, 0]
+        return predictions
+
+
+def load_inference_backend(name, source_path):
+    """
+    تحميل محرك numpy أو tflite. ValueError إذا كان الاسم غير معروف أو كان الملف
+    المصدّر أقدم من النموذج الأصلي (يجب إعادة التصدير بعد كل تدريب).
+    """
+    if name == 'numpy':
+        backend = NumpyForensicsModel(NUMPY_WEIGHTS_PATH)
+    elif name == 'tflite':
+        backend = TFLiteForensicsModel(TFLITE_MODEL_PATH, NUMPY_WEIGHTS_PATH)
+    else:
+        raise ValueError(f'محرك استدلال غير معروف: {name} (المتاح: {", ".join(INFERENCE_BACKENDS)})')
+
+    current_version = model_file_version(source_path)
+    if current_version and backend.source_version != current_version:
+        raise ValueError(f'الملف المصدّر لمحرك {name} لا يطابق {source_path}؛ أعد التصدير')
+    return backend
+
+
+# =========================================================
+# 4. التصدير وفحص التطابق من سطر الأوامر
+# =========================================================
+
+def _load_images(directory, size, limit):
+    """صور المجلد محجّمة إلى مدخل النموذج بقيم بين 0 و 1 (نفس تحضير _cnn_input)."""
+    from PIL import Image
+
+    images = []
+    for file_name in sorted(os.listdir(directory)):
+        if len(images) >= limit:
+            break
+        try:
+            with Image.open(os.path.join(directory, file_name)) as img:
+                images.append(np.array(img.convert('RGB').resize(size)) / 255.0)
+        except Exception:
+            continue
+    return np.asarray(images, dtype=np.float32)
+
+
+def _sample_images(args, input_shape):
+    directory = args.images if args.command == 'check' else args.calibration_dir
+    if directory:
+        images = _load_images(directory, input_shape[:2], args.samples)
+        if len(images):
+            return images
+        print(f"WARNING: لا توجد صور صالحة في {directory}.")
+    print("WARNING: استخدام صور عشوائية؛ الأفضل تمرير صور حقيقية لقياس دقيق.")
+    return np.random.default_rng(0).random((args.samples,) + tuple(input_shape), dtype=np.float32)
+
+
+def _verdict_bands(predictions):
+    # نفس حدود حكم analyze_ai (ثقة الأصالة 40 و 70)
+    return np.digitize((1.0 - predictions) * 100.0, [40.0, 70.0])
+
+
+def _check_parity(model, args):
+    """مقارنة مخرجات المحركات المصدّرة مع Keras؛ تُرجع False عند تجاوز حد الفرق."""
+    images = _sample_images(args, model.input_shape[1:])
+    reference = model.predict(images, verbose=0)[:, 0]
+    passed = True
+
+    for name in ('numpy', 'tflite'):
+        try:
+            backend = load_inference_backend(name, args.model)
+        except (OSError, ValueError) as e:
+            print(f"⏭️  {name}: {e}")
+            continue
+
+        predictions = backend.predict_batch(images)
+        diff = np.abs(predictions - reference)
+        tolerance = PARITY_TOLERANCE_INT8 if getattr(backend, 'quantization', '') == 'int8' else PARITY_TOLERANCE
+        agreement = float(np.mean(_verdict_bands(predictions) == _verdict_bands(reference)))
+        ok = float(diff.max()) <= tolerance
+        passed = passed and ok
+        print(f"{'✅' if ok else '❌'} {backend.version}: max|Δ|={diff.max():.2e} mean|Δ|={diff.mean():.2e} "
+              f"(الحد {tolerance:g})، تطابق الحكم {agreement * 100:.1f}%")
+
+        if name == 'numpy':
+            from gradcam_explainer import GradcamExplainer
+            cams_reference = GradcamExplainer(model).explain_batch(images[:8])
+            cam_diff = float(np.abs(backend.explain_batch(images[:8]) - cams_reference).max())
+            print(f"   Grad-CAM: max|Δ|={cam_diff:.2e}")
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='تصدير نموذج CNN لمحركات الاستدلال البديلة والتحقق من تطابقها')
+    parser.add_argument('command', choices=('export', 'check'))
+    parser.add_argument('--model', default='forensics_model.h5', help='نموذج Keras المصدر')
+    parser.add_argument('--int8', action='store_true', help='تكميم TFLite إلى int8 بعد التدريب')
+    parser.add_argument('--calibration-dir', help='صور معايرة التكميم')
+    parser.add_argument('--images', help='صور فحص التطابق')
+    parser.add_argument('--samples', type=int, default=64, help='عدد الصور المستخدمة')
+    args = parser.parse_args(argv)
+
+    from tensorflow.keras.models import load_model
+    model = load_model(args.model)
+
+    if args.command == 'export':
+        print(f"✅ {export_numpy_weights(model, NUMPY_WEIGHTS_PATH, args.model)}")
+        calibration = _sample_images(args, model.input_shape[1:]) if args.int8 else None
+        print(f"✅ {export_tflite(model, TFLITE_MODEL_PATH, args.model, args.int8, calibration)}")
+        return 0
+    return 0 if _check_parity(model, args) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import io
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# =========================================================
+# وضع المهام غير المتزامنة (إرسال ثم استعلام) بعمال محليين
+# =========================================================
+
+# عدد عمليات التحليل (كل عملية تحمّل نسختها من النموذج)
+JOB_WORKERS = int(os.environ.get('SIDQ_JOB_WORKERS', '2'))
+# أقصى عدد من المهام المقبولة (قيد الانتظار أو التنفيذ) قبل الرد بـ "مشغول"
+JOB_QUEUE_MAX = int(os.environ.get('SIDQ_JOB_QUEUE_MAX', '32'))
+# مدة بقاء حالة المهمة المكتملة (بالثواني)
+JOB_TTL_SECONDS = float(os.environ.get('SIDQ_JOB_TTL', '3600'))
+
+
+class QueueFull(Exception):
+    """الطابور ممتلئ: يجب على العميل إعادة المحاولة لاحقاً."""
+
+
+# ----------------------------------------------------
+# دوال تعمل داخل عمليات العمال
+# ----------------------------------------------------
+
+def _init_worker():
+    # تحميل TensorFlow والنموذج مرة واحدة عند بدء العملية
+    from ai_forensics import load_forensics_model
+    load_forensics_model()
+
+
+def _run_analysis(raw_bytes, include_ai=True):
+    from ai_forensics import analyze_full_forensics
+    return analyze_full_forensics(io.BytesIO(raw_bytes), include_visuals=False, include_ai=include_ai)
+
+
+# ----------------------------------------------------
+# الطابور داخل عملية الويب
+# ----------------------------------------------------
+
+class JobQueue:
+    """
+    يقبل المهام فوراً ويعيد معرّفها، ويشغّل التحليل في مجمع عمليات محلي
+    (بدون وسيط خارجي). عند امتلاء الطابور يرفع QueueFull بدلاً من الانتظار،
+    فيبقى عامل الويب متاحاً أثناء ذروة الحمل.
+
+    on_complete(results, raw_bytes) -> dict: حفظ النتيجة وإرجاع ملخصها للعميل.
+    store: مخزن النتائج لحفظ حالة المهام المكتملة (للمشاركة بين عمال الويب).
+    """
+
+    def __init__(self, on_complete, store, max_workers=JOB_WORKERS, max_pending=JOB_QUEUE_MAX):
+        self.on_complete = on_complete
+        self.store = store
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._jobs = {}  # المهام الجارية: job_id -> future
+
+    def _get_executor(self):
+        # spawn بدلاً من fork: TensorFlow وخيوط عامل الويب لا تتحمل fork
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    @staticmethod
+    def _job_key(job_id):
+        return f'job:{job_id}'
+
+    def submit(self, raw_bytes, include_ai=True):
+        with self._lock:
+            if len(self._jobs) >= self.max_pending:
+                raise QueueFull()
+
+            job_id = uuid.uuid4().hex
+            try:
+                future = self._get_executor().submit(_run_analysis, raw_bytes, include_ai)
+            except BrokenProcessPool:
+                # إعادة إنشاء المجمع إذا توقفت إحدى العمليات بشكل مفاجئ، بعد إغلاق المعطل
+                # (خيط إدارته وأنابيبه وبقية عملياته) بدون انتظار
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                future = self._get_executor().submit(_run_analysis, raw_bytes, include_ai)
+            self._jobs[job_id] = future
+
+        self.store.put(self._job_key(job_id), {'status': 'queued'}, ttl=JOB_TTL_SECONDS)
+        future.add_done_callback(lambda f: self._finish(job_id, f, raw_bytes))
+        return job_id
+
+    def _finish(self, job_id, future, raw_bytes):
+        try:
+            state = {'status': 'done'}
+            state.update(self.on_complete(future.result(), raw_bytes))
+        except Exception as e:
+            state = {'status': 'error', 'message': str(e)}
+        self.store.put(self._job_key(job_id), state, ttl=JOB_TTL_SECONDS)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def status(self, job_id):
+        """حالة المهمة: queued أو running أو done أو error (None إذا كانت غير معروفة)."""
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is not None and not future.done():
+            return {'status': 'running' if future.running() else 'queued'}
+        return self.store.get(self._job_key(job_id))
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._jobs)
+        return {'in_flight': in_flight, 'max_pending': self.max_pending, 'workers': self.max_workers}
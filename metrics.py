@@ -0,0 +1,226 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# =========================================================
+# مقاييس الأداء (Prometheus) وتتبع زمن المراحل لكل طلب
+# =========================================================
+
+# حدود فئات الهيستوجرام
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(16 * 1024 * 4 ** i for i in range(8))  # 16KB .. 256MB
+PIXELS_BUCKETS = (0.25e6, 0.5e6, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6, 64e6)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """عدّاد تراكمي مع تسميات (labels) اختيارية."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """هيستوجرام بفئات ثابتة (مجموع وعدد وعدّاد لكل فئة) مع تسميات اختيارية."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [counts per bucket + inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            snapshot = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, [('le', _format_value(float(bound)))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.label_names, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class GaugeCallback:
+    """قيم لحظية تُقرأ عند كل طلب لـ /metrics: fn() -> {(قيم التسميات): القيمة}."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, fn, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.label_names = tuple(label_names)
+
+    def collect(self):
+        try:
+            values = self.fn() or {}
+        except Exception:
+            return
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            yield f'{self.name}{_format_labels(self.label_names, key)} {_format_value(float(value))}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # إعادة التسجيل بنفس الاسم تُرجع المقياس الموجود (استيراد الوحدة مرتين)
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """كل المقاييس بصيغة Prometheus النصية (الإصدار 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, documentation, label_names=()):
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+
+def histogram(name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets))
+
+
+def gauge_callback(name, documentation, fn, label_names=()):
+    return REGISTRY.register(GaugeCallback(name, documentation, fn, label_names))
+
+
+# ----------------------------------------------------
+# مقاييس خط التحليل
+# ----------------------------------------------------
+
+STAGE_SECONDS = histogram('sidq_stage_seconds', 'Latency of each analysis stage.', ['stage'])
+STAGE_ERRORS = counter('sidq_stage_errors_total', 'Exceptions raised by analysis stages.', ['stage'])
+IMAGE_BYTES = histogram('sidq_image_bytes', 'Size of decoded uploads in bytes.', buckets=BYTES_BUCKETS)
+IMAGE_PIXELS = histogram('sidq_image_pixels', 'Decoded image dimensions (width x height).', buckets=PIXELS_BUCKETS)
+BATCH_SIZE = histogram('sidq_batch_size', 'Micro-batch sizes per batcher.', ['batcher'], buckets=BATCH_SIZE_BUCKETS)
+BATCH_SECONDS = histogram('sidq_batch_seconds', 'Latency of one micro-batch forward pass.', ['batcher'])
+HTTP_SECONDS = histogram('sidq_http_request_seconds', 'HTTP request latency.', ['endpoint', 'method', 'status'])
+
+
+# ----------------------------------------------------
+# تتبع زمن المراحل لكل طلب (اختياري)
+# ----------------------------------------------------
+
+# قائمة (المرحلة، الثواني) للطلب الحالي؛ None = التتبع غير مفعّل
+_current_trace = contextvars.ContextVar('sidq_trace', default=None)
+
+# دوال (المرحلة، الثواني) تُستدعى بعد كل مرحلة (مثلاً تقدير الزمن في admission_control)
+_stage_listeners = []
+
+
+def add_stage_listener(listener):
+    """تسجيل دالة listener(stage, elapsed) تُستدعى عند انتهاء كل مرحلة."""
+    _stage_listeners.append(listener)
+
+
+def start_trace():
+    """تفعيل التتبع للسياق الحالي (طلب HTTP) وإرجاع رمز لإيقافه."""
+    return _current_trace.set([])
+
+
+def end_trace(token):
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    return trace or []
+
+
+@contextmanager
+def stage_timer(stage):
+    """قياس زمن مرحلة وتسجيله في الهيستوجرام وفي تتبع الطلب الحالي إن وُجد."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        for listener in _stage_listeners:
+            listener(stage, elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+
+def timed(stage):
+    """مزخرف يقيس زمن الدالة كمرحلة باسم stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def format_server_timing(trace):
+    """تحويل التتبع إلى ترويسة Server-Timing (تعرضها أدوات المتصفح مباشرة)."""
+    return ', '.join(f'{stage};dur={elapsed * 1000.0:.2f}' for stage, elapsed in trace)
@@ -0,0 +1,77 @@
+import datetime
+import hashlib
+import json
+import os
+
+# =========================================================
+# بصمة إصدار النموذج (ملف JSON بجانب forensics_model.h5)
+#
+# يكتبها train_and_save_model.py بعد التدريب، ويتحقق منها ai_forensics عند التحميل:
+# أن الملف هو نفسه الذي دُرّب (SHA-256)، وأن حجم المدخل وترميز التسميات مطابقان.
+# =========================================================
+
+MODEL_STAMP_FORMAT = 1
+# التسميات كما يفسرها analyze_ai: الإخراج = احتمال التزوير
+MODEL_LABELS = {'authentic': 0, 'forged': 1}
+
+
+def stamp_path(model_path):
+    return model_path + '.json'
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_model_stamp(model_path, img_size, **training_info):
+    """كتابة بصمة النموذج بعد حفظه (كتابة ذرية)."""
+    stamp = {
+        'format': MODEL_STAMP_FORMAT,
+        'model_sha256': file_sha256(model_path),
+        'img_size': img_size,
+        'labels': MODEL_LABELS,
+        'trained_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        **training_info,
+    }
+    path = stamp_path(model_path)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(stamp, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(path + '.tmp', path)
+    return stamp
+
+
+def read_model_stamp(model_path):
+    """البصمة أو None إذا لم توجد (نماذج دُرّبت قبل إضافة البصمة)."""
+    try:
+        with open(stamp_path(model_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def check_model_stamp(model_path, img_size):
+    """
+    التحقق من تطابق النموذج مع بصمته وإعدادات الاستدلال.
+    تُرجع (البصمة أو None، قائمة المشكلات بالعربية؛ فارغة = مطابق).
+    """
+    stamp = read_model_stamp(model_path)
+    if stamp is None:
+        return None, [f"لا توجد بصمة إصدار للنموذج ({stamp_path(model_path)})"]
+
+    problems = []
+    if stamp.get('format') != MODEL_STAMP_FORMAT:
+        problems.append(f"صيغة بصمة غير معروفة: {stamp.get('format')}")
+    if stamp.get('img_size') != img_size:
+        problems.append(f"حجم مدخل التدريب {stamp.get('img_size')} لا يطابق الاستدلال {img_size}")
+    if stamp.get('labels') != MODEL_LABELS:
+        problems.append(f"ترميز التسميات {stamp.get('labels')} لا يطابق {MODEL_LABELS}")
+    try:
+        if stamp.get('model_sha256') != file_sha256(model_path):
+            problems.append("ملف النموذج تغيّر بعد كتابة البصمة (أعد التدريب أو التصدير)")
+    except OSError as e:
+        problems.append(str(e))
+    return stamp, problems
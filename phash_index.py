@@ -0,0 +1,284 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from metrics import counter
+
+# =========================================================
+# فهرس البصمات الإدراكية (pHash) للأحكام السابقة
+#
+# القوالب المزورة تُعاد بتعديلات بسيطة (قص، إعادة ضغط، تغيير نص) فلا تلتقطها
+# الذاكرة المؤقتة بمحتوى الملف. بصمة pHash (64 بت) تبقى قريبة بمسافة هامنغ صغيرة
+# لهذه التعديلات، فيُعاد الحكم السابق للقالب كإشارة إضافية في النتيجة.
+# =========================================================
+
+# ملف SQLite للفهرس؛ فارغ = الفهرس معطل
+PHASH_INDEX_PATH = os.environ.get('SIDQ_PHASH_INDEX', '')
+# أقصى مسافة هامنغ (من 64 بت) لاعتبار الصورتين نفس القالب
+PHASH_RADIUS = int(os.environ.get('SIDQ_PHASH_RADIUS', '6'))
+# تسجيل أحكام التحليلات الجديدة في الفهرس تلقائياً (اختياري: الحكم الآلي الخاطئ يتكرر
+# لكل نسخ القالب، والقوالب المعتمدة تُضاف من سطر الأوامر)
+PHASH_RECORD = os.environ.get('SIDQ_PHASH_RECORD', '0') == '1'
+# تسمية الأحكام المسجلة آلياً؛ أي تسمية أخرى قالب معتمد لا تستبدله التحليلات
+PHASH_ANALYSIS_LABEL = 'analysis'
+# الأحكام التي تُحفظ في الفهرس (CAUTION لا يصلح مرجعاً)
+PHASH_RECORDED_VERDICTS = ('FORGED', 'CLEAN')
+
+# حجم الصورة الرمادية قبل DCT، وحجم الترددات المنخفضة المستخدمة للبصمة
+PHASH_IMAGE_SIZE = 32
+PHASH_LOW_FREQ = 8
+
+# الفهرسة متعددة الأجزاء (Multi-Index Hashing): البصمة تُقسم إلى 4 أجزاء من 16 بت
+# ولكل جزء جدول مرتب في الذاكرة. إذا كانت المسافة ≤ r فجزء واحد على الأقل مسافته
+# ≤ r // 4 (مبدأ برج الحمام)، فيكفي البحث عن قيم الأجزاء القريبة ثم التحقق من المسافة الكاملة.
+PHASH_CHUNKS = 4
+PHASH_CHUNK_BITS = 64 // PHASH_CHUNKS
+# r // 4 ≤ 2 يبقي عدد القيم المبحوث عنها صغيراً (حتى 4 × 137)
+PHASH_MAX_RADIUS = 3 * PHASH_CHUNKS - 1
+# البصمات الجديدة تُفحص خطياً حتى تبلغ هذا العدد ثم يُعاد بناء الجداول المرتبة
+PHASH_TAIL_MAX = 4096
+
+PHASH_MATCHES = counter('sidq_phash_matches_total', 'Near-duplicate matches found in the perceptual-hash index.', ['verdict'])
+
+# عدد البتات المفعّلة لكل بايت (NumPy 1.x لا يوفر bitwise_count)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(size):
+    """مصفوفة DCT-II المتعامدة (size × size)."""
+    n = np.arange(size)
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def perceptual_hash(image):
+    """
+    بصمة pHash من 64 بت لصورة PIL: ترددات DCT المنخفضة (8×8) لصورة رمادية 32×32،
+    كل بت = المعامل أكبر من الوسيط (بدون المركبة الثابتة).
+    """
+    gray = image.convert('L').resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.LANCZOS)
+    coefficients = _DCT @ np.asarray(gray, dtype=np.float64) @ _DCT.T
+    low = coefficients[:PHASH_LOW_FREQ, :PHASH_LOW_FREQ].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def _hamming_distances(hashes, image_hash):
+    """مسافة هامنغ بين مصفوفة بصمات (uint64) وبصمة واحدة."""
+    xored = np.bitwise_xor(hashes, np.uint64(image_hash))
+    return _POPCOUNT[xored.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _to_signed(value):
+    # SQLite يخزن أعداداً صحيحة بإشارة (64 بت)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _chunk_values(hashes, i):
+    return ((hashes >> np.uint64(PHASH_CHUNK_BITS * i)) & np.uint64((1 << PHASH_CHUNK_BITS) - 1)).astype(np.uint16)
+
+
+def _masks_within(radius, bits=PHASH_CHUNK_BITS):
+    """كل أقنعة bits بت التي لا يزيد عدد بتاتها المفعّلة عن radius."""
+    masks = {0}
+    for _ in range(radius):
+        masks |= {mask | (1 << bit) for mask in masks for bit in range(bits)}
+    return np.array(sorted(masks), dtype=np.uint16)
+
+
+class PHashIndex:
+    """
+    فهرس بصمات pHash وأحكامها: SQLite هو المخزن الدائم المشترك بين العمال والعمليات،
+    وكل عملية تحتفظ بنسخة من البصمات في الذاكرة (8 بايت لكل بصمة) مع جدول مرتب لكل جزء.
+    الاستعلام بنصف قطر r يبحث (searchsorted) عن قيم الأجزاء القريبة فقط، ثم يتحقق
+    من المسافة الكاملة للمرشحين دفعة واحدة، فلا يتناسب زمنه مع عدد البصمات المخزنة.
+    الإضافات من عمليات أخرى تُقرأ تدريجياً (id أكبر من آخر ما قُرئ) قبل كل استعلام.
+    """
+
+    def __init__(self, path, radius=PHASH_RADIUS):
+        if not 0 <= radius <= PHASH_MAX_RADIUS:
+            raise ValueError(f'SIDQ_PHASH_RADIUS يجب أن يكون بين 0 و {PHASH_MAX_RADIUS}.')
+        self.path = path
+        self.radius = radius
+        self._probe_masks = _masks_within(radius // PHASH_CHUNKS)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # البصمات المقروءة (مخزن يتضاعف عند الامتلاء) وآخر id مقروء
+        self._hashes = np.empty(1024, dtype=np.uint64)
+        self._size = 0
+        self._last_id = 0
+        # [(قيم الجزء مرتبة، مواقعها في _hashes)] لأول _indexed بصمة
+        self._tables = []
+        self._indexed = 0
+        # تحديث حكم بصمة موجودة يبقي صفها (id) كما هو، فلا تتكرر البصمة في الذاكرة
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS phashes ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT, hash INTEGER NOT NULL UNIQUE,'
+            ' verdict TEXT NOT NULL, final_score REAL, label TEXT, recorded_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        # اتصال مستقل لكل خيط (ولكل عملية بعد fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # ----------------------------------------------------
+    # مزامنة النسخة في الذاكرة
+    # ----------------------------------------------------
+
+    def _sync(self):
+        """قراءة البصمات المضافة منذ آخر مزامنة، وإعادة بناء الجداول عند الحاجة (تحت القفل)."""
+        rows = self._connect().execute(
+            'SELECT id, hash FROM phashes WHERE id > ? ORDER BY id', (self._last_id,)
+        ).fetchall()
+        if rows:
+            new_hashes = np.array([row[1] for row in rows], dtype=np.int64).view(np.uint64)
+            if self._size + len(new_hashes) > len(self._hashes):
+                grown = np.empty(max(2 * len(self._hashes), self._size + len(new_hashes)), dtype=np.uint64)
+                grown[:self._size] = self._hashes[:self._size]
+                self._hashes = grown
+            self._hashes[self._size:self._size + len(new_hashes)] = new_hashes
+            self._size += len(new_hashes)
+            self._last_id = rows[-1][0]
+
+        if self._size - self._indexed > PHASH_TAIL_MAX:
+            hashes = self._hashes[:self._size]
+            tables = []
+            for i in range(PHASH_CHUNKS):
+                values = _chunk_values(hashes, i)
+                order = np.argsort(values, kind='stable')
+                tables.append((values[order], order))
+            self._tables, self._indexed = tables, self._size
+
+    def _candidates(self, image_hash, masks):
+        """مواقع البصمات التي يقع أحد أجزائها ضمن masks من جزء الاستعلام."""
+        with self._lock:
+            self._sync()
+            # المصفوفات لا تُعدّل في مواضعها المقروءة، فيكفي أخذ مراجع لها
+            hashes, size, tables, indexed = self._hashes, self._size, self._tables, self._indexed
+
+        query = np.array([image_hash], dtype=np.uint64)
+        positions = [np.arange(indexed, size)]
+        for i, (values, order) in enumerate(tables):
+            probes = np.bitwise_xor(_chunk_values(query, i)[0], masks)
+            starts = np.searchsorted(values, probes, side='left')
+            ends = np.searchsorted(values, probes, side='right')
+            positions.extend(order[start:end] for start, end in zip(starts, ends) if end > start)
+        return hashes, np.unique(np.concatenate(positions))
+
+    # ----------------------------------------------------
+    # الإضافة والاستعلام
+    # ----------------------------------------------------
+
+    def add(self, image_hash, verdict, final_score=None, label=None):
+        """
+        تسجيل حكم البصمة (الأحدث يحل محل السابق لنفس البصمة)، عدا أن الحكم الآلي
+        (label=PHASH_ANALYSIS_LABEL) لا يستبدل قالباً معتمداً.
+        """
+        self._connect().execute(
+            'INSERT INTO phashes (hash, verdict, final_score, label, recorded_at) VALUES (?, ?, ?, ?, ?)'
+            ' ON CONFLICT(hash) DO UPDATE SET verdict = excluded.verdict, final_score = excluded.final_score,'
+            ' label = excluded.label, recorded_at = excluded.recorded_at'
+            ' WHERE excluded.label IS NOT ? OR phashes.label IS ?',
+            (_to_signed(image_hash), verdict, final_score, label, time.time(),
+             PHASH_ANALYSIS_LABEL, PHASH_ANALYSIS_LABEL),
+        )
+
+    def query(self, image_hash, radius=None):
+        """كل البصمات ضمن مسافة radius، مرتبة تصاعدياً حسب المسافة."""
+        radius = self.radius if radius is None else radius
+        masks = self._probe_masks if radius == self.radius else _masks_within(radius // PHASH_CHUNKS)
+        hashes, positions = self._candidates(image_hash, masks)
+        distances = _hamming_distances(hashes[positions], image_hash)
+        close = distances <= radius
+        if not close.any():
+            return []
+
+        # البصمة الواحدة قد تأتي من أكثر من جزء، والتفاصيل (الحكم الحالي) من SQLite
+        found = dict(zip(hashes[positions][close].view(np.int64).tolist(), distances[close].tolist()))
+        rows = self._connect().execute(
+            f'SELECT hash, verdict, final_score, label, recorded_at FROM phashes'
+            f' WHERE hash IN ({", ".join("?" * len(found))})',
+            list(found),
+        ).fetchall()
+        matches = [
+            {
+                'verdict': verdict,
+                'final_score': final_score,
+                'distance': found[stored_hash],
+                'label': label,
+                'recorded_at': datetime.datetime.fromtimestamp(recorded_at).isoformat(timespec='seconds'),
+            }
+            for stored_hash, verdict, final_score, label, recorded_at in rows
+        ]
+        matches.sort(key=lambda match: match['distance'])
+        return matches
+
+    def lookup(self, image_hash):
+        """أقرب حكم سابق للبصمة أو None."""
+        matches = self.query(image_hash)
+        if not matches:
+            return None
+        PHASH_MATCHES.inc(verdict=matches[0]['verdict'])
+        return dict(matches[0], hash=f'{image_hash:016x}')
+
+    def record(self, image_hash, verdict, final_score):
+        """تسجيل حكم تحليل جديد إذا كان حاسماً (FORGED أو CLEAN)."""
+        if PHASH_RECORD and verdict in PHASH_RECORDED_VERDICTS:
+            self.add(image_hash, verdict, final_score, label=PHASH_ANALYSIS_LABEL)
+
+    def stats(self):
+        count = self._connect().execute('SELECT COUNT(*) FROM phashes').fetchone()[0]
+        return {'path': self.path, 'radius': self.radius, 'entries': count}
+
+
+def phash_version():
+    """إعدادات الفهرس التي تغيّر شكل النتيجة (تدخل في إصدار التحليل)."""
+    if not PHASH_INDEX_PATH:
+        return 'phash=off'
+    return f'phash={PHASH_IMAGE_SIZE}:{PHASH_LOW_FREQ}:{PHASH_RADIUS}'
+
+
+def create_phash_index(path=PHASH_INDEX_PATH):
+    """إنشاء الفهرس حسب SIDQ_PHASH_INDEX، أو None إذا لم يُضبط."""
+    if not path:
+        return None
+    return PHashIndex(path)
+
+
+# =========================================================
+# إضافة قوالب معروفة من سطر الأوامر
+# python phash_index.py <FORGED|CLEAN> <image1> <image2> ...
+# =========================================================
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 3 or sys.argv[1] not in PHASH_RECORDED_VERDICTS or not PHASH_INDEX_PATH:
+        print("الاستخدام: SIDQ_PHASH_INDEX=<ملف> python phash_index.py <FORGED|CLEAN> <صور...>")
+        sys.exit(1)
+
+    index = create_phash_index()
+    for path in sys.argv[2:]:
+        with Image.open(path) as image:
+            index.add(perceptual_hash(image), sys.argv[1], label=os.path.basename(path))
+    print(f"✅ تمت إضافة {len(sys.argv) - 2} صورة بحكم {sys.argv[1]} ({index.stats()['entries']} في الفهرس).")
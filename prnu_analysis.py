@@ -1,60 +1,211 @@
 import numpy as np
 from PIL import Image
-import cv2
 import io
-import base64 
+import os
+import base64
 
-# الاستيراد الضروري لـ Wiener filter
-try:
-    from skimage.restoration import wiener 
-except ImportError:
-    pass 
+from image_context import iter_tiles as iter_image_tiles
 
+# القيم المرجعية لتباين الضوضاء (مُحاكاة):
+LOW_VAR_THRESHOLD = 30.0
+HIGH_VAR_THRESHOLD = 150.0
 
-def extract_noise_pattern(image_stream):
+# حجم نافذة مرشح Wiener المحلي (بكسل)
+PRNU_WINDOW = 5
+# حجم البلاطة: تُعالج الصورة بدقتها الأصلية بلاطةً بلاطة (ذاكرة محدودة لكل بلاطة)
+PRNU_TILE_SIZE = int(os.environ.get('SIDQ_PRNU_TILE', '256'))
+# ميزانية المعالجة: أقصى عدد من البكسلات يُحلَّل لكل صورة. الصور الأكبر تُؤخذ
+# منها عينة منتظمة من البلاطات (بدون تصغير، فتبقى ضوضاء المستشعر سليمة)
+PRNU_MAX_PIXELS = int(os.environ.get('SIDQ_PRNU_MAX_PIXELS', str(8 * 1000 * 1000)))
+# البلاطة "غير متسقة" إذا اختلف تباينها عن الوسيط بأكثر من هذه النسبة (في أي اتجاه)
+PRNU_TILE_OUTLIER_RATIO = 4.0
+# أقصى بُعد لصورة الضوضاء المعروضة في التقرير (للعرض فقط، لا يؤثر على الحساب)
+PRNU_VISUAL_MAX_SIZE = 1024
+
+
+# =========================================================
+# 1. مرشح Wiener المحلي (متجه بالكامل عبر الصورة التكاملية)
+# =========================================================
+
+def _box_mean(padded, window):
+    """متوسط نافذة مربعة لكل بكسل عبر الصورة التكاملية (بدون حلقات)."""
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.float64)
+    np.cumsum(padded, axis=0, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    window_sum = (
+        integral[window:, window:] - integral[:-window, window:]
+        - integral[window:, :-window] + integral[:-window, :-window]
+    )
+    return window_sum / (window * window)
+
+
+def wiener_residual(padded, window=PRNU_WINDOW):
+    """
+    بقايا الضوضاء (الصورة - نسختها المنقّاة) بمرشح Wiener التكيفي المحلي،
+    بنفس صيغة scipy.signal.wiener مع تقدير قدرة الضوضاء من البلاطة نفسها.
+    padded: البلاطة مع هامش (window // 2) من كل جهة؛ الناتج بحجم البلاطة بدون الهامش.
+    """
+    padded = padded.astype(np.float64, copy=False)
+    local_mean = _box_mean(padded, window)
+    local_var = _box_mean(padded * padded, window) - local_mean * local_mean
+    np.maximum(local_var, 0.0, out=local_var)
+
+    margin = window // 2
+    center = padded[margin:padded.shape[0] - margin, margin:padded.shape[1] - margin]
+    noise_power = local_var.mean()
+
+    # حيث التباين المحلي أقل من الضوضاء يصبح الناتج هو المتوسط المحلي
+    residual = center - local_mean
+    gain = np.divide(noise_power, local_var, out=np.ones_like(local_var), where=local_var > noise_power)
+    residual *= gain
+    return residual
+
+
+# =========================================================
+# 2. تقسيم الصورة إلى بلاطات ضمن ميزانية المعالجة
+# =========================================================
+
+def iter_tiles(height, width, tile_size=PRNU_TILE_SIZE, max_pixels=PRNU_MAX_PIXELS):
+    """بلاطات PRNU ضمن ميزانيتها (انظر image_context.iter_tiles)."""
+    return iter_image_tiles(height, width, tile_size, max_pixels)
+
+
+def _padded_tile(gray, y0, y1, x0, x1, margin):
+    # هامش من البكسلات المجاورة الحقيقية، وانعكاس عند حواف الصورة فقط
+    height, width = gray.shape
+    top, left = max(0, y0 - margin), max(0, x0 - margin)
+    bottom, right = min(height, y1 + margin), min(width, x1 + margin)
+    tile = gray[top:bottom, left:right]
+    pad = ((margin - (y0 - top), margin - (bottom - y1)), (margin - (x0 - left), margin - (right - x1)))
+    if any(p for side in pad for p in side):
+        tile = np.pad(tile, pad, mode='symmetric')
+    return tile
+
+
+def center_residual(gray, size):
+    """
+    بقايا الضوضاء لمربع مركزي بحجم size (بالدقة الأصلية) مع شدة الإضاءة المقابلة،
+    لمقارنتها ببصمات الكاميرات. تُرجع (None, None) إذا كانت الصورة أصغر من size.
+    """
+    height, width = gray.shape
+    if height < size or width < size:
+        return None, None
+    y0, x0 = (height - size) // 2, (width - size) // 2
+    margin = PRNU_WINDOW // 2
+    residual = wiener_residual(_padded_tile(gray, y0, y0 + size, x0, x0 + size, margin))
+    intensity = gray[y0:y0 + size, x0:x0 + size].astype(np.float64)
+    return residual, intensity
+
+
+def compute_noise_map(gray, tile_size=PRNU_TILE_SIZE, max_pixels=PRNU_MAX_PIXELS, keep_residual=False):
     """
-    محاكاة استخلاص نمط الضوضاء (Noise Pattern) من الصورة (PRNU Approximation).
+    استخلاص بقايا الضوضاء بالدقة الأصلية بلاطةً بلاطة.
+    يُرجع قاموساً: التباين الكلي، مصفوفة تباين البلاطات (NaN للبلاطات غير المعالجة)،
+    وعند keep_residual=True قائمة (y0، x0، بقايا البلاطة) لتوليد صورة الضوضاء.
     """
-    
+    height, width = gray.shape
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+    tile_variances = np.full((rows, cols), np.nan, dtype=np.float64)
+    residual_tiles = [] if keep_residual else None
+
+    # مجاميع مشتركة لحساب التباين الكلي بدون تجميع البقايا في الذاكرة
+    total_count, total_sum, total_sq = 0, 0.0, 0.0
+    margin = PRNU_WINDOW // 2
+    for row, col, y0, y1, x0, x1 in iter_tiles(height, width, tile_size, max_pixels):
+        residual = wiener_residual(_padded_tile(gray, y0, y1, x0, x1, margin))
+        tile_variances[row, col] = residual.var()
+        total_count += residual.size
+        total_sum += residual.sum()
+        total_sq += np.square(residual).sum()
+        if keep_residual:
+            residual_tiles.append((y0, x0, residual.astype(np.float16)))
+
+    mean = total_sum / total_count
+    return {
+        'variance': max(total_sq / total_count - mean * mean, 0.0),
+        'tile_variances': tile_variances,
+        'tiles_processed': int(np.count_nonzero(~np.isnan(tile_variances))),
+        'tiles_total': rows * cols,
+        'residual_tiles': residual_tiles,
+    }
+
+
+def find_inconsistent_tiles(tile_variances, ratio=PRNU_TILE_OUTLIER_RATIO):
+    """قناع البلاطات التي يختلف تباين ضوضائها عن وسيط الصورة بأكثر من ratio."""
+    processed = ~np.isnan(tile_variances)
+    if not processed.any():
+        return np.zeros_like(processed)
+    median = np.median(tile_variances[processed])
+    if median <= 0:
+        return np.zeros_like(processed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = np.abs(np.log(np.maximum(tile_variances, 1e-12) / median))
+    return processed & (deviation > np.log(ratio))
+
+
+def _render_residual(residual_tiles, height, width, variance):
+    # تطبيع ثابت (±3σ) بدلاً من min/max حتى لا تطغى بكسلات شاذة على الصورة
+    limit = 3.0 * np.sqrt(variance) or 1.0
+    canvas = np.full((height, width), 128, dtype=np.uint8)
+    for y0, x0, residual in residual_tiles:
+        scaled = (np.clip(residual.astype(np.float32), -limit, limit) + limit) * (127.5 / limit)
+        canvas[y0:y0 + residual.shape[0], x0:x0 + residual.shape[1]] = scaled.astype(np.uint8)
+
+    prnu_img = Image.fromarray(canvas, mode='L')
+    # تصغير للعرض فقط (NEAREST يحافظ على نسيج الضوضاء بدلاً من تمويهه)
+    prnu_img.thumbnail((PRNU_VISUAL_MAX_SIZE, PRNU_VISUAL_MAX_SIZE), Image.NEAREST)
+    buffer = io.BytesIO()
+    prnu_img.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+def _noise_map_summary(noise_map, inconsistent):
+    # ملخص قابل للتسلسل (JSON) لخريطة التباين المكانية
+    tile_variances = noise_map['tile_variances']
+    return {
+        'tile_size': PRNU_TILE_SIZE,
+        'rows': tile_variances.shape[0],
+        'cols': tile_variances.shape[1],
+        'tiles_processed': noise_map['tiles_processed'],
+        'tiles_total': noise_map['tiles_total'],
+        'variances': [
+            [None if np.isnan(v) else round(float(v), 2) for v in row]
+            for row in tile_variances
+        ],
+        'inconsistent_tiles': [[int(r), int(c)] for r, c in np.argwhere(inconsistent)],
+        'inconsistent_ratio': float(inconsistent.sum()) / max(1, noise_map['tiles_processed']),
+    }
+
+
+# =========================================================
+# 3. تحليل PRNU الكامل
+# =========================================================
+
+def extract_noise_pattern(image_context, include_visuals=True):
+    """
+    استخلاص نمط الضوضاء (Noise Pattern) من الصورة (PRNU Approximation)
+    بدقتها الأصلية وعلى شكل بلاطات، مع خريطة مكانية لتباين الضوضاء.
+    تستقبل سياق الصورة المشترك (ImageContext) المفكوك مرة واحدة.
+    عند include_visuals=False تُحسب الدرجة فقط بدون ترميز صورة الضوضاء.
+
+    تُرجع (الحكم، الدرجة، صورة الضوضاء Base64، ملخص خريطة البلاطات).
+    """
+
     prnu_base64_image = None
-    prnu_trust_score = 0.0
-    # رسالة افتراضية في حالة عدم توفر المكتبة
-    prnu_verdict = f"❌ خطأ: فشل استخلاص PRNU (قد تكون مكتبة scikit-image مفقودة)." 
+    noise_map_summary = None
 
-    # 1. التحقق من توفر Wiener Filter
     try:
-        wiener_func = wiener
-    except NameError:
-        image_stream.seek(0)
-        return prnu_verdict, prnu_trust_score, prnu_base64_image
+        # الصورة الرمادية من السياق المشترك (بدون إعادة فك الترميز)
+        gray = image_context.gray
 
-    try:
-        # **خطوة حاسمة:** إعادة تعيين مؤشر الدفق إلى البداية.
-        image_stream.seek(0) 
-        
-        # قراءة الصورة وتحويلها للرمادي للتبسيط
-        img = Image.open(image_stream).convert('L') 
-        
-        # تحجيم الصورة لتسريع عملية Wiener Filter
-        if img.width > 500 or img.height > 500:
-            img = img.resize((500, 500), Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.ANTIALIAS)
-            
-        img_np = np.array(img, dtype=np.float32)
-        
-        # 2. تطبيق مرشح Wiener لحساب الضوضاء المقدرة
-        denoised_img = wiener(img_np, (5, 5), balance=0.01) 
-        
-        # حساب الضوضاء المقدرة
-        noise_pattern = img_np - denoised_img
-        
-        # 3. حساب درجة الثقة (التحقق من التباين)
-        noise_variance = np.var(noise_pattern)
-
-        # القيم المرجعية (مُحاكاة):
-        LOW_VAR_THRESHOLD = 30.0  
-        HIGH_VAR_THRESHOLD = 150.0 
-        
-        prnu_trust_score = 0.0 
+        # 1. بقايا الضوضاء لكل بلاطة بمرشح Wiener المحلي
+        noise_map = compute_noise_map(gray, keep_residual=include_visuals)
+        noise_variance = noise_map['variance']
+        inconsistent = find_inconsistent_tiles(noise_map['tile_variances'])
+        noise_map_summary = _noise_map_summary(noise_map, inconsistent)
+
+        # 2. حساب درجة الثقة (التحقق من التباين)
+        prnu_trust_score = 0.0
 
         if noise_variance < LOW_VAR_THRESHOLD:
             prnu_trust_score = 10.0 + 30.0 * (noise_variance / LOW_VAR_THRESHOLD)
@@ -68,19 +219,21 @@ def extract_noise_pattern(image_stream):
             prnu_trust_score = 40.0 + range_score * ((noise_variance - LOW_VAR_THRESHOLD) / range_var)
             prnu_verdict = f"✅ تباين ضوضاء طبيعي ({noise_variance:.2f})."
 
+        if noise_map_summary['inconsistent_tiles']:
+            prnu_verdict += (
+                f" مناطق ضوضاء غير متسقة: {len(noise_map_summary['inconsistent_tiles'])}"
+                f" من {noise_map_summary['tiles_processed']} بلاطة."
+            )
+
+        # 3. توليد صورة الضوضاء Base64 (عند الطلب فقط)
+        if include_visuals:
+            prnu_base64_image = _render_residual(
+                noise_map['residual_tiles'], gray.shape[0], gray.shape[1], noise_variance
+            )
 
-        # 4. توليد صورة الضوضاء Base64
-        noise_img_scaled = ((noise_pattern - noise_pattern.min()) / (noise_pattern.max() - noise_pattern.min())) * 255
-        noise_img_scaled = noise_img_scaled.astype(np.uint8)
-        
-        prnu_img = Image.fromarray(noise_img_scaled, mode='L')
-        buffer = io.BytesIO()
-        prnu_img.save(buffer, format="PNG")
-        prnu_base64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # 4. إرجاع النتائج
+        return prnu_verdict, float(prnu_trust_score), prnu_base64_image, noise_map_summary
 
-        # 5. إرجاع النتائج
-        return prnu_verdict, float(prnu_trust_score), prnu_base64_image
-        
     except Exception as e:
         prnu_verdict = f"❌ خطأ حرج في تحليل PRNU: {str(e)}"
-        return prnu_verdict, 0.0, prnu_base64_image
\ No newline at end of file
+        return prnu_verdict, 0.0, prnu_base64_image, noise_map_summary
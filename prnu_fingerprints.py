@@ -0,0 +1,300 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from prnu_analysis import center_residual
+
+# =========================================================
+# قاعدة بصمات PRNU المرجعية للكاميرات (مطابقة سريعة بالارتباط)
+# =========================================================
+
+# مجلد قاعدة البصمات؛ فارغ = المطابقة معطلة
+PRNU_DB_PATH = os.environ.get('SIDQ_PRNU_DB', '')
+# حجم المربع المركزي المستخدم للبصمة (بكسل)
+PRNU_FINGERPRINT_SIZE = int(os.environ.get('SIDQ_PRNU_FINGERPRINT_SIZE', '256'))
+# عدد البصمات المقروءة من القرص في كل خطوة (يحد استهلاك الذاكرة أثناء المطابقة)
+PRNU_MATCH_CHUNK = 128
+# عدد أفضل المرشحين الذين يُحسب لهم PCE (الأغلى حساباً)
+PRNU_PCE_TOP_K = 5
+# عتبة PCE المعتادة في الأدبيات لاعتبار الصورة صادرة من الكاميرا
+PRNU_PCE_THRESHOLD = 60.0
+# نصف حجم الجوار المستبعد حول القمة عند حساب طاقة الخلفية في PCE
+PRNU_PCE_NEIGHBORHOOD = 5
+
+_INDEX_FILE = 'index.json'
+
+
+def camera_key(make, model):
+    """مفتاح الكاميرا الموحد من حقلي EXIF (make و model)."""
+    return f"{str(make).strip().lower()}|{str(model).strip().lower()}"
+
+
+def _slug(key):
+    return re.sub(r'[^a-z0-9]+', '-', key).strip('-') or 'camera'
+
+
+def _zero_mean(array):
+    return array - array.mean()
+
+
+def estimate_fingerprint(grays, size=PRNU_FINGERPRINT_SIZE):
+    """
+    تقدير بصمة الكاميرا K من عدة صور رمادية لنفس الكاميرا
+    (مقدّر الاحتمال الأعظم: K = Σ W·I / Σ I²)، مطبّعة إلى تباين واحد.
+    """
+    numerator = np.zeros((size, size), dtype=np.float64)
+    denominator = np.zeros((size, size), dtype=np.float64)
+    used = 0
+    for gray in grays:
+        residual, intensity = center_residual(gray, size)
+        if residual is None:
+            continue
+        numerator += residual * intensity
+        denominator += intensity * intensity
+        used += 1
+    if not used:
+        raise ValueError(f'لا توجد صور بحجم {size}x{size} على الأقل لتقدير البصمة.')
+
+    fingerprint = _zero_mean(numerator / (denominator + 1.0))
+    std = fingerprint.std()
+    return (fingerprint / std if std > 0 else fingerprint).astype(np.float16), used
+
+
+def _pce(query, references):
+    """
+    نسبة طاقة قمة الارتباط (PCE) لكل مرجع عند الإزاحة الصفرية،
+    عبر الارتباط الدائري بتحويل فورييه لكل المراجع دفعة واحدة.
+    """
+    size = query.shape[-1]
+    correlation = np.fft.irfft2(
+        np.fft.rfft2(query)[None] * np.conj(np.fft.rfft2(references, axes=(-2, -1))),
+        s=(size, size), axes=(-2, -1),
+    )
+    peak = correlation[:, 0, 0]
+
+    # استبعاد جوار القمة (مع الالتفاف حول الحواف) من طاقة الخلفية
+    offsets = np.r_[0:PRNU_PCE_NEIGHBORHOOD + 1, size - PRNU_PCE_NEIGHBORHOOD:size]
+    mask = np.ones((size, size), dtype=bool)
+    mask[np.ix_(offsets, offsets)] = False
+    background = np.mean(np.square(correlation[:, mask]), axis=1)
+    return np.sign(peak) * np.square(peak) / np.maximum(background, 1e-30)
+
+
+class FingerprintDB:
+    """
+    بصمات مرجعية مخزنة كمصفوفات float16 على القرص (مصفوفة لكل make/model)
+    تُفتح بـ memmap، فلا تُحمَّل القاعدة كاملة في الذاكرة. المطابقة تحسب
+    الارتباط المطبّع (NCC) لكل البصمات على دفعات كجداءات نقطية، ثم PCE لأفضل المرشحين.
+
+    يمكن الإضافة من عملية أخرى (سطر الأوامر) أثناء عمل الخادم: يُعاد قراءة
+    الفهرس تلقائياً عند تغيّره، وكل إضافة تكتب ملفاً جديداً بدلاً من تعديل المفتوح.
+    """
+
+    def __init__(self, path, size=PRNU_FINGERPRINT_SIZE):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._index = None
+        self._index_mtime = None
+        self._arrays = {}  # اسم الملف -> memmap
+        os.makedirs(path, exist_ok=True)
+
+    # ----------------------------------------------------
+    # الفهرس والملفات
+    # ----------------------------------------------------
+
+    def _index_path(self):
+        return os.path.join(self.path, _INDEX_FILE)
+
+    def _load_index(self):
+        try:
+            mtime = os.stat(self._index_path()).st_mtime_ns
+        except FileNotFoundError:
+            return {'size': self.size, 'revision': 0, 'cameras': {}}
+
+        with self._lock:
+            if self._index is None or self._index_mtime != mtime:
+                with open(self._index_path(), encoding='utf-8') as f:
+                    self._index = json.load(f)
+                self._index_mtime = mtime
+                # إغلاق ملفات الإصدارات القديمة
+                live = {camera['file'] for camera in self._index['cameras'].values()}
+                self._arrays = {name: array for name, array in self._arrays.items() if name in live}
+            return self._index
+
+    def _array(self, filename):
+        with self._lock:
+            array = self._arrays.get(filename)
+            if array is None:
+                array = np.load(os.path.join(self.path, filename), mmap_mode='r')
+                self._arrays[filename] = array
+            return array
+
+    def _write_atomic(self, filename, write_fn):
+        tmp_path = os.path.join(self.path, f'.{filename}.tmp')
+        write_fn(tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, filename))
+
+    # ----------------------------------------------------
+    # الإضافة والاستعلام
+    # ----------------------------------------------------
+
+    def enroll(self, make, model, grays, label=None):
+        """
+        إضافة بصمة جديدة للكاميرا (make، model) مقدّرة من الصور الرمادية grays.
+        تُرجع عدد الصور المستخدمة.
+        """
+        fingerprint, used = estimate_fingerprint(grays, self.size)
+        key = camera_key(make, model)
+
+        index = dict(self._load_index())
+        if index.get('size', self.size) != self.size:
+            raise ValueError(f"حجم البصمات في القاعدة ({index['size']}) لا يطابق {self.size}.")
+        cameras = dict(index['cameras'])
+        revision = index['revision'] + 1
+
+        camera = cameras.get(key)
+        if camera is not None:
+            existing = self._array(camera['file'])
+            stacked = np.concatenate([existing, fingerprint[None]])
+            labels = camera['labels'] + [label or f'fingerprint-{len(camera["labels"]) + 1}']
+        else:
+            stacked = fingerprint[None]
+            labels = [label or 'fingerprint-1']
+
+        filename = f'{_slug(key)}-{revision}.npy'
+
+        def write_array(tmp):
+            with open(tmp, 'wb') as f:
+                np.save(f, stacked)
+        self._write_atomic(filename, write_array)
+        cameras[key] = {'make': str(make), 'model': str(model), 'file': filename, 'labels': labels}
+
+        index.update(size=self.size, revision=revision, cameras=cameras)
+
+        def write_index(tmp):
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, indent=2)
+        self._write_atomic(_INDEX_FILE, write_index)
+
+        # حذف الإصدار السابق (العمليات التي فتحته تحتفظ بنسختها حتى تعيد قراءة الفهرس)
+        if camera is not None:
+            try:
+                os.remove(os.path.join(self.path, camera['file']))
+            except OSError:
+                pass
+        return used
+
+    def has_camera(self, make, model):
+        return camera_key(make, model) in self._load_index()['cameras']
+
+    def match(self, gray, make=None, model=None, top_k=PRNU_PCE_TOP_K):
+        """
+        مطابقة صورة رمادية مع البصمات المخزنة (كاميرا EXIF فقط إذا حُددت make و model).
+        تُرجع قائمة بأفضل المرشحين مرتبة تنازلياً حسب NCC، أو [] إذا تعذرت المطابقة.
+        """
+        residual, intensity = center_residual(gray, self.size)
+        if residual is None:
+            return []
+
+        cameras = self._load_index()['cameras']
+        if make is not None or model is not None:
+            key = camera_key(make, model)
+            cameras = {key: cameras[key]} if key in cameras else {}
+        if not cameras:
+            return []
+
+        # ترتيب أولي بجداء نقطي واحد لكل بصمة: البصمات مطبّعة إلى تباين واحد،
+        # فمقام NCC(W, I·K) ≈ ||W||·||I|| ثابت للاستعلام ولا يحتاج قراءة البصمة مرتين
+        dims = self.size * self.size
+        query = _zero_mean(residual)
+        weighted = (query * intensity).astype(np.float32).ravel()
+        weighted /= max(np.linalg.norm(query) * np.linalg.norm(intensity), 1e-12)
+
+        keys, scores = [], []
+        buffer = np.empty((PRNU_MATCH_CHUNK, dims), dtype=np.float32)
+        for key, camera in cameras.items():
+            array = self._array(camera['file']).reshape(-1, dims)
+            camera_scores = np.empty(array.shape[0], dtype=np.float32)
+            for start in range(0, array.shape[0], PRNU_MATCH_CHUNK):
+                count = min(PRNU_MATCH_CHUNK, array.shape[0] - start)
+                # تحويل float16 -> float32 داخل مخزن مؤقت ثابت (بدون نسخ جديدة لكل دفعة)
+                np.copyto(buffer[:count], array[start:start + count])
+                np.matmul(buffer[:count], weighted, out=camera_scores[start:start + count])
+            keys.append(key)
+            scores.append(camera_scores)
+
+        # أفضل المرشحين عبر كل الكاميرات
+        offsets = np.cumsum([0] + [len(camera_scores) for camera_scores in scores])
+        all_scores = np.concatenate(scores)
+        top_k = min(max(1, top_k), all_scores.size)
+        top = np.argpartition(-all_scores, top_k - 1)[:top_k]
+        candidates = []
+        for flat in top:
+            camera_index = int(np.searchsorted(offsets, flat, side='right')) - 1
+            candidates.append((keys[camera_index], int(flat - offsets[camera_index])))
+
+        # NCC الدقيق و PCE لأفضل المرشحين فقط
+        references = np.stack([
+            _zero_mean(intensity * self._array(cameras[key]['file'])[row].astype(np.float64))
+            for key, row in candidates
+        ])
+        ncc_values = (references.reshape(len(candidates), -1) @ query.ravel()) / np.maximum(
+            np.linalg.norm(references.reshape(len(candidates), -1), axis=1) * np.linalg.norm(query), 1e-12
+        )
+        pce_values = _pce(query, references)
+        results = sorted(zip(ncc_values, pce_values, candidates), key=lambda item: -item[0])
+
+        return [
+            {
+                'camera': f"{cameras[key]['make']} {cameras[key]['model']}",
+                'label': cameras[key]['labels'][row],
+                'ncc': round(float(ncc), 5),
+                'pce': round(float(pce), 2),
+                'matched': bool(pce >= PRNU_PCE_THRESHOLD),
+            }
+            for ncc, pce, (key, row) in results
+        ]
+
+    def version(self):
+        """إصدار القاعدة لإبطال النتائج المخزنة عند إضافة بصمات جديدة."""
+        index = self._load_index()
+        return f"{index.get('size', self.size)}-{index['revision']}"
+
+    def stats(self):
+        cameras = self._load_index()['cameras']
+        return {
+            'path': self.path,
+            'size': self.size,
+            'cameras': len(cameras),
+            'fingerprints': sum(len(camera['labels']) for camera in cameras.values()),
+        }
+
+
+def create_fingerprint_db(path=PRNU_DB_PATH):
+    """إنشاء قاعدة البصمات حسب SIDQ_PRNU_DB، أو None إذا لم تُضبط."""
+    if not path:
+        return None
+    return FingerprintDB(path)
+
+
+# =========================================================
+# إضافة بصمة كاميرا من سطر الأوامر
+# python prnu_fingerprints.py <make> <model> <image1> <image2> ...
+# =========================================================
+
+if __name__ == '__main__':
+    import sys
+    from PIL import Image
+
+    if len(sys.argv) < 4 or not PRNU_DB_PATH:
+        print("الاستخدام: SIDQ_PRNU_DB=<مجلد> python prnu_fingerprints.py <make> <model> <صور...>")
+        sys.exit(1)
+
+    make, model, paths = sys.argv[1], sys.argv[2], sys.argv[3:]
+    grays = (np.asarray(Image.open(path).convert('L')) for path in paths)
+    used = create_fingerprint_db().enroll(make, model, grays, label=os.path.basename(paths[0]))
+    print(f"✅ تمت إضافة بصمة {make} {model} من {used} صورة.")
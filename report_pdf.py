@@ -0,0 +1,250 @@
+import base64
+import io
+
+from PIL import Image
+
+from ela_analysis import compute_ela
+
+# =========================================================
+# إعدادات التقرير (ReportLab)
+# =========================================================
+
+try:
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.lib.utils import ImageReader
+    from reportlab.lib import colors
+
+    # ⚠️ **هام:** يجب أن يكون ملف الخط 'Tajawal-Bold.ttf' موجوداً
+    pdfmetrics.registerFont(TTFont('Tajawal', 'Tajawal-Bold.ttf'))
+    ARABIC_FONT = 'Tajawal'
+except Exception as e:
+    print(f"WARNING: فشل تحميل خط Tajawal أو ReportLab: {e}. سيتم استخدام الخط الافتراضي.")
+    ARABIC_FONT = 'Helvetica'
+
+# أقصى بُعد (بكسل) للصور المضمّنة: صور الأقسام تُرسم بعرض 300 نقطة
+# والأصل بعرض الصفحة، فالدقة الأعلى لا تظهر وتضخم الملف فقط
+REPORT_SECTION_IMAGE_MAX_SIZE = 600
+REPORT_ORIGINAL_IMAGE_MAX_SIZE = 1000
+# جودة ضغط JPEG للصور المضمّنة
+REPORT_JPEG_QUALITY = 80
+
+# الصور المضمّنة في التقرير بالترتيب
+REPORT_ASSETS = ('prnu', 'ela', 'copymove', 'gradcam', 'original')
+# مرحلة التحليل التي تنتمي إليها كل صورة (لا تُولَّد صور المراحل المتخطاة)
+REPORT_ASSET_STAGES = {'prnu': 'prnu', 'ela': 'ela', 'copymove': 'copymove', 'gradcam': 'ai'}
+
+
+# =========================================================
+# صور التقرير (مصغّرة ومرمّزة JPEG مرة واحدة لكل تحليل)
+# =========================================================
+
+def _jpeg_thumbnail(img, max_size):
+    img = img.convert('RGB') if img.mode != 'RGB' else img.copy()
+    img.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=REPORT_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def report_asset_names(analysis_data):
+    """
+    صور التقرير المطلوبة، بدون صور المراحل التي تخطاها التقييم المتتالي
+    أو التي لم تكن موجودة عند حفظ النتيجة (لا يوجد حقل {المرحلة}_verdict).
+    """
+    skipped = set(analysis_data.get('skipped_stages') or ())
+    return tuple(
+        name for name in REPORT_ASSETS
+        if name not in REPORT_ASSET_STAGES
+        or (REPORT_ASSET_STAGES[name] not in skipped and f'{REPORT_ASSET_STAGES[name]}_verdict' in analysis_data)
+    )
+
+
+def render_report_asset(image_context, name, render_artefact):
+    """
+    صورة التقرير name كبايتات JPEG مصغّرة (أو None).
+    ELA تُصغَّر مباشرة من صورة الخطأ دون المرور بترميز PNG بالدقة الكاملة،
+    وبقية الصور تُؤخذ من render_artefact (وهي صغيرة أصلاً).
+    """
+    if name == 'original':
+        return _jpeg_thumbnail(image_context.reduced_image(REPORT_ORIGINAL_IMAGE_MAX_SIZE),
+                               REPORT_ORIGINAL_IMAGE_MAX_SIZE)
+    if name == 'ela':
+        error_img = compute_ela(image_context.rgb_image, extra_qualities=(), keep_error_image=True)[2]
+        return _jpeg_thumbnail(error_img, REPORT_SECTION_IMAGE_MAX_SIZE)
+
+    image_base64 = render_artefact(image_context, name)
+    if not image_base64:
+        return None
+    with Image.open(io.BytesIO(base64.b64decode(image_base64))) as img:
+        return _jpeg_thumbnail(img, REPORT_SECTION_IMAGE_MAX_SIZE)
+
+
+# =========================================================
+# توليد التقرير
+# =========================================================
+
+def build_report_pdf(analysis_data, timestamp, images):
+    """
+    بناء تقرير PDF وإرجاع بايتاته.
+    images: {'prnu'|'ela'|'copymove'|'gradcam'|'original': بايتات JPEG مصغّرة أو None}،
+    تُضمَّن في PDF كما هي (DCTDecode) بدون فك أو إعادة ترميز.
+    """
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    # إعداد الخط الأساسي
+    font_size = 12
+    p.setFont(ARABIC_FONT, font_size)
+    line_height = font_size * 1.5
+    margin = 50
+    x, y = width - margin, height - margin
+
+    # 1. رأس التقرير والختم
+    p.setFont(ARABIC_FONT, 20)
+    p.drawRightString(x, y, "تقرير الأدلة الجنائية لخدمة صِدق (Sidq Report)")
+    y -= line_height * 2
+
+    p.setFont(ARABIC_FONT, 10)
+    p.drawRightString(x, y, f"تاريخ ووقت التحليل: {timestamp}")
+    y -= line_height
+
+    # 2. قسم القرار الأمني (الختم)
+    p.setFillColor(colors.white)
+
+    if analysis_data['abshr_verdict'] == 'CLEAN':
+        box_color = colors.green
+        verdict_text = "✅ أصالة مُؤكَّدة (CLEAN)"
+    elif analysis_data['abshr_verdict'] == 'CAUTION':
+        box_color = colors.orange
+        verdict_text = "⚠️ احتمالية تلاعب (CAUTION)"
+    else:
+        box_color = colors.red
+        verdict_text = "❌ تزوير مُؤكَّد (FORGED)"
+
+    p.setFillColor(box_color)
+    p.rect(margin, y - 50, width - 2 * margin, 60, fill=1) # رسم مستطيل خلفي
+
+    p.setFillColor(colors.white)
+    p.setFont(ARABIC_FONT, 18)
+    p.drawCentredString(width / 2, y - 30, verdict_text)
+    y -= line_height * 4
+
+    # 3. جدول المعلومات الأساسية
+    p.setFillColor(colors.black)
+    p.setFont(ARABIC_FONT, font_size)
+    p.drawRightString(x, y, "أ. البيانات الأساسية للوثيقة")
+    y -= line_height
+
+    # دالة بسيطة لرسم سطر المعلومات
+    def draw_info_line(key, value):
+        nonlocal y
+        p.setFont(ARABIC_FONT, font_size)
+        p.drawRightString(x, y, key)
+        p.drawString(margin + 150, y, str(value))
+        y -= line_height
+
+    draw_info_line("الدرجة النهائية:", f"{analysis_data['final_score']:.2f}%")
+    draw_info_line("صانع الكاميرا:", analysis_data['metadata']['make'])
+    draw_info_line("طراز الكاميرا:", analysis_data['metadata']['model'])
+    draw_info_line("تاريخ الالتقاط:", analysis_data['metadata']['datetime'])
+    draw_info_line("الأبعاد (بكسل):", analysis_data['metadata']['size'])
+    draw_info_line("صيغة الملف:", analysis_data['metadata']['format'])
+    y -= line_height
+
+    # 4. قسم نتائج التحليل التفصيلية (التحليل الجنائي)
+    p.drawRightString(x, y, "ب. نتائج التحليل الجنائي")
+    y -= line_height
+
+    # دالة لرسم قسم التحليل
+    def draw_analysis_section(title, score, verdict, image_bytes):
+        nonlocal y
+        p.setFillColor(colors.blue)
+        p.setFont(ARABIC_FONT, font_size)
+        p.drawRightString(x, y, title)
+        y -= line_height
+
+        p.setFillColor(colors.black)
+        # None = مرحلة تخطاها التقييم المتتالي
+        draw_info_line("الدرجة:", f"{score:.2f}%" if score is not None else "—")
+        draw_info_line("الخلاصة:", verdict)
+        y -= line_height
+
+        # عرض صورة الدليل الجنائي
+        if image_bytes:
+            try:
+                img = ImageReader(io.BytesIO(image_bytes))
+                # رسم الصورة (300 نقطة عرض)
+                img_w, img_h = 300, 300 * (img.getSize()[1] / img.getSize()[0])
+
+                # التحقق من تجاوز حدود الصفحة
+                if y - img_h < margin:
+                    p.showPage()
+                    p.setFont(ARABIC_FONT, font_size)
+                    y = height - margin - line_height * 2 # بدء صفحة جديدة
+
+                p.drawImage(img, width - margin - img_w, y - img_h, width=img_w, height=img_h)
+                y -= img_h + line_height
+            except Exception as e:
+                p.setFillColor(colors.red)
+                p.drawRightString(x, y, f"❌ خطأ في عرض الصورة: {e}")
+                y -= line_height
+                p.setFillColor(colors.black)
+
+    # التحليل حسب الترتيب
+    draw_analysis_section("PRNU (تحليل ضوضاء الكاميرا)",
+                          analysis_data['prnu_score'],
+                          analysis_data['prnu_verdict'],
+                          images.get('prnu'))
+
+    draw_analysis_section("ELA (تحليل مستوى الخطأ)",
+                          analysis_data['ela_score'],
+                          analysis_data['ela_verdict'],
+                          images.get('ela'))
+
+    # النتائج المحفوظة قبل إضافة مرحلة النسخ واللصق لا تحتوي على حقولها
+    if 'copymove_verdict' in analysis_data:
+        draw_analysis_section("Copy-Move (كشف النسخ واللصق)",
+                              analysis_data['copymove_score'],
+                              analysis_data['copymove_verdict'],
+                              images.get('copymove'))
+
+    draw_analysis_section("AI/GradCAM (الذكاء الاصطناعي)",
+                          analysis_data['ai_score'],
+                          analysis_data['ai_verdict'],
+                          images.get('gradcam'))
+
+    # 5. الصورة الأصلية في نهاية التقرير
+    if images.get('original'):
+        p.showPage() # صفحة جديدة للصورة الأصلية
+        y = height - margin
+        p.setFont(ARABIC_FONT, 14)
+        p.drawRightString(x, y, "ج. الصورة الأصلية المرسلة للتحليل")
+        y -= line_height * 2
+
+        try:
+            img = ImageReader(io.BytesIO(images['original']))
+
+            # تحجيم الصورة لتناسب عرض الصفحة (بحد أقصى)
+            img_w, img_h = width - 2 * margin, (width - 2 * margin) * (img.getSize()[1] / img.getSize()[0])
+
+            # رسم الصورة في منتصف الصفحة
+            p.drawImage(img, margin, y - img_h, width=img_w, height=img_h)
+            y -= img_h
+        except Exception as e:
+            p.setFillColor(colors.red)
+            p.drawRightString(x, y, f"❌ خطأ في عرض الصورة الأصلية: {e}")
+
+    # 6. حفظ التقرير
+    p.save()
+    return buffer.getvalue()
+
+
+def iter_chunks(data, chunk_size=64 * 1024):
+    """بث البايتات على أجزاء بدلاً من إرسالها كتلة واحدة."""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
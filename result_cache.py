@@ -0,0 +1,102 @@
+import hashlib
+import os
+import threading
+
+from result_store import MemoryResultStore, SQLiteResultStore
+
+# =========================================================
+# ذاكرة مؤقتة للنتائج حسب محتوى الملف (لإعادة الإرسال المتكرر)
+# =========================================================
+
+# تفعيل/تعطيل الذاكرة المؤقتة (1 أو 0)
+RESULT_CACHE_ENABLED = os.environ.get('SIDQ_RESULT_CACHE', '1') == '1'
+# حدود المستوى الأول (داخل الذاكرة)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('SIDQ_RESULT_CACHE_MAX_ENTRIES', '4096'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('SIDQ_RESULT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get('SIDQ_RESULT_CACHE_TTL', str(24 * 3600)))
+# المستوى الثاني الاختياري على القرص (مشترك بين العمال)، مثال: /var/sidq/result_cache.db
+RESULT_CACHE_DISK_PATH = os.environ.get('SIDQ_RESULT_CACHE_DISK', '')
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('SIDQ_RESULT_CACHE_DISK_MAX_ENTRIES', '200000'))
+RESULT_CACHE_DISK_MAX_BYTES = int(os.environ.get('SIDQ_RESULT_CACHE_DISK_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+
+class ResultCache:
+    """
+    ذاكرة مؤقتة بمستويين مفتاحها بصمة SHA-256 لبايتات الملف مع إصدار
+    النموذج ومعاملات التحليل، فأي تغيير في النموذج أو العتبات يُبطل المفاتيح القديمة.
+    """
+
+    def __init__(self, memory_store, disk_store=None):
+        self.memory_store = memory_store
+        self.disk_store = disk_store
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def content_digest(raw_bytes):
+        return hashlib.sha256(raw_bytes).hexdigest()
+
+    @staticmethod
+    def make_key(digest, version):
+        return f'{digest}:{version}'
+
+    def get(self, key):
+        value = self.memory_store.get(key)
+        if value is not None:
+            with self._lock:
+                self._hits += 1
+            return value
+
+        if self.disk_store is not None:
+            value = self.disk_store.get(key)
+            if value is not None:
+                # ترقية النتيجة إلى المستوى الأول
+                self.memory_store.put(key, value)
+                with self._lock:
+                    self._disk_hits += 1
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, value):
+        self.memory_store.put(key, value)
+        if self.disk_store is not None:
+            self.disk_store.put(key, value)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+            }
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = ((stats['hits'] + stats['disk_hits']) / lookups) if lookups else 0.0
+        stats['memory'] = self.memory_store.stats()
+        if self.disk_store is not None:
+            stats['disk'] = self.disk_store.stats()
+        return stats
+
+
+def create_result_cache():
+    """إنشاء الذاكرة المؤقتة حسب الإعدادات، أو None إذا كانت معطلة."""
+    if not RESULT_CACHE_ENABLED:
+        return None
+    memory_store = MemoryResultStore(
+        ttl=RESULT_CACHE_TTL_SECONDS,
+        max_entries=RESULT_CACHE_MAX_ENTRIES,
+        max_bytes=RESULT_CACHE_MAX_BYTES,
+    )
+    disk_store = None
+    if RESULT_CACHE_DISK_PATH:
+        disk_store = SQLiteResultStore(
+            RESULT_CACHE_DISK_PATH,
+            ttl=RESULT_CACHE_TTL_SECONDS,
+            max_entries=RESULT_CACHE_DISK_MAX_ENTRIES,
+            max_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+        )
+    return ResultCache(memory_store, disk_store)
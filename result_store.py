@@ -0,0 +1,191 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# =========================================================
+# مخزن نتائج التحليل على الخادم (بدلاً من ملف تعريف الارتباط)
+# =========================================================
+
+# نوع المخزن: memory أو sqlite:///results.db
+RESULT_STORE_URL = os.environ.get('SIDQ_RESULT_STORE', 'memory')
+# مدة صلاحية النتيجة (بالثواني)
+RESULT_TTL_SECONDS = float(os.environ.get('SIDQ_RESULT_TTL', '3600'))
+# الحد الأقصى لعدد العناصر وحجمها الإجمالي
+RESULT_MAX_ENTRIES = int(os.environ.get('SIDQ_RESULT_MAX_ENTRIES', '512'))
+RESULT_MAX_BYTES = int(os.environ.get('SIDQ_RESULT_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def estimate_size(value):
+    """تقدير تقريبي لحجم القيمة بالبايت (يكفي لتطبيق حد الحجم)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 16
+
+
+class MemoryResultStore:
+    """
+    مخزن داخل الذاكرة مع إخلاء LRU وانتهاء صلاحية (TTL) وحد للحجم.
+    مناسب لعامل واحد؛ لا يُشارك بين عمليات gunicorn.
+    """
+
+    def __init__(self, ttl=RESULT_TTL_SECONDS, max_entries=RESULT_MAX_ENTRIES, max_bytes=RESULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, key, value, ttl=None):
+        size = estimate_size(value)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, size, expires_at)
+            self._total_bytes += size
+            self._evict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[2] <= time.time():
+                self._pop(key)
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'entries': len(self._entries), 'bytes': self._total_bytes}
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, (_, _, expires_at) in self._entries.items() if expires_at <= now]:
+            self._pop(key)
+        while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+
+
+class SQLiteResultStore:
+    """
+    مخزن على القرص (SQLite) يُشارك بين جميع عمال gunicorn على نفس الجهاز،
+    مع إخلاء حسب آخر استخدام وانتهاء صلاحية وحد للحجم.
+    """
+
+    def __init__(self, path, ttl=RESULT_TTL_SECONDS, max_entries=RESULT_MAX_ENTRIES, max_bytes=RESULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_bytes))
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,'
+                ' expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)')
+
+    def _connect(self):
+        # اتصال مستقل لكل خيط (ولكل عملية بعد fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def put(self, key, value, ttl=None):
+        if isinstance(value, memoryview):
+            # أصل الصورة المربوط بالذاكرة (mmap) لا يُسلسل؛ يُنسخ هنا فقط عند الكتابة في SQLite
+            value = value.tobytes()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+            (key, blob, len(blob), expires_at, now),
+        )
+        self._evict(conn, now)
+
+    def get(self, key, default=None):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute('SELECT value, expires_at FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        if row[1] <= now:
+            conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            return default
+        conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+        return pickle.loads(row[0])
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def __contains__(self, key):
+        row = self._connect().execute(
+            'SELECT 1 FROM results WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def stats(self):
+        entries, total_bytes = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results'
+        ).fetchone()
+        return {'backend': 'sqlite', 'path': self.path, 'entries': entries, 'bytes': total_bytes}
+
+    def _evict(self, conn, now):
+        conn.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+        entries, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        while entries > self.max_entries or total_bytes > self.max_bytes:
+            row = conn.execute('SELECT key, size FROM results ORDER BY accessed_at LIMIT 1').fetchone()
+            if row is None:
+                break
+            conn.execute('DELETE FROM results WHERE key = ?', (row[0],))
+            entries -= 1
+            total_bytes -= row[1]
+
+
+def create_result_store(url=RESULT_STORE_URL, **kwargs):
+    """
+    إنشاء المخزن حسب الإعداد:
+    memory                         -> MemoryResultStore
+    sqlite:///results.db           -> SQLiteResultStore (مسار نسبي)
+    sqlite:////var/sidq/results.db -> SQLiteResultStore (مسار مطلق)
+    """
+    if url in ('', 'memory', 'memory://'):
+        return MemoryResultStore(**kwargs)
+    if url.startswith('sqlite:///'):
+        return SQLiteResultStore(url[len('sqlite:///'):], **kwargs)
+    raise ValueError(f"نوع مخزن النتائج غير مدعوم: {url}")
@@ -0,0 +1,50 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# =========================================================
+# جدولة مراحل التحليل (PRNU و ELA و CNN) بالتوازي
+# =========================================================
+
+# الحد الأقصى لعدد المراحل المتزامنة في مجمع العمال المشترك
+# (1 = تشغيل متسلسل كما في السابق)
+STAGE_WORKERS = int(os.environ.get('SIDQ_STAGE_WORKERS', '4'))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_stage_executor():
+    """
+    مجمع عمال مشترك بين جميع الطلبات، يُنشأ عند أول استخدام.
+    يُعاد إنشاؤه بعد fork (عمال gunicorn) لأن الخيوط لا تنتقل مع العملية.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix='sidq-stage')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run_stages(stages):
+    """
+    تشغيل مراحل مستقلة في نفس الوقت وإرجاع نتائجها بنفس الترتيب.
+
+    stages: قائمة من (الدالة، المعاملات). تُرسل كل المراحل عدا الأخيرة إلى
+    المجمع المشترك، وتُنفَّذ الأخيرة في خيط الطلب نفسه لتوفير عامل.
+    أي استثناء داخل مرحلة يُعاد رفعه كما لو كانت متسلسلة.
+    كل مرحلة تعمل بنسخة من سياق الطلب (contextvars) حتى يصل إليها تتبع الطلب.
+    """
+    if STAGE_WORKERS <= 1 or len(stages) <= 1:
+        return [func(*args) for func, args in stages]
+
+    executor = get_stage_executor()
+    futures = [executor.submit(contextvars.copy_context().run, func, *args) for func, args in stages[:-1]]
+
+    last_func, last_args = stages[-1]
+    last_result = last_func(*last_args)
+
+    return [future.result() for future in futures] + [last_result]
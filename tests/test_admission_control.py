@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from admission_control import (
+    LEVEL_FULL, LEVEL_NO_CNN, LEVEL_NO_VISUALS, LEVEL_REJECTED, AdmissionController, AdmissionRejected,
+)
+
+
+def _controller(**options):
+    defaults = dict(target_seconds=1.0, capacity=2, max_in_flight=8, rate=0, alpha=0.5, probe_seconds=60)
+    defaults.update(options)
+    return AdmissionController(**defaults)
+
+
+def _hold(controller, count):
+    """count طلبات جارية (تُفتح بالتتابع) لمحاكاة الحمل."""
+    contexts = [controller.admit() for _ in range(count)]
+    levels = [context.__enter__() for context in contexts]
+    return contexts, levels
+
+
+def _release(contexts):
+    for context in contexts:
+        context.__exit__(None, None, None)
+
+
+def test_idle_process_always_admits_full():
+    controller = _controller()
+    controller._latency['full'] = 6.0
+    with controller.admit() as level:
+        assert level == LEVEL_FULL
+
+
+def test_levels_degrade_with_in_flight_work():
+    controller = _controller()
+    controller._latency.update(full=0.9, no_cnn=0.3)
+    contexts, levels = _hold(controller, 4)
+    # الأول في عملية خاملة، ثم يرتفع الزمن المتوقع مع الأعمال الجارية
+    assert levels[0] == LEVEL_FULL
+    assert LEVEL_NO_VISUALS in levels or LEVEL_NO_CNN in levels
+    assert levels[-1] == LEVEL_NO_CNN
+    controller._latency['no_cnn'] = 5.0
+    with pytest.raises(AdmissionRejected) as rejected:
+        with controller.admit():
+            pass
+    assert rejected.value.status_code == 503 and rejected.value.level == LEVEL_REJECTED
+    assert rejected.value.retry_after >= 1
+    _release(contexts)
+
+
+def test_returns_to_full_after_load_drops():
+    # عينة بطيئة واحدة (تحميل النموذج) لا تُبقي الخادم في no_cnn إلى الأبد
+    controller = _controller(probe_seconds=0.2)
+    controller._latency.update(full=6.0, no_cnn=0.2)
+    background, _ = _hold(controller, 1)
+    controller._full_sampled_at = time.monotonic()
+    with controller.admit() as level:
+        assert level == LEVEL_NO_CNN
+    time.sleep(0.25)
+    # تحت السعة وبعد مهلة التجربة: طلب كامل يجدد التقدير
+    probes = []
+    for _ in range(8):
+        with controller.admit() as level:
+            probes.append(level)
+        time.sleep(0.25)
+    assert LEVEL_FULL in probes
+    assert controller._latency['full'] < controller.target_seconds * controller.visuals_at / 2
+    with controller.admit() as level:
+        assert level == LEVEL_FULL
+    _release(background)
+    assert controller.current_level() == LEVEL_FULL
+
+
+def test_token_bucket_limits_each_client():
+    controller = _controller(rate=1.0, burst=2)
+    for _ in range(2):
+        with controller.admit('client-a'):
+            pass
+    with pytest.raises(AdmissionRejected) as rejected:
+        with controller.admit('client-a'):
+            pass
+    assert rejected.value.status_code == 429 and rejected.value.retry_after >= 1
+    with controller.admit('client-b') as level:
+        assert level == LEVEL_FULL
+
+
+def test_submission_without_latency_still_rate_limited():
+    # طابور المهام: الإرسال يمر بحد العميل ولا يُحسب زمناً للتحليل
+    controller = _controller(rate=1.0, burst=1)
+    with controller.admit('client-a', record_latency=False) as level:
+        assert level == LEVEL_FULL
+    assert controller._latency == {}
+    with pytest.raises(AdmissionRejected) as rejected:
+        with controller.admit('client-a', record_latency=False):
+            pass
+    assert rejected.value.status_code == 429
@@ -0,0 +1,52 @@
+from cascade_scoring import CASCADE_ORDER, combine_scores, run_cascade
+
+
+def test_omitted_stage_weights_are_renormalised():
+    # بدون CNN يجب أن تبقى كل القرارات ممكنة من المراحل المنفذة
+    assert combine_scores({'prnu': 90, 'ela': 90, 'copymove': 90}, omitted=('ai',)) == (90.0, 'CLEAN')
+    assert combine_scores({'prnu': 10, 'ela': 30, 'copymove': 20}, omitted=('ai',))[1] == 'FORGED'
+
+
+def test_missing_stage_without_omission_stays_conservative():
+    # مرحلة لم تُنفذ بعد (التقييم المتتالي) تؤخذ بمداها الكامل
+    assert combine_scores({'prnu': 90, 'ela': 90, 'copymove': 90})[1] == 'CAUTION'
+
+
+def test_cascade_treats_absent_stages_as_omitted():
+    results, skipped, _ = run_cascade({'prnu': lambda: (90.0,), 'ela': lambda: (85.0,), 'copymove': lambda: (90.0,)})
+    assert set(results) == {'prnu', 'ela', 'copymove'}
+    assert skipped == []
+
+
+def _stages(prnu, ela, copymove):
+    def cnn():
+        raise AssertionError('CNN stage should have been skipped')
+    return {
+        'ai': cnn, 'prnu': lambda: (prnu,), 'ela': lambda: (ela,), 'copymove': lambda: (copymove,),
+    }
+
+
+def test_cascade_skips_cnn_on_camera_match():
+    assert CASCADE_ORDER[-1] == 'ai'
+    results, skipped, decided = run_cascade(_stages(90.0, 90.0, 90.0))
+    assert skipped == ['ai'] and decided == 'CLEAN'
+    scores = {stage: result[0] for stage, result in results.items()}
+    assert combine_scores(scores, decided=decided) == (90.0, 'CLEAN')
+
+
+def test_cascade_skips_remaining_stages_on_forgery():
+    # منطقة منسوخة مؤكدة تحسم التزوير أياً كانت بقية الدرجات
+    results, skipped, decided = run_cascade(_stages(70.0, 90.0, 20.0))
+    assert skipped == ['ai'] and decided == 'FORGED'
+    scores = {stage: result[0] for stage, result in results.items()}
+    assert combine_scores(scores, decided=decided) == (39.0, 'FORGED')
+
+    _, skipped, decided = run_cascade(_stages(25.0, 30.0, 90.0))
+    assert skipped == ['copymove', 'ai'] and decided == 'FORGED'
+
+
+def test_cascade_runs_cnn_when_undecided():
+    results, skipped, decided = run_cascade({
+        'ai': lambda: (80.0,), 'prnu': lambda: (60.0,), 'ela': lambda: (75.0,), 'copymove': lambda: (50.0,),
+    })
+    assert 'ai' in results and skipped == [] and decided is None
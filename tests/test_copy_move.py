@@ -0,0 +1,67 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from copy_move import detect_copy_move
+
+WIDTH, HEIGHT = 1200, 800
+
+
+def _noisy(img, rnd):
+    arr = np.asarray(img, dtype=np.float32) + rnd.normal(0, 3, (HEIGHT, WIDTH))
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+
+def _jpeg(img, quality=85):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return Image.open(buffer).convert('L')
+
+
+def _document(seed=0, box_rows=0):
+    """مستند نصي بختم دائري، واختيارياً صفوف خانات متكررة (مثل خانات رقم الهوية)."""
+    rnd = np.random.default_rng(seed)
+    img = Image.new('L', (WIDTH, HEIGHT), 235)
+    draw = ImageDraw.Draw(img)
+    for line in range(12):
+        draw.text((40, 40 + line * 30), ' '.join(str(rnd.integers(1e5, 1e6)) for _ in range(8)), fill=20)
+    for row in range(box_rows):
+        for col in range(10):
+            x, y = 100 + col * 60, 450 + row * 70
+            draw.rectangle((x, y, x + 48, y + 50), outline=30, width=3)
+            draw.line((x + 6, y + 40, x + 42, y + 40), fill=90, width=1)
+    draw.ellipse((850, 500, 1050, 700), outline=60, width=6)
+    draw.text((900, 590), 'STAMP', fill=60)
+    return _noisy(img, rnd)
+
+
+def _clone_stamp(img):
+    forged = img.copy()
+    forged.paste(img.crop((850, 500, 1050, 700)), (100, 560))
+    return forged
+
+
+def test_clean_document_has_no_clone():
+    stats, _ = detect_copy_move(_jpeg(_document()))
+    assert stats['shifts'] == []
+    assert stats['cloned_ratio'] == 0.0
+
+
+def test_cloned_stamp_is_detected():
+    stats, mask = detect_copy_move(_jpeg(_clone_stamp(_document())), keep_mask_image=True)
+    assert stats['shifts'][0]['dy'] == 60 and stats['shifts'][0]['dx'] == -750
+    assert stats['cloned_ratio'] >= 0.005
+    assert mask is not None
+
+
+def test_grid_form_is_not_reported_as_clone():
+    # خانات متطابقة بمسافات ثابتة: إزاحة دورية وليست نسخاً
+    stats, _ = detect_copy_move(_jpeg(_document(box_rows=3)))
+    assert stats['shifts'] == []
+    assert stats['cloned_ratio'] == 0.0
+
+
+def test_clone_on_grid_form_is_still_detected():
+    stats, _ = detect_copy_move(_jpeg(_clone_stamp(_document(box_rows=1))))
+    assert [(shift['dy'], shift['dx']) for shift in stats['shifts']] == [(60, -750)]
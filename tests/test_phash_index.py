@@ -0,0 +1,42 @@
+import numpy as np
+
+from phash_index import PHASH_ANALYSIS_LABEL, PHASH_TAIL_MAX, PHashIndex
+
+
+def test_analysis_verdict_does_not_replace_enrolled_template(tmp_path):
+    index = PHashIndex(str(tmp_path / 'phash.db'))
+    image_hash = 0xF0F0_1234_5678_9ABC
+    index.add(image_hash, 'FORGED', label='template.jpg')
+    index.add(image_hash, 'CLEAN', 80.0, label=PHASH_ANALYSIS_LABEL)
+
+    match = index.lookup(image_hash)
+    assert (match['verdict'], match['label']) == ('FORGED', 'template.jpg')
+    # التحديث يبقي الصف نفسه، فلا تتكرر البصمة في الذاكرة
+    assert index._size == 1
+
+    # القالب المعتمد يستبدل الحكم الآلي
+    other_hash = 0x0123_4567_89AB_CDEF
+    index.add(other_hash, 'CLEAN', 80.0, label=PHASH_ANALYSIS_LABEL)
+    index.add(other_hash, 'FORGED', label='template2.jpg')
+    assert index.lookup(other_hash)['verdict'] == 'FORGED'
+    assert index._size == 2
+
+
+def test_near_duplicates_found_after_table_rebuild(tmp_path):
+    index = PHashIndex(str(tmp_path / 'phash.db'))
+    rnd = np.random.default_rng(0)
+    hashes = [int(value) for value in rnd.integers(0, 2**64, PHASH_TAIL_MAX + 500, dtype=np.uint64)]
+    with index._connect() as conn:
+        conn.executemany(
+            'INSERT INTO phashes (hash, verdict, recorded_at) VALUES (?, ?, 0)',
+            [(value - 2**64 if value >= 2**63 else value, 'FORGED') for value in hashes],
+        )
+
+    for stored in hashes[::97]:
+        # تعديل بنصف القطر الكامل (بتات عشوائية من أجزاء مختلفة)
+        bits = rnd.choice(64, index.radius, replace=False)
+        query = stored ^ sum(1 << int(bit) for bit in bits)
+        matches = index.query(query)
+        assert matches and matches[0]['distance'] == index.radius
+    # الاستعلامات مرت بالجداول المرتبة لا بالفحص الخطي
+    assert index._indexed == len(hashes)
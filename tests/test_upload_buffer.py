@@ -0,0 +1,42 @@
+import io
+from tempfile import SpooledTemporaryFile
+
+from werkzeug.formparser import parse_form_data
+from werkzeug.test import EnvironBuilder
+
+from upload_buffer import UPLOAD_MEMORY_MAX, spool_upload, upload_stream_factory
+
+
+def _parse_upload(data):
+    environ = EnvironBuilder(method='POST', data={'image': (io.BytesIO(data), 'a.jpg')}).get_environ()
+    _, _, files = parse_form_data(environ, stream_factory=upload_stream_factory)
+    return files
+
+
+def test_stream_factory_keeps_only_small_known_uploads_in_memory():
+    assert isinstance(upload_stream_factory(1000), io.BytesIO)
+    for total_content_length in (UPLOAD_MEMORY_MAX + 1, None):
+        stream = upload_stream_factory(total_content_length)
+        assert not isinstance(stream, io.BytesIO)
+        assert stream.fileno() >= 0
+        stream.close()
+
+
+def test_views_survive_closing_the_request_files():
+    for data in (b'\xff\xd8' + b'a' * 1000, b'\xff\xd8' + b'b' * (2 * UPLOAD_MEMORY_MAX)):
+        files = _parse_upload(data)
+        view = spool_upload(files['image'])
+        # Werkzeug يغلق ملفات الطلب في نهايته والعرض ما زال مستخدماً
+        for _, file in files.items(multi=True):
+            file.close()
+        assert len(view) == len(data) and view[:4] == data[:4] and view[-1:] == data[-1:]
+        assert bytes(view) == data
+
+
+def test_spooled_upload_is_read_through_public_api():
+    # رفع Starlette: UploadFile.file هو SpooledTemporaryFile
+    stream = SpooledTemporaryFile(max_size=1024 * 1024, mode='rb+')
+    stream.write(b'c' * 5000)
+    view = spool_upload(stream)
+    stream.close()
+    assert bytes(view) == b'c' * 5000
@@ -2,14 +2,21 @@ import tensorflow as tf
 from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense
 from tensorflow.keras.optimizers import Adam 
+import argparse
+import hashlib
 import numpy as np
 import os
 import sys
 
+from model_stamp import MODEL_LABELS, write_model_stamp
+
 # حجم الصورة الذي يتطلبه النموذج (مطابق لـ ai_forensics.py)
 IMG_SIZE = 128
 MODEL_PATH = 'forensics_model.h5'
 
+# امتدادات الصور المقبولة في مجلد التدريب
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
 # =========================================================
 # 1. تعريف النموذج (يجب أن يطابق ما في ai_forensics.py)
 # =========================================================
@@ -39,50 +46,161 @@ def build_forensics_model():
     return model
 
 # =========================================================
-# 2. توليد بيانات وهمية وتدريب سريع
+# 2. خط بيانات التدريب (tf.data): بث الصور من القرص بدلاً من تحميلها كلها
+# =========================================================
+
+def list_labelled_images(data_dir):
+    """
+    مسارات الصور وتسمياتها من مجلد فيه مجلدان فرعيان authentic/ و forged/
+    (بأي عمق داخلهما). التسمية = احتمال التزوير كما يفسره analyze_ai.
+    """
+    paths, labels = [], []
+    for class_name, label in MODEL_LABELS.items():
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            raise FileNotFoundError(f"المجلد {class_dir} غير موجود (المطلوب: {', '.join(MODEL_LABELS)})")
+        for root, _, files in os.walk(class_dir):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, file_name))
+                    labels.append(label)
+    return paths, labels
+
+
+def _load_image(path, label):
+    # نفس تحضير _cnn_input: RGB بحجم IMG_SIZE x IMG_SIZE وقيم بين 0 و 1
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, (IMG_SIZE, IMG_SIZE), method='bicubic', antialias=True)
+    return tf.clip_by_value(image / 255.0, 0.0, 1.0), label
+
+
+def _augment(image, label):
+    # تحويلات لا تغيّر آثار الضغط أو الضوضاء على مستوى البكسل (انعكاس ودوران 90 درجة)
+    image = tf.image.random_flip_left_right(image)
+    image = tf.image.rot90(image, k=tf.random.uniform((), 0, 4, dtype=tf.int32))
+    return image, label
+
+
+def make_dataset(paths, labels, batch_size, cache_dir=None, name='train', augment=False, shuffle=False):
+    """
+    خط بيانات متوازٍ: قراءة وفك ترميز وتحجيم الصور على كل الأنوية (AUTOTUNE)،
+    ثم ذاكرة مؤقتة على القرص للصور المحضّرة (قبل التحويلات العشوائية)،
+    ثم الخلط والتجميع والجلب المسبق بالتوازي مع التدريب.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((paths, np.asarray(labels, dtype=np.float32)))
+    dataset = dataset.map(_load_image, num_parallel_calls=tf.data.AUTOTUNE).ignore_errors(log_warning=True)
+
+    if cache_dir:
+        # اسم الملف يتضمن بصمة قائمة الملفات وحجم المدخل، فلا تُستخدم ذاكرة قديمة
+        digest = hashlib.sha256('\n'.join([str(IMG_SIZE)] + list(paths)).encode('utf-8')).hexdigest()[:16]
+        os.makedirs(cache_dir, exist_ok=True)
+        dataset = dataset.cache(os.path.join(cache_dir, f'{name}-{digest}'))
+
+    if shuffle:
+        dataset = dataset.shuffle(min(len(paths), 2048), reshuffle_each_iteration=True)
+    if augment:
+        dataset = dataset.map(_augment, num_parallel_calls=tf.data.AUTOTUNE)
+
+    options = tf.data.Options()
+    # ترتيب الإخراج غير مهم للتدريب؛ يسمح باستهلاك أول عنصر جاهز من أي نواة
+    options.deterministic = False
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE).with_options(options)
+
+
+def split_dataset(paths, labels, validation_split, seed=42):
+    """تقسيم ثابت (بنفس البذرة) إلى تدريب وتحقق."""
+    order = np.random.default_rng(seed).permutation(len(paths))
+    n_validation = int(len(paths) * validation_split)
+    pick = lambda idx: ([paths[i] for i in idx], [labels[i] for i in idx])
+    return pick(order[n_validation:]), pick(order[:n_validation])
+
+
+def train_on_directory(model, args):
+    paths, labels = list_labelled_images(args.data_dir)
+    if not paths:
+        raise ValueError(f"لا توجد صور في {args.data_dir}")
+    (train_paths, train_labels), (val_paths, val_labels) = split_dataset(paths, labels, args.validation_split)
+    print(f"صور التدريب: {len(train_paths)}، صور التحقق: {len(val_paths)} "
+          f"(مزورة: {int(sum(labels))} من {len(labels)})")
+
+    train_ds = make_dataset(train_paths, train_labels, args.batch_size, args.cache_dir, 'train',
+                            augment=not args.no_augment, shuffle=True)
+    val_ds = make_dataset(val_paths, val_labels, args.batch_size, args.cache_dir, 'validation') if val_paths else None
+
+    history = model.fit(train_ds, validation_data=val_ds, epochs=args.epochs, verbose=2)
+    return {
+        'mode': 'directory',
+        'data_dir': os.path.abspath(args.data_dir),
+        'samples': {'train': len(train_paths), 'validation': len(val_paths)},
+        'epochs': args.epochs,
+        'metrics': {k: float(v[-1]) for k, v in history.history.items()},
+    }
+
+
+def train_mock(model):
+    # توليد بيانات وهمية بسيطة (100 صورة)
+    # 100 صورة، بحجم 128x128، وثلاث قنوات لونية (RGB)
+    X_mock = np.random.rand(100, IMG_SIZE, IMG_SIZE, 3).astype('float32')
+    y_mock = np.random.randint(0, 2, 100) # تسميات وهمية: 0 أو 1
+
+    # تدريب سريع جداً (epoch واحد فقط) لحفظ الأوزان
+    # هذه الخطوة لا تهدف إلى تدريب النموذج فعلياً، بل لتوليد ملف الأوزان.
+    print("تدريب سريع (1 Epoch) لتوليد ملف الأوزان...")
+    model.fit(X_mock, y_mock, epochs=1, batch_size=32, verbose=0)
+    return {'mode': 'mock', 'samples': {'train': 100, 'validation': 0}, 'epochs': 1}
+
+
+# =========================================================
+# 3. التدريب والحفظ
 # =========================================================
 
 if __name__ == '__main__':
-    print("بدء عملية توليد وتدريب النموذج الوهمي...")
+    parser = argparse.ArgumentParser(description='تدريب نموذج Sidq وحفظه مع بصمة الإصدار')
+    parser.add_argument('--data-dir', help='مجلد فيه authentic/ و forged/ (بدونه: نموذج وهمي)')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--validation-split', type=float, default=0.1)
+    parser.add_argument('--cache-dir', help='ذاكرة مؤقتة على القرص للصور المحضّرة (تسرّع الدورات التالية)')
+    parser.add_argument('--no-augment', action='store_true', help='بدون انعكاس/دوران عشوائي')
+    parser.add_argument('--output', default=MODEL_PATH)
+    args = parser.parse_args()
+
+    if args.data_dir:
+        print(f"بدء التدريب من المجلد {args.data_dir}...")
+    else:
+        print("بدء عملية توليد وتدريب النموذج الوهمي...")
     
     # ⚠️ تحقق من أن TensorFlow يعمل بشكل صحيح
     try:
         if tf.config.list_physical_devices('GPU'):
             print("TensorFlow يستخدم معالج الرسوميات (GPU).")
         else:
-            print("TensorFlow يستخدم المعالج المركزي (CPU).")
+            print(f"TensorFlow يستخدم المعالج المركزي (CPU، {os.cpu_count()} أنوية).")
     except Exception:
         print("تحذير: فشل التحقق من إعدادات TensorFlow.")
-        
-    # توليد بيانات وهمية بسيطة (100 صورة)
-    # 100 صورة، بحجم 128x128، وثلاث قنوات لونية (RGB)
-    X_mock = np.random.rand(100, IMG_SIZE, IMG_SIZE, 3).astype('float32')
-    y_mock = np.random.randint(0, 2, 100) # تسميات وهمية: 0 أو 1
 
     # بناء النموذج
     model = build_forensics_model()
 
-    # تدريب سريع جداً (epoch واحد فقط) لحفظ الأوزان
-    # هذه الخطوة لا تهدف إلى تدريب النموذج فعلياً، بل لتوليد ملف الأوزان.
-    print("تدريب سريع (1 Epoch) لتوليد ملف الأوزان...")
     try:
-        model.fit(X_mock, y_mock, epochs=1, batch_size=32, verbose=0)
+        training_info = train_on_directory(model, args) if args.data_dir else train_mock(model)
     except Exception as e:
-        print(f"❌ فشل التدريب السريع. قد تكون لديك مشكلة في تثبيت NumPy/TensorFlow: {e}")
+        print(f"❌ فشل التدريب. قد تكون لديك مشكلة في البيانات أو تثبيت NumPy/TensorFlow: {e}")
         sys.exit(1)
 
     # =========================================================
-    # 3. حفظ النموذج (لتوليد الملف المفقود)
+    # 4. حفظ النموذج وبصمة إصداره (يتحقق منها ai_forensics عند التحميل)
     # =========================================================
     try:
-        model.save(MODEL_PATH)
+        model.save(args.output)
         
         # التأكد من حفظ الملف
-        if os.path.exists(MODEL_PATH):
-            print(f"✅ نجاح: تم حفظ نموذج وهمي بنجاح باسم: {MODEL_PATH}")
+        if os.path.exists(args.output):
+            write_model_stamp(args.output, IMG_SIZE, tensorflow=tf.__version__, **training_info)
+            print(f"✅ نجاح: تم حفظ النموذج باسم: {args.output} (مع بصمة الإصدار)")
             print("\nالآن يمكنك تشغيل خادم Flask بأمان.")
         else:
-            print(f"❌ فشل: لم يتم العثور على الملف {MODEL_PATH} بعد عملية الحفظ.")
+            print(f"❌ فشل: لم يتم العثور على الملف {args.output} بعد عملية الحفظ.")
             
     except Exception as e:
-        print(f"❌ فشل حفظ النموذج: {e}")
\ No newline at end of file
+        print(f"❌ فشل حفظ النموذج: {e}")
@@ -0,0 +1,115 @@
+import io
+import mmap
+import os
+from tempfile import SpooledTemporaryFile, TemporaryFile
+
+# =========================================================
+# استقبال الملفات المرفوعة بدون نسخ (Zero-copy ingestion)
+#
+# Werkzeug يكتب الملف المرفوع مرة واحدة في دفق من upload_stream_factory. بدلاً من
+# file.read() ثم io.BytesIO (نسختان من الملف) نربط الملف المؤقت بالذاكرة (mmap)
+# ونمرر للمحللات عرضاً للقراءة فقط (memoryview) يشير إلى نفس الصفحات.
+# =========================================================
+
+# الطلبات الأصغر من هذا الحد تُستقبل في الذاكرة (نفس حد Werkzeug الافتراضي)
+UPLOAD_MEMORY_MAX = 500 * 1024
+
+
+def upload_stream_factory(total_content_length, content_type=None, filename=None, content_length=None):
+    """
+    دفق الملف المرفوع (بتوقيع stream_factory في Werkzeug): BytesIO للطلب الصغير معلوم
+    الحجم، وإلا ملف مؤقت حقيقي يمكن ربطه بالذاكرة. بدلاً من SpooledTemporaryFile الافتراضي
+    الذي لا يكشف بواجهته العامة أين انتهت البيانات (fileno() ينقلها إلى القرص).
+    """
+    if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_MAX:
+        return io.BytesIO()
+    return TemporaryFile('rb+')
+
+
+def spool_upload(file_storage):
+    """
+    محتوى الملف المرفوع كـ memoryview للقراءة فقط بدون نسخه.
+
+    الملف الصغير في BytesIO يُعرض كائن bytes الداخلي (getvalue لا ينسخ في CPython ولا يصدّر
+    عرضاً، فإغلاق Werkzeug للملف في نهاية الطلب لا يرفع BufferError). الملف المؤقت على القرص
+    يُربط بالذاكرة (mmap) فيبقى صالحاً بعد إغلاقه، وتُحرَّر صفحاته وواصف الملف عند تحرير آخر
+    مرجع للعرض. SpooledTemporaryFile (رفع Starlette) يُقرأ نسخةً: حجمه محدود بحد الطلب
+    وfileno() كان سينقله إلى القرص. العرض مخصص لمدة الطلب: المخزن طويل العمر يحفظ نسخة
+    bytes (انظر ArtefactCache).
+    """
+    stream = getattr(file_storage, 'stream', file_storage)
+    if isinstance(stream, io.BytesIO):
+        return memoryview(stream.getvalue())
+    if isinstance(stream, SpooledTemporaryFile):
+        stream.seek(0)
+        return memoryview(stream.read())
+
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        fileno = None
+
+    if fileno is not None:
+        stream.flush()
+        if os.fstat(fileno).st_size == 0:
+            # mmap لا يقبل ملفاً فارغاً
+            return memoryview(b'')
+        return memoryview(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ))
+    stream.seek(0)
+    return memoryview(stream.read()).toreadonly()
+
+
+class BufferReader(io.RawIOBase):
+    """
+    دفق للقراءة فقط فوق مخزن (bytes أو memoryview أو mmap) بدون نسخه،
+    بموضع مستقل لكل قارئ (عدة خيوط تفتح نفس الأصل بالتوازي).
+    بديل io.BytesIO(buffer) الذي ينسخ أي مخزن ليس bytes.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def __len__(self):
+        return len(self._view)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f'whence غير صالح: {whence}')
+        if pos < 0:
+            raise ValueError('موضع سالب')
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        # نسخة واحدة لكل قطعة مقروءة فقط (بدلاً من bytearray ثم bytes في RawIOBase)
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        if end <= self._pos:
+            return b''
+        data = self._view[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    readall = read
+
+    def readinto(self, buffer):
+        target = memoryview(buffer).cast('B')
+        count = max(0, min(len(target), len(self._view) - self._pos))
+        target[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count